@@ -3,6 +3,10 @@ from flask import Flask, send_from_directory
 from flask_cors import CORS
 from .extensions import db, migrate, jwt_manager
 from .api import api
+from .commands import import_cli, jobs_cli, perf_cli, reports_cli, stock_cli
+from .health import health_bp
+from .metrics import metrics_bp
+from . import compression, instrumentation, pool
 from datetime import timedelta
 
 def create_app(config_name='production'):
@@ -12,11 +16,21 @@ def create_app(config_name='production'):
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
     app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 
-    CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
-    db.init_app(app)
+    CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True,
+         expose_headers=['X-Next-Cursor', 'Link', 'Content-Disposition', 'ETag'])
+    pool.init_app(app)
     migrate.init_app(app, db)
     jwt_manager.init_app(app)
     api.init_app(app)
+    instrumentation.init_app(app, api)
+    compression.init_app(app)
+    app.register_blueprint(health_bp)
+    app.register_blueprint(metrics_bp)
+    app.cli.add_command(stock_cli)
+    app.cli.add_command(perf_cli)
+    app.cli.add_command(import_cli)
+    app.cli.add_command(reports_cli)
+    app.cli.add_command(jobs_cli)
 
     @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>')
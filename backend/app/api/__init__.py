@@ -10,6 +10,8 @@ from .outgoing_invoice import api as outgoing_invoice_api
 from .user import auth_ns as user_api
 from .operation import api as operation_api
 from .contract import api as contract_api
+from .report import api as report_api
+from .job import api as job_api
 
 authorizations = {
     'Bearer Auth': {
@@ -40,4 +42,6 @@ api.add_namespace(operation_api, path='/api/operations')
 api.add_namespace(contract_api, path='/api/contracts')
 api.add_namespace(incoming_invoice_api, path='/api/incoming-invoices')
 api.add_namespace(outgoing_invoice_api, path='/api/outgoing-invoices')
+api.add_namespace(report_api, path='/api/reports')
+api.add_namespace(job_api, path='/api/jobs')
 api.add_namespace(user_api, path='/api/user')
\ No newline at end of file
@@ -0,0 +1,75 @@
+import json
+
+from flask import current_app, request
+from flask_restx import abort, fields, reqparse
+
+from app.extensions import db
+from app.services import csv_import, invoice_import
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+
+bulk_parser = reqparse.RequestParser()
+bulk_parser.add_argument('batch_size', type=int, location='args',
+                         help='Number of invoices committed per transaction')
+
+csv_import_parser = reqparse.RequestParser()
+csv_import_parser.add_argument('batch_size', type=int, location='args',
+                               help='Number of rows merged per transaction')
+
+
+def batch_size(args):
+    size = args.get('batch_size') or current_app.config['BULK_IMPORT_BATCH_SIZE']
+    return max(1, min(size, current_app.config['BULK_IMPORT_MAX_BATCH_SIZE']))
+
+
+def read_bulk_payload():
+    '''A JSON array body, or an NDJSON body with one invoice per line.
+
+    NDJSON is parsed lazily from the request stream, one line at a time, so
+    the import only ever holds the batch it is writing.  A line that is not
+    valid JSON is rejected like an invalid invoice.
+    '''
+    if request.mimetype in NDJSON_MIMETYPES:
+        return ndjson_payloads(request.stream)
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, list):
+        abort(400, 'Expected a JSON array of invoices or an application/x-ndjson body')
+    return payload
+
+
+def ndjson_payloads(stream):
+    for number, raw in enumerate(stream, start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            yield json.loads(raw)
+        except ValueError:
+            yield invoice_import.PayloadError(f'Invalid JSON on line {number}')
+
+
+def import_report_model(api, name):
+    error_model = api.model(f'{name}ImportError', {
+        'line': fields.Integer(description='Line of the rejected row in the CSV file'),
+        'error': fields.String(description='Why the row was rejected'),
+    })
+    return api.model(f'{name}ImportReport', {
+        'inserted': fields.Integer(),
+        'updated': fields.Integer(),
+        'rejected': fields.Integer(),
+        'errors': fields.List(fields.Nested(error_model),
+                              description=f'The first {csv_import.MAX_REPORTED_ERRORS} rejected rows'),
+    })
+
+
+def import_csv_upload(api, entity):
+    '''Import the uploaded CSV: the ``file`` part of a multipart form, or the raw (optionally gzipped) body.'''
+    args = csv_import_parser.parse_args()
+    size = args.get('batch_size') or current_app.config['CSV_IMPORT_BATCH_SIZE']
+    upload = request.files.get('file')
+    try:
+        return csv_import.import_csv(entity, upload.stream if upload else request.stream, max(1, size))
+    except csv_import.CsvImportError as e:
+        db.session.rollback()
+        api.abort(400, str(e))
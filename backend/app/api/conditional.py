@@ -0,0 +1,72 @@
+import hashlib
+from functools import wraps
+
+from flask import make_response, request
+from flask_restx.utils import unpack
+
+from app.compression import ETAG_SUFFIXES
+from app.services import table_versions
+
+
+def entity_tag(table_name, version):
+    '''Strong ETag of the current request at ``version`` of ``table_name``.
+
+    The path, query string and ``X-Fields`` mask are hashed in, so each page,
+    filter and item has its own tag.
+    '''
+    query = '&'.join(sorted(request.query_string.decode('latin-1').split('&')))
+    digest = hashlib.sha1(
+        f'{request.path}?{query}|{request.headers.get("X-Fields", "")}'.encode()
+    ).hexdigest()[:16]
+    return f'{table_name}-{version}-{digest}'
+
+
+def not_modified(etag, updated_at):
+    '''The validator the client already holds, or ``None`` when it needs the body.
+
+    A compressed response carried the tag with an encoding suffix, so those
+    variants match as well.
+    '''
+    if request.if_none_match:
+        for candidate in [etag] + [etag + suffix for suffix in ETAG_SUFFIXES.values()]:
+            if request.if_none_match.contains(candidate):
+                return candidate
+        return None
+    if request.if_modified_since and updated_at:
+        if updated_at.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None):
+            return etag
+    return None
+
+
+def validator_headers(etag, updated_at):
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if updated_at:
+        headers['Last-Modified'] = updated_at.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    return headers
+
+
+def conditional(table_name):
+    '''Answer GETs of ``table_name`` data with validators and ``304 Not Modified``.
+
+    Put it above ``marshal_with``: a matching ``If-None-Match`` (or
+    ``If-Modified-Since``) is answered after one primary-key lookup of the
+    table version, without running the resource or marshalling rows.
+    '''
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            version, updated_at = table_versions.current(table_name)
+            etag = entity_tag(table_name, version)
+            headers = validator_headers(etag, updated_at)
+            matched = not_modified(etag, updated_at)
+            if matched:
+                response = make_response('', 304)
+                response.headers.update(validator_headers(matched, updated_at))
+                return response
+
+            data, code, result_headers = unpack(method(*args, **kwargs))
+            if code == 200:
+                result_headers = dict(result_headers or {}, **headers)
+            return data, code, result_headers
+        return wrapper
+    return decorator
@@ -1,6 +1,9 @@
 from flask_restx import Namespace, Resource, fields
 from app.models import Contract
 from app.extensions import db
+from app.services import reference_cache
+from .conditional import conditional
+from .pagination import keyset_page, pagination_parser
 
 api = Namespace('contracts', description='Operations related to contracts')
 
@@ -12,9 +15,14 @@ contract_model = api.model('Contract', {
 @api.route('/')
 class ContractList(Resource):
     @api.doc('list_contracts')
+    @api.expect(pagination_parser)
+    @conditional('contract')
     @api.marshal_list_with(contract_model)
     def get(self):
-        return Contract.query.all()
+        args = pagination_parser.parse_args()
+        contracts, headers = reference_cache.page(
+            Contract, lambda: keyset_page(Contract.query, [Contract.contract_id], args))
+        return contracts, 200, headers
 
     @api.doc('create_contract')
     @api.expect(contract_model)
@@ -32,9 +40,10 @@ class ContractList(Resource):
 @api.response(404, 'Contract not found')
 class ContractItem(Resource):
     @api.doc('get_contract')
+    @conditional('contract')
     @api.marshal_with(contract_model)
     def get(self, id):
-        return Contract.query.get_or_404(id)
+        return reference_cache.get_or_404(Contract, id)
 
     @api.doc('delete_contract')
     @api.response(204, 'Contract deleted')
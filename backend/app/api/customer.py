@@ -1,6 +1,9 @@
 from flask_restx import Namespace, Resource, fields
 from app.models import Customer
 from app.extensions import db
+from .bulk import csv_import_parser, import_csv_upload, import_report_model
+from .conditional import conditional
+from .pagination import keyset_page, pagination_parser
 
 api = Namespace('customers', description='Customer operations')
 
@@ -11,12 +14,18 @@ customer_model = api.model('Customer', {
     'address': fields.String(),
 })
 
+customer_import_report_model = import_report_model(api, 'Customer')
+
 @api.route('/')
 class CustomerList(Resource):
     @api.doc('list_customers')
+    @api.expect(pagination_parser)
+    @conditional('customer')
     @api.marshal_list_with(customer_model)
     def get(self):
-        return Customer.query.all()
+        args = pagination_parser.parse_args()
+        customers, headers = keyset_page(Customer.query, [Customer.customer_id], args)
+        return customers, 200, headers
 
     @api.doc('create_customer')
     @api.expect(customer_model)
@@ -31,11 +40,22 @@ class CustomerList(Resource):
         db.session.commit()
         return new_customer, 201
 
+@api.route('/import')
+class CustomerImport(Resource):
+    @api.doc('import_customers', description='CSV columns: name; optional contact_info and address. '
+             'Rows are matched on name; existing customers are updated.')
+    @api.expect(csv_import_parser)
+    @api.marshal_with(customer_import_report_model)
+    def post(self):
+        '''Create or update customers from a CSV upload (text/csv, gzip or multipart ``file``)'''
+        return import_csv_upload(api, 'customers')
+
 @api.route('/<int:id>')
 @api.param('id', 'The customer identifier')
 @api.response(404, 'Customer not found')
 class CustomerItem(Resource):
     @api.doc('get_customer')
+    @conditional('customer')
     @api.marshal_with(customer_model)
     def get(self, id):
         return Customer.query.get_or_404(id)
\ No newline at end of file
@@ -1,6 +1,9 @@
 from flask_restx import Namespace, Resource, fields
 from app.models import Employee
 from app.extensions import db
+from app.services import reference_cache
+from .conditional import conditional
+from .pagination import keyset_page, pagination_parser
 
 api = Namespace('employees', description='Employee operations')
 
@@ -15,9 +18,14 @@ employee_model = api.model('Employee', {
 @api.route('/')
 class EmployeeList(Resource):
     @api.doc('list_employees')
+    @api.expect(pagination_parser)
+    @conditional('employee')
     @api.marshal_list_with(employee_model)
     def get(self):
-        return Employee.query.all()
+        args = pagination_parser.parse_args()
+        employees, headers = reference_cache.page(
+            Employee, lambda: keyset_page(Employee.query, [Employee.employee_id], args))
+        return employees, 200, headers
 
     @api.doc('create_employee')
     @api.expect(employee_model)
@@ -37,6 +45,7 @@ class EmployeeList(Resource):
 @api.response(404, 'Employee not found')
 class EmployeeItem(Resource):
     @api.doc('get_employee')
+    @conditional('employee')
     @api.marshal_with(employee_model)
     def get(self, id):
-        return Employee.query.get_or_404(id)
\ No newline at end of file
+        return reference_cache.get_or_404(Employee, id)
\ No newline at end of file
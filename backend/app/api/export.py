@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Response, current_app, stream_with_context
+from flask_restx import inputs, reqparse
+from sqlalchemy import select
+
+from app.extensions import db
+from .pagination import filter_date_range
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+export_parser = reqparse.RequestParser()
+export_parser.add_argument('format', type=str, location='args', default='csv', choices=tuple(EXPORT_FORMATS),
+                           help='csv (default) or ndjson')
+export_parser.add_argument('date_from', type=inputs.date, location='args',
+                           help='Only invoices dated on or after this day (YYYY-MM-DD)')
+export_parser.add_argument('date_to', type=inputs.date, location='args',
+                           help='Only invoices dated on or before this day (YYYY-MM-DD)')
+export_parser.add_argument('storage_id', type=int, location='args',
+                           help='Only invoices for this storage')
+
+
+def item_export_statement(invoice_model, item_model, id_column, foreign_key, args):
+    '''One row per invoice line, joined with its invoice header, in invoice order.'''
+    columns = list(invoice_model.__table__.c) + [
+        column for column in item_model.__table__.c if column.name != foreign_key.name
+    ]
+    statement = select(*columns).join_from(invoice_model, item_model, foreign_key == id_column)
+    statement = filter_date_range(statement, invoice_model.date, args)
+    if args.get('storage_id'):
+        statement = statement.where(invoice_model.storage_id == args['storage_id'])
+    return statement.order_by(invoice_model.date, id_column, list(item_model.__table__.primary_key)[0])
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def csv_chunks(columns, partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for rows in partitions:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(columns, partitions):
+    for rows in partitions:
+        yield ''.join(
+            json.dumps(dict(zip(columns, map(json_value, row))), separators=(',', ':')) + '\n' for row in rows
+        )
+
+
+def stream_export(statement, filename, export_format):
+    '''Stream the rows of ``statement`` as a CSV or NDJSON download.
+
+    Rows come from a server-side cursor ``EXPORT_BATCH_SIZE`` at a time and
+    each batch is written out before the next one is fetched, so the worker
+    holds one batch in memory however large the export is.  The CSV header
+    goes out before the query runs.
+    '''
+    columns = [column.name for column in statement.selected_columns]
+    chunks = csv_chunks if export_format == 'csv' else ndjson_chunks
+
+    def generate():
+        if export_format == 'csv':
+            yield csv_line(columns)
+        result = db.session.execute(
+            statement.execution_options(yield_per=current_app.config['EXPORT_BATCH_SIZE'])
+        )
+        try:
+            yield from chunks(columns, result.partitions())
+        finally:
+            result.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}.{export_format}'},
+    )
@@ -0,0 +1,101 @@
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app, request
+from flask_restx import fields
+from sqlalchemy import Integer, String
+
+from app.extensions import db
+from app.instrumentation import timed_marshal
+
+
+def enabled():
+    '''Whether list endpoints may skip ORM hydration and ``marshal`` for this request.
+
+    ``X-Fields`` masks are only applied by ``marshal``, so a masked request
+    takes the regular path.
+    '''
+    return current_app.config['FAST_LIST_SERIALIZATION'] and 'X-Fields' not in request.headers
+
+
+def iso8601(value):
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return value.isoformat()
+
+
+def value_format(field, column):
+    '''Function formatting a non-null value of ``column`` like ``field.format``, or ``None`` to keep it as is.'''
+    field_type = type(field)
+    if field_type is fields.Float:
+        return float
+    if field_type is fields.Integer:
+        return None if isinstance(column.type, Integer) else int
+    if field_type is fields.String:
+        return None if isinstance(column.type, String) else str
+    if field_type is fields.DateTime and field.dt_format == 'iso8601':
+        return iso8601
+    raise TypeError(f'No fast path for {field_type.__name__} field')
+
+
+class Rows:
+    '''Select the columns behind a flask-restx ``model`` and format them the way ``marshal`` would.
+
+    Fields are matched with the columns of ``entity``'s table by name; a
+    field without a column gets the value ``marshal`` gives a missing
+    attribute.  ``items`` is ``(field name, item model, foreign key)`` for a
+    nested list of child rows, loaded with one extra query per page.
+    '''
+
+    def __init__(self, model, entity, items=None):
+        table = entity.__table__
+        self.columns = []
+        self.steps = []
+        self.items = None
+        for name, field in model.items():
+            if field.attribute is not None or field.mask is not None or callable(field.default):
+                raise TypeError(f'No fast path for field {name}')
+            if items and name == items[0]:
+                item_model, foreign_key = items[1:]
+                self.items = (name, Rows(item_model, foreign_key.class_), foreign_key)
+                self.steps.append((name, None, None, None))
+            elif name in table.c:
+                self.steps.append((name, len(self.columns), value_format(field, table.c[name]),
+                                   field.output(name, {})))
+                self.columns.append(table.c[name])
+            elif isinstance(field, (fields.List, fields.Nested)):
+                raise TypeError(f'No fast path for field {name}')
+            else:
+                self.steps.append((name, None, None, field.output(name, {})))
+        self.primary_key = table.primary_key.columns[0]
+
+    def query(self, *extra):
+        '''Legacy query over the model's columns, ready for ``filter_date_range`` and ``keyset_page``.'''
+        return db.session.query(*self.columns, *extra)
+
+    def format(self, row):
+        data = {}
+        for name, index, format, missing in self.steps:
+            value = None if index is None else row[index]
+            if value is None:
+                data[name] = missing
+            else:
+                data[name] = format(value) if format else value
+        return data
+
+    @timed_marshal
+    def marshal(self, rows):
+        '''The JSON-ready list ``marshal(objects, model)`` returns for the objects behind ``rows``.'''
+        data = [self.format(row) for row in rows]
+        if self.items and data:
+            name, item_rows, foreign_key = self.items
+            children = defaultdict(list)
+            key = self.columns.index(self.primary_key)
+            ids = [row[key] for row in rows]
+            for start in range(0, len(ids), 500):
+                query = item_rows.query(foreign_key).filter(foreign_key.in_(ids[start:start + 500]))
+                for item in query.order_by(item_rows.primary_key):
+                    children[item[-1]].append(item_rows.format(item))
+            for id, invoice in zip(ids, data):
+                invoice[name] = children[id]
+        return data
@@ -1,11 +1,15 @@
-from datetime import datetime
-import decimal
+from datetime import datetime, timedelta
 from flask import request
-from flask_restx import Namespace, Resource, fields
-from sqlalchemy import func
-from app.models import IncomingInvoice, IncomingInvoiceItem, Product, Storage
+from flask_restx import Namespace, Resource, fields, marshal
+from sqlalchemy.orm import noload
+from app.models import IncomingInvoice, IncomingInvoiceItem, Product
 from app.extensions import db
-from decimal import Decimal
+from app.services import invoice_import, invoices, ledger
+from app.services.numbering import allocator
+from . import fast_list
+from .bulk import batch_size, bulk_parser, read_bulk_payload
+from .export import EXPORT_FORMATS, export_parser, item_export_statement, stream_export
+from .pagination import date_range_parser, filter_date_range, keyset_page
 
 api = Namespace('incoming_invoices', description='Incoming Invoice operations')
 
@@ -22,7 +26,7 @@ incoming_invoice_item_model = api.model('IncomingInvoiceItem', {
     'account_number': fields.String()
 })
 
-incoming_invoice_model = api.model('IncomingInvoice', {
+incoming_invoice_header_model = api.model('IncomingInvoiceHeader', {
     'incoming_invoice_id': fields.Integer(readonly=True),
     'number': fields.String(readonly=True),
     'date': fields.DateTime(required=True),
@@ -33,6 +37,13 @@ incoming_invoice_model = api.model('IncomingInvoice', {
     'storage_id': fields.Integer(required=True),
     'responsible_person_id': fields.Integer(required=True),
     'comment': fields.String(),
+    'total_amount': fields.Float(readonly=True, description='Sum of the lines total_price'),
+    'vat_total': fields.Float(readonly=True, description='Sum of the lines vat_amount'),
+    'discount_total': fields.Float(readonly=True, description='Amount taken off by line discounts'),
+    'line_count': fields.Integer(readonly=True, description='Number of invoice lines'),
+})
+
+incoming_invoice_model = api.clone('IncomingInvoice', incoming_invoice_header_model, {
     'items': fields.List(fields.Nested(incoming_invoice_item_model))
 })
 
@@ -47,74 +58,93 @@ product_model = api.model('Product', {
     'storage_id': fields.Integer(description='The storage identifier')
 })
 
+incoming_invoice_rows = fast_list.Rows(incoming_invoice_model, IncomingInvoice,
+                                   items=('items', incoming_invoice_item_model, IncomingInvoiceItem.incoming_invoice_id))
+incoming_invoice_header_rows = fast_list.Rows(incoming_invoice_header_model, IncomingInvoice)
+
+incoming_bulk_result_model = api.model('IncomingInvoiceBulkResult', {
+    'index': fields.Integer(description='Position of the invoice in the submitted batch'),
+    'id': fields.Integer(description='Identifier of the created invoice'),
+    'number': fields.String(),
+    'error': fields.String(description='Why the invoice was not created'),
+})
+
+incoming_bulk_report_model = api.model('IncomingInvoiceBulkReport', {
+    'created': fields.Integer(),
+    'rejected': fields.Integer(),
+    'results': fields.List(fields.Nested(incoming_bulk_result_model, skip_none=True)),
+})
+
+incoming_invoice_list_parser = date_range_parser.copy()
+incoming_invoice_list_parser.add_argument('supplier_id', type=int, location='args',
+                                          help='Only invoices from this supplier (counter_agent_id)')
+incoming_invoice_list_parser.add_argument('include', type=str, location='args', default='items',
+                                          help='Pass include=items (default) to embed invoice lines, '
+                                               'or an empty include= for headers only')
+
 @api.route('/')
 class IncomingInvoiceList(Resource):
     @api.doc('list_incoming_invoices')
-    @api.marshal_list_with(incoming_invoice_model)
+    @api.expect(incoming_invoice_list_parser)
+    @api.response(200, 'Success', [incoming_invoice_model])
     def get(self):
-        return IncomingInvoice.query.all()
+        args = incoming_invoice_list_parser.parse_args()
+        include_items = 'items' in (args.get('include') or '').split(',')
+        rows = incoming_invoice_rows if include_items else incoming_invoice_header_rows
+        fast = fast_list.enabled()
+        if fast:
+            query = rows.query()
+        else:
+            query = IncomingInvoice.query
+            if not include_items:
+                query = query.options(noload(IncomingInvoice.items))
+        query = filter_date_range(query, IncomingInvoice.date, args)
+        if args.get('storage_id'):
+            query = query.filter(IncomingInvoice.storage_id == args['storage_id'])
+        if args.get('supplier_id'):
+            query = query.filter(IncomingInvoice.counter_agent_id == args['supplier_id'])
+        invoices, headers = keyset_page(
+            query, [IncomingInvoice.date, IncomingInvoice.incoming_invoice_id], args, descending=True
+        )
+        if fast:
+            return rows.marshal(invoices), 200, headers
+        model = incoming_invoice_model if include_items else incoming_invoice_header_model
+        return marshal(invoices, model, mask=request.headers.get('X-Fields')), 200, headers
 
     @api.doc('create_incoming_invoice')
     @api.expect(incoming_invoice_model)
     @api.marshal_with(incoming_invoice_model, code=201)
     def post(self):
-        data = api.payload
-
-        last_invoice = IncomingInvoice.query.order_by(IncomingInvoice.incoming_invoice_id.desc()).first()
-        new_id = (last_invoice.incoming_invoice_id if last_invoice else 0) + 1
-        new_number = f"inv{new_id:03}"
-
-        new_invoice = IncomingInvoice(
-            number=new_number,
-            date=data['date'],
-            counter_agent_id=data['counter_agent_id'],
-            operation_id=data['operation_id'],
-            contract_id=data['contract_id'],
-            organization_id=data['organization_id'],
-            storage_id=data['storage_id'],
-            responsible_person_id=data['responsible_person_id'],
-            comment=data.get('comment')
-        )
-        db.session.add(new_invoice)
-        db.session.flush()
-
-        for item_data in data.get('items', []):
-            product = Product.query.filter_by(name=item_data['product_name']).first()
-            quantity_decimal = Decimal(item_data['quantity'])
-
-            if not product:
-                product = Product(
-                    name=item_data['product_name'],
-                    unit_price=Decimal(item_data['unit_price']),
-                    unit_of_measure=item_data['unit_of_measure'],
-                    current_stock=quantity_decimal,
-                    date=new_invoice.date,
-                    storage_id=new_invoice.storage_id
-                )
-                db.session.add(product)
-            else:
-                product.current_stock += quantity_decimal
-                product.date = new_invoice.date
-                product.storage_id = new_invoice.storage_id
-
-            new_item = IncomingInvoiceItem(
-                incoming_invoice_id=new_invoice.incoming_invoice_id,
-                product_name=item_data['product_name'],
-                product_description=item_data.get('product_description'),
-                quantity=quantity_decimal,
-                unit_of_measure=item_data['unit_of_measure'],
-                unit_price=Decimal(item_data['unit_price']),
-                total_price=quantity_decimal * Decimal(item_data['unit_price']),
-                vat_percentage=Decimal(item_data.get('vat_percentage', 20.0)),
-                vat_amount = Decimal(item_data['quantity']) * Decimal(item_data['unit_price']) / 6 if Decimal(item_data.get('vat_percentage', 20.0)) > 0 else Decimal('0'),
-                account_number=item_data.get('account_number')
-            )
-
-            db.session.add(new_item)
-
+        try:
+            new_invoice = invoices.create_incoming_invoice(api.payload)
+        except invoices.InvoiceError as e:
+            api.abort(400, str(e))
         db.session.commit()
         return new_invoice, 201
 
+@api.route('/bulk')
+class IncomingInvoiceBulk(Resource):
+    @api.doc('bulk_create_incoming_invoices')
+    @api.expect(bulk_parser, [incoming_invoice_model])
+    @api.marshal_with(incoming_bulk_report_model)
+    def post(self):
+        '''Create many invoices from a JSON array or an NDJSON stream'''
+        args = bulk_parser.parse_args()
+        return invoice_import.import_incoming_invoices(read_bulk_payload(), batch_size(args))
+
+@api.route('/export')
+class IncomingInvoiceExport(Resource):
+    @api.doc('export_incoming_invoices')
+    @api.expect(export_parser)
+    @api.produces(list(EXPORT_FORMATS.values()))
+    def get(self):
+        '''Stream every invoice line with its invoice header as CSV or NDJSON'''
+        args = export_parser.parse_args()
+        statement = item_export_statement(
+            IncomingInvoice, IncomingInvoiceItem, IncomingInvoice.incoming_invoice_id, IncomingInvoiceItem.incoming_invoice_id, args
+        )
+        return stream_export(statement, 'incoming-invoice-items', args['format'])
+
 @api.route('/<int:id>')
 @api.param('id', 'The incoming invoice identifier')
 @api.response(404, 'Incoming Invoice not found')
@@ -130,73 +160,20 @@ class IncomingInvoiceID(Resource):
     @api.marshal_with(incoming_invoice_model)
     def patch(self, id):
         invoice = IncomingInvoice.query.filter_by(incoming_invoice_id=id).first_or_404()
-        data = api.payload
-
-        for key, value in data.items():
-            if key != 'items':
-                setattr(invoice, key, value)
-
-        if 'items' in data:
-            existing_items = {item.product_name: item for item in invoice.items}
-
-            for item in invoice.items:
-                if item.product_name not in [i['product_name'] for i in data['items']]:
-                    db.session.delete(item)
-
-            for item_data in data['items']:
-                existing_item = existing_items.get(item_data['product_name'])
-
-                if existing_item:
-                    for key, value in item_data.items():
-                        setattr(existing_item, key, value)
-                else:
-                    vat_percentage = item_data.get('vat_percentage')
-                    if vat_percentage is not None:
-                        try:
-                            vat_percentage = Decimal(str(vat_percentage))
-                        except (TypeError, ValueError, decimal.InvalidOperation):
-                            vat_percentage = Decimal('20.0')
-                    else:
-                        vat_percentage = Decimal('20.0')
-
-                    new_item = IncomingInvoiceItem(
-                        incoming_invoice_id=id,
-                        product_name=item_data['product_name'],
-                        product_description=item_data.get('product_description'),
-                        quantity=Decimal(item_data['quantity']),
-                        unit_of_measure=item_data['unit_of_measure'],
-                        unit_price=Decimal(item_data['unit_price']),
-                        total_price=Decimal(item_data['quantity']) * Decimal(item_data['unit_price']),
-                        vat_percentage=vat_percentage,
-                        vat_amount=Decimal(item_data['quantity']) * Decimal(item_data['unit_price']) / 6 if vat_percentage > 0 else Decimal('0'),
-                        account_number=item_data.get('account_number')
-                    )
-                    db.session.add(new_item)
-
-                    product = Product.query.filter_by(name=item_data['product_name']).first()
-                    if not product:
-                        product = Product(
-                            name=item_data['product_name'],
-                            unit_price=Decimal(item_data['unit_price']),
-                            unit_of_measure=item_data['unit_of_measure'],
-                            description=item_data.get('product_description'),
-                            current_stock=Decimal(item_data['quantity']),
-                            date=invoice.date,
-                            storage_id=invoice.storage_id
-                        )
-                        db.session.add(product)
-                    else:
-                        product.current_stock += Decimal(item_data['quantity'])
-                        product.date = invoice.date
-                        product.storage_id = invoice.storage_id
-
+        try:
+            invoices.update_incoming_invoice(invoice, api.payload)
+        except invoices.InvoiceError as e:
+            api.abort(400, str(e))
         db.session.commit()
         return invoice
 
     @api.doc('delete_incoming_invoice')
     def delete(self, id):
         invoice = IncomingInvoice.query.filter_by(incoming_invoice_id=id).first_or_404()
-        db.session.delete(invoice)
+        try:
+            invoices.delete_incoming_invoice(invoice)
+        except invoices.InvoiceError as e:
+            api.abort(400, str(e))
         db.session.commit()
         return '', 204
 
@@ -204,9 +181,11 @@ class IncomingInvoiceID(Resource):
 @api.route('/by-date-and-storage')
 class ProductsByDateAndStorage(Resource):
     @api.doc('get_products_by_date_and_storage')
-    @api.param('date', 'The date to filter products (YYYY-MM-DD)')
+    @api.param('date', 'The date to report stock for (YYYY-MM-DD), inclusive')
+    @api.param('storage_id', 'Only stock held in this storage')
     @api.marshal_list_with(product_model)
     def get(self):
+        '''Stock per product and storage at the end of the given day'''
         date_str = request.args.get('date')
         if not date_str:
             return [], 400
@@ -216,23 +195,28 @@ class ProductsByDateAndStorage(Resource):
         except ValueError:
             return [], 400
 
-        products_by_storage = db.session.query(Product, Storage.name.label('storage_name')) \
-            .join(Storage, Product.storage_id == Storage.storage_id) \
-            .filter(db.func.date(Product.date) <= filter_date) \
-            .all()
+        storage_id = request.args.get('storage_id', type=int)
+        end_of_day = datetime.combine(filter_date, datetime.min.time()) + timedelta(days=1)
+        balances = [row for row in ledger.balances_as_of(end_of_day, storage_id) if row[2]]
+        products = {
+            product.product_id: product
+            for product in Product.query.filter(Product.product_id.in_({row[0] for row in balances}))
+        }
 
         result = []
-        for product, storage_name in products_by_storage:
+        for product_id, product_storage_id, balance in sorted(balances, key=lambda row: (row[0], row[1] or 0)):
+            product = products.get(product_id)
+            if product is None:
+                continue
             product_dict = {
                 'product_id': product.product_id,
                 'name': product.name,
                 'description': product.description,
                 'unit_price': product.unit_price,
-                'current_stock': product.current_stock,
+                'current_stock': balance,
                 'unit_of_measure': product.unit_of_measure,
                 'date': product.date,
-                'storage_id': product.storage_id,
-                'storage_name': storage_name
+                'storage_id': product_storage_id
             }
             result.append(product_dict)
 
@@ -240,9 +224,13 @@ class ProductsByDateAndStorage(Resource):
 
 
 @api.route('/next-invoice-number')
+@api.param('organization_id', 'The organization of the invoice (for per-organization series)')
+@api.param('date', 'The invoice date, YYYY-MM-DD (for per-year series)')
 class NextInvoiceNumber(Resource):
     def get(self):
-        last_invoice = IncomingInvoice.query.order_by(IncomingInvoice.incoming_invoice_id.desc()).first()
-        new_id = (last_invoice.incoming_invoice_id if last_invoice else 0) + 1
-        new_number = f"inv{new_id:03}"
-        return {'next_invoice_number': new_number}
+        organization_id = request.args.get('organization_id', type=int)
+        try:
+            date = invoices.parse_datetime(request.args.get('date'))
+        except invoices.InvoiceError as e:
+            api.abort(400, str(e))
+        return {'next_invoice_number': allocator.peek('inv', organization_id, date)}
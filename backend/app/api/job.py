@@ -0,0 +1,163 @@
+import os
+import shutil
+
+from flask import request, send_file, url_for
+from flask_restx import Namespace, Resource, fields, marshal, reqparse
+from app.models import Job
+from app.extensions import db
+from app.services import csv_import, jobs
+from app.services import job_types  # noqa: F401  (registers the job types)
+from .bulk import csv_import_parser
+from .pagination import keyset_page
+
+api = Namespace('jobs', description='Background jobs: queue heavy work and poll for its result')
+
+job_model = api.model('Job', {
+    'job_id': fields.Integer(readonly=True, description='The job unique identifier'),
+    'job_type': fields.String(required=True, description='What to run, see GET /api/jobs/types'),
+    'params': fields.Raw(description='Parameters of the job type'),
+    'status': fields.String(readonly=True, description='queued, running, succeeded, failed or cancelled'),
+    'progress': fields.Integer(readonly=True, description='Percent done'),
+    'message': fields.String(readonly=True, description='Latest progress message'),
+    'result': fields.Raw(readonly=True, description='Summary returned by a succeeded job'),
+    'result_url': fields.String(readonly=True, attribute=lambda job: job.result_file and url_for(
+        'jobs_job_result', id=job.job_id), description='Where to download the result file'),
+    'error': fields.String(readonly=True, description='Why the last attempt failed'),
+    'attempts': fields.Integer(readonly=True),
+    'max_attempts': fields.Integer(readonly=True),
+    'cancel_requested': fields.Boolean(readonly=True),
+    'created_at': fields.DateTime(readonly=True),
+    'started_at': fields.DateTime(readonly=True),
+    'finished_at': fields.DateTime(readonly=True),
+})
+
+job_type_model = api.model('JobType', {
+    'job_type': fields.String(attribute='name'),
+    'description': fields.String(),
+    'concurrency': fields.Integer(description='Jobs of this type run at the same time at most'),
+    'max_attempts': fields.Integer(),
+})
+
+job_list_parser = reqparse.RequestParser()
+job_list_parser.add_argument('status', type=str, location='args', choices=(
+    jobs.QUEUED, jobs.RUNNING, jobs.SUCCEEDED, jobs.FAILED, jobs.CANCELLED), help='Only jobs in this status')
+job_list_parser.add_argument('job_type', type=str, location='args', help='Only jobs of this type')
+job_list_parser.add_argument('after', type=str, location='args', help='Cursor from the X-Next-Cursor header')
+job_list_parser.add_argument('limit', type=int, location='args', help='Maximum number of jobs to return')
+
+
+def queued(job):
+    db.session.commit()
+    return marshal(job, job_model), 202, {'Location': url_for('jobs_job_item', id=job.job_id)}
+
+
+def enqueue(job_type, params):
+    try:
+        return jobs.enqueue(job_type, params)
+    except jobs.JobError as e:
+        db.session.rollback()
+        api.abort(400, str(e))
+
+
+@api.route('/')
+class JobList(Resource):
+    @api.doc('list_jobs')
+    @api.expect(job_list_parser)
+    @api.response(200, 'Success', [job_model])
+    def get(self):
+        '''List jobs, newest first, one page at a time'''
+        args = job_list_parser.parse_args()
+        query = Job.query
+        if args.get('status'):
+            query = query.filter(Job.status == args['status'])
+        if args.get('job_type'):
+            query = query.filter(Job.job_type == args['job_type'])
+        rows, headers = keyset_page(query, [Job.job_id], args, descending=True)
+        return marshal(rows, job_model), 200, headers
+
+    @api.doc('create_job')
+    @api.expect(job_model)
+    @api.response(202, 'Job queued', job_model)
+    @api.response(400, 'Unknown job type or invalid parameters')
+    def post(self):
+        '''Queue a job; poll the URL in the Location header for its progress'''
+        payload = api.payload or {}
+        return queued(enqueue(payload.get('job_type'), payload.get('params')))
+
+
+@api.route('/types')
+class JobTypeList(Resource):
+    @api.doc('list_job_types')
+    @api.marshal_list_with(job_type_model)
+    def get(self):
+        '''List the job types and their concurrency limits'''
+        limits = jobs.concurrency_limits()
+        return [{'name': name, 'description': kind.description, 'concurrency': limits[name],
+                 'max_attempts': kind.max_attempts} for name, kind in sorted(jobs.JOB_TYPES.items())]
+
+
+@api.route('/imports/<string:entity>')
+@api.param('entity', 'customers, products, storages or suppliers')
+class JobImport(Resource):
+    @api.doc('queue_import', description='Same CSV format as the synchronous /import endpoint of the entity. '
+             'The rejected rows can be downloaded from the result URL once the job has finished.')
+    @api.expect(csv_import_parser)
+    @api.response(202, 'Import queued', job_model)
+    def post(self, entity):
+        '''Queue a CSV import from an upload (text/csv, gzip or multipart ``file``)'''
+        if entity not in csv_import.IMPORTS:
+            api.abort(404, f'Unknown import {entity}')
+        args = csv_import_parser.parse_args()
+        job = enqueue('import', {'entity': entity, 'batch_size': args.get('batch_size')})
+        upload = request.files.get('file')
+        directory = jobs.job_dir(job.job_id)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, jobs.INPUT_FILE), 'wb') as target:
+            shutil.copyfileobj(upload.stream if upload else request.stream, target)
+        return queued(job)
+
+
+@api.route('/<int:id>')
+@api.param('id', 'The job identifier')
+@api.response(404, 'Job not found')
+class JobItem(Resource):
+    @api.doc('get_job')
+    @api.marshal_with(job_model)
+    def get(self, id):
+        '''Fetch the status and progress of a job'''
+        return db.get_or_404(Job, id)
+
+
+@api.route('/<int:id>/cancel')
+@api.param('id', 'The job identifier')
+@api.response(404, 'Job not found')
+class JobCancel(Resource):
+    @api.doc('cancel_job')
+    @api.response(202, 'Cancelled, or asked to stop at its next progress report', job_model)
+    @api.response(409, 'The job has already finished')
+    def post(self, id):
+        '''Cancel a queued or running job'''
+        job = db.get_or_404(Job, id)
+        if not jobs.cancel(job.job_id):
+            db.session.rollback()
+            api.abort(409, f'Job {id} has already finished')
+        db.session.commit()
+        db.session.refresh(job)
+        return marshal(job, job_model), 202
+
+
+@api.route('/<int:id>/result')
+@api.param('id', 'The job identifier')
+@api.response(404, 'Job or result not found')
+class JobResult(Resource):
+    @api.doc('get_job_result')
+    @api.response(409, 'The job has not succeeded')
+    def get(self, id):
+        '''Download the file a job produced'''
+        job = db.get_or_404(Job, id)
+        if job.status != jobs.SUCCEEDED:
+            api.abort(409, f'Job {id} is {job.status}')
+        path = job.result_file and os.path.join(jobs.job_dir(job.job_id), job.result_file)
+        if not path or not os.path.exists(path):
+            api.abort(404, f'Job {id} has no result file')
+        return send_file(path, mimetype=job.result_type, as_attachment=True, download_name=job.result_file)
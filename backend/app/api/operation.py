@@ -1,6 +1,9 @@
 from flask_restx import Namespace, Resource, fields
 from app.models import Operation
 from app.extensions import db
+from app.services import reference_cache
+from .conditional import conditional
+from .pagination import keyset_page, pagination_parser
 
 api = Namespace('operations', description='Operations related to business processes')
 
@@ -12,9 +15,14 @@ operation_model = api.model('Operation', {
 @api.route('/')
 class OperationList(Resource):
     @api.doc('list_operations')
+    @api.expect(pagination_parser)
+    @conditional('operation')
     @api.marshal_list_with(operation_model)
     def get(self):
-        return Operation.query.all()
+        args = pagination_parser.parse_args()
+        operations, headers = reference_cache.page(
+            Operation, lambda: keyset_page(Operation.query, [Operation.operation_id], args))
+        return operations, 200, headers
 
     @api.doc('create_operation')
     @api.expect(operation_model)
@@ -32,9 +40,10 @@ class OperationList(Resource):
 @api.response(404, 'Operation not found')
 class OperationItem(Resource):
     @api.doc('get_operation')
+    @conditional('operation')
     @api.marshal_with(operation_model)
     def get(self, id):
-        return Operation.query.get_or_404(id)
+        return reference_cache.get_or_404(Operation, id)
 
     @api.doc('delete_operation')
     @api.response(204, 'Operation deleted')
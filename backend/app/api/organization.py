@@ -1,6 +1,9 @@
 from flask_restx import Namespace, Resource, fields
 from app.models import Organization
 from app.extensions import db
+from app.services import reference_cache
+from .conditional import conditional
+from .pagination import keyset_page, pagination_parser
 
 api = Namespace('organizations', description='Organization operations')
 
@@ -12,9 +15,14 @@ org_model = api.model('Organization', {
 @api.route('/')
 class OrganizationList(Resource):
     @api.doc('list_organizations')
+    @api.expect(pagination_parser)
+    @conditional('organization')
     @api.marshal_list_with(org_model)
     def get(self):
-        return Organization.query.all()
+        args = pagination_parser.parse_args()
+        organizations, headers = reference_cache.page(
+            Organization, lambda: keyset_page(Organization.query, [Organization.organization_id], args))
+        return organizations, 200, headers
 
     @api.doc('create_organization')
     @api.expect(org_model)
@@ -30,6 +38,7 @@ class OrganizationList(Resource):
 @api.response(404, 'Organization not found')
 class OrganizationItem(Resource):
     @api.doc('get_organization')
+    @conditional('organization')
     @api.marshal_with(org_model)
     def get(self, id):
-        return Organization.query.get_or_404(id)
\ No newline at end of file
+        return reference_cache.get_or_404(Organization, id)
\ No newline at end of file
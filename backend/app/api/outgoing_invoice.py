@@ -1,10 +1,17 @@
-import decimal
-from flask_restx import Namespace, Resource, fields
+import tempfile
+
+from flask import current_app, request, send_file
+from flask_restx import Namespace, Resource, fields, inputs, marshal, reqparse
+from sqlalchemy.orm import noload
 from flask_jwt_extended import jwt_required
-from sqlalchemy import func
-from app.models import OutgoingInvoice, OutgoingInvoiceItem, Product, Customer
+from app.models import OutgoingInvoice, OutgoingInvoiceItem
 from app.extensions import db
-from decimal import Decimal, InvalidOperation
+from app.services import documents, invoice_import, invoices
+from app.services.numbering import allocator
+from . import fast_list
+from .bulk import batch_size, bulk_parser, read_bulk_payload
+from .export import EXPORT_FORMATS, export_parser, item_export_statement, stream_export
+from .pagination import date_range_parser, filter_date_range, keyset_page
 
 api = Namespace('outgoing_invoices', description='Outgoing Invoice operations')
 
@@ -19,10 +26,11 @@ outgoing_invoice_item_model = api.model('OutgoingInvoiceItem', {
     'vat_percentage': fields.Float(required=True),
     'vat_amount': fields.Float(required=True),
     'discount': fields.Float(),
-    'account_number': fields.String()
+    'account_number': fields.String(),
+    'cogs': fields.Float(readonly=True, description='FIFO cost of the goods sold on this line')
 })
 
-outgoing_invoice_model = api.model('OutgoingInvoice', {
+outgoing_invoice_header_model = api.model('OutgoingInvoiceHeader', {
     'outgoing_invoice_id': fields.Integer(readonly=True),
     'number': fields.String(readonly=True),
     'date': fields.DateTime(required=True),
@@ -34,84 +42,168 @@ outgoing_invoice_model = api.model('OutgoingInvoice', {
     'contract_number': fields.String(),
     'payment_document': fields.String(),
     'comment': fields.String(),
+    'total_amount': fields.Float(readonly=True, description='Sum of the lines total_price'),
+    'vat_total': fields.Float(readonly=True, description='Sum of the lines vat_amount'),
+    'discount_total': fields.Float(readonly=True, description='Amount taken off by line discounts'),
+    'line_count': fields.Integer(readonly=True, description='Number of invoice lines'),
+})
+
+outgoing_invoice_model = api.clone('OutgoingInvoice', outgoing_invoice_header_model, {
     'items': fields.List(fields.Nested(outgoing_invoice_item_model))
 })
 
+outgoing_invoice_rows = fast_list.Rows(outgoing_invoice_model, OutgoingInvoice,
+                                   items=('items', outgoing_invoice_item_model, OutgoingInvoiceItem.outgoing_invoice_id))
+outgoing_invoice_header_rows = fast_list.Rows(outgoing_invoice_header_model, OutgoingInvoice)
+
+document_parser = reqparse.RequestParser()
+document_parser.add_argument('format', type=str, location='args', default='pdf', choices=tuple(documents.FORMATS),
+                             help='pdf (default) or html')
+
+documents_parser = document_parser.copy()
+documents_parser.add_argument('date_from', type=inputs.date, location='args', required=True,
+                              help='First invoice day to print (YYYY-MM-DD)')
+documents_parser.add_argument('date_to', type=inputs.date, location='args', required=True,
+                              help='Last invoice day to print (YYYY-MM-DD)')
+documents_parser.add_argument('storage_id', type=int, location='args', help='Only invoices for this storage')
+documents_parser.add_argument('customer_id', type=int, location='args', help='Only invoices for this customer')
+
+
+def checked_format(args):
+    try:
+        documents.check_format(args['format'])
+    except documents.DocumentError as e:
+        api.abort(400, str(e))
+    return args['format']
+
+outgoing_bulk_result_model = api.model('OutgoingInvoiceBulkResult', {
+    'index': fields.Integer(description='Position of the invoice in the submitted batch'),
+    'id': fields.Integer(description='Identifier of the created invoice'),
+    'number': fields.String(),
+    'error': fields.String(description='Why the invoice was not created'),
+})
+
+outgoing_bulk_report_model = api.model('OutgoingInvoiceBulkReport', {
+    'created': fields.Integer(),
+    'rejected': fields.Integer(),
+    'results': fields.List(fields.Nested(outgoing_bulk_result_model, skip_none=True)),
+})
+
+outgoing_invoice_list_parser = date_range_parser.copy()
+outgoing_invoice_list_parser.add_argument('customer_id', type=int, location='args',
+                                          help='Only invoices for this customer')
+outgoing_invoice_list_parser.add_argument('include', type=str, location='args', default='items',
+                                          help='Pass include=items (default) to embed invoice lines, '
+                                               'or an empty include= for headers only')
+
 @api.route('/')
 class OutgoingInvoiceList(Resource):
     @api.doc('list_outgoing_invoices')
-    @api.marshal_list_with(outgoing_invoice_model)
+    @api.expect(outgoing_invoice_list_parser)
+    @api.response(200, 'Success', [outgoing_invoice_model])
     def get(self):
-        return OutgoingInvoice.query.all()
+        args = outgoing_invoice_list_parser.parse_args()
+        include_items = 'items' in (args.get('include') or '').split(',')
+        rows = outgoing_invoice_rows if include_items else outgoing_invoice_header_rows
+        fast = fast_list.enabled()
+        if fast:
+            query = rows.query()
+        else:
+            query = OutgoingInvoice.query
+            if not include_items:
+                query = query.options(noload(OutgoingInvoice.items))
+        query = filter_date_range(query, OutgoingInvoice.date, args)
+        if args.get('storage_id'):
+            query = query.filter(OutgoingInvoice.storage_id == args['storage_id'])
+        if args.get('customer_id'):
+            query = query.filter(OutgoingInvoice.customer_id == args['customer_id'])
+        invoices, headers = keyset_page(
+            query, [OutgoingInvoice.date, OutgoingInvoice.outgoing_invoice_id], args, descending=True
+        )
+        if fast:
+            return rows.marshal(invoices), 200, headers
+        model = outgoing_invoice_model if include_items else outgoing_invoice_header_model
+        return marshal(invoices, model, mask=request.headers.get('X-Fields')), 200, headers
 
     @api.doc('create_outgoing_invoice')
     @api.expect(outgoing_invoice_model)
     @api.marshal_with(outgoing_invoice_model, code=201)
     def post(self):
-        data = api.payload
-        # Generate the invoice number
-        last_invoice = OutgoingInvoice.query.order_by(OutgoingInvoice.outgoing_invoice_id.desc()).first()
-        new_id = (last_invoice.outgoing_invoice_id if last_invoice else 0) + 1
-        new_number = f"out{new_id:03}"
-
-        new_invoice = OutgoingInvoice(
-            number=new_number,
-            date=data['date'],
-            customer_id=data['customer_id'],
-            organization_id=data['organization_id'],
-            contract_id=data['contract_id'],
-            storage_id=data['storage_id'],
-            responsible_person_id=data['responsible_person_id'],
-            payment_document=data.get('payment_document'),
-            comment=data.get('comment')
-        )
-        db.session.add(new_invoice)
-        db.session.flush()
-
-        for item_data in data.get('items', []):
-            product = Product.query.filter_by(name=item_data['product_name']).first()
-            if not product:
-                api.abort(400, f"Product with name '{item_data['product_name']}' not found")
-
-            quantity = Decimal(str(item_data['quantity']))
-            if product.current_stock < quantity:
-                api.abort(400, f"Not enough stock for product {product.name}. Available: {product.current_stock}, Requested: {quantity}")
-
-            unit_price = Decimal(str(item_data['unit_price']))
-            total_price = quantity * unit_price
-
-            vat_percentage = item_data.get('vat_percentage', 20)
-            print(vat_percentage)
-            try:
-                vat_percentage = Decimal(vat_percentage)
-            except (TypeError, ValueError, InvalidOperation):
-                vat_percentage = Decimal('20')
-
-            vat_amount = total_price / 6 if vat_percentage > 0 else Decimal('0')
-
-            discount = Decimal(str(item_data.get('discount', '0')))
-            if discount > 0:
-                total_price = total_price * (1 - discount / 100)
-
-            new_item = OutgoingInvoiceItem(
-                outgoing_invoice_id=new_invoice.outgoing_invoice_id,
-                product_name=product.name,
-                product_description=item_data.get('product_description'),
-                quantity=quantity,
-                unit_of_measure=item_data['unit_of_measure'],
-                unit_price=unit_price,
-                total_price=total_price,
-                vat_percentage=vat_percentage,
-                vat_amount=vat_amount,
-                discount=discount,
-                account_number=item_data.get('account_number')
-            )
-            db.session.add(new_item)
-            product.current_stock -= quantity
-
+        try:
+            new_invoice = invoices.create_outgoing_invoice(api.payload)
+        except invoices.InvoiceError as e:
+            api.abort(400, str(e))
         db.session.commit()
         return new_invoice, 201
 
+@api.route('/bulk')
+class OutgoingInvoiceBulk(Resource):
+    @api.doc('bulk_create_outgoing_invoices')
+    @api.expect(bulk_parser, [outgoing_invoice_model])
+    @api.marshal_with(outgoing_bulk_report_model)
+    def post(self):
+        '''Create many invoices from a JSON array or an NDJSON stream'''
+        args = bulk_parser.parse_args()
+        return invoice_import.import_outgoing_invoices(read_bulk_payload(), batch_size(args))
+
+@api.route('/export')
+class OutgoingInvoiceExport(Resource):
+    @api.doc('export_outgoing_invoices')
+    @api.expect(export_parser)
+    @api.produces(list(EXPORT_FORMATS.values()))
+    def get(self):
+        '''Stream every invoice line with its invoice header as CSV or NDJSON'''
+        args = export_parser.parse_args()
+        statement = item_export_statement(
+            OutgoingInvoice, OutgoingInvoiceItem, OutgoingInvoice.outgoing_invoice_id, OutgoingInvoiceItem.outgoing_invoice_id, args
+        )
+        return stream_export(statement, 'outgoing-invoice-items', args['format'])
+
+@api.route('/documents')
+class OutgoingInvoiceDocuments(Resource):
+    @api.doc('print_outgoing_invoices', description='Documents are cached, so printing the same invoices again '
+             'only checks their versions. Larger batches can run as an invoice_documents job (/api/jobs).')
+    @api.expect(documents_parser)
+    @api.produces(['application/zip'])
+    @api.response(400, 'Too many invoices, or PDF rendering is not installed')
+    def get(self):
+        '''Download the printable documents of the invoices in a date range as a ZIP'''
+        args = documents_parser.parse_args()
+        document_format = checked_format(args)
+        if args['date_from'] > args['date_to']:
+            api.abort(400, 'date_from must not be after date_to')
+        limit = current_app.config['RENDER_MAX_BATCH']
+        invoice_ids = documents.batch_ids(args['date_from'], args['date_to'], args.get('storage_id'),
+                                          args.get('customer_id'), limit + 1)
+        if len(invoice_ids) > limit:
+            api.abort(400, f'More than {limit} invoices; narrow the range or queue an invoice_documents job')
+        contexts = documents.load(invoice_ids)
+        paths = documents.documents(contexts, document_format)
+        output = tempfile.TemporaryFile()
+        documents.archive(contexts, paths, document_format, output)
+        output.seek(0)
+        return send_file(output, mimetype='application/zip', as_attachment=True, download_name=(
+            f"invoices-{args['date_from']:%Y-%m-%d}-{args['date_to']:%Y-%m-%d}.zip"))
+
+@api.route('/<int:id>/document')
+@api.param('id', 'The outgoing invoice identifier')
+@api.response(404, 'Outgoing Invoice not found')
+class OutgoingInvoiceDocument(Resource):
+    @api.doc('print_outgoing_invoice')
+    @api.expect(document_parser)
+    @api.produces(list(documents.FORMATS.values()))
+    @api.response(400, 'PDF rendering is not installed')
+    def get(self, id):
+        '''Render the printable document of an invoice, from the cache when it has not changed'''
+        args = document_parser.parse_args()
+        document_format = checked_format(args)
+        contexts = documents.load([id])
+        if not contexts:
+            api.abort(404, f'Outgoing invoice {id} not found')
+        path, = documents.documents(contexts, document_format)
+        return send_file(path, mimetype=documents.FORMATS[document_format],
+                         download_name=documents.filename(contexts[0], document_format))
+
 @api.route('/<int:id>')
 @api.param('id', 'The outgoing invoice identifier')
 @api.response(404, 'Outgoing Invoice not found')
@@ -127,80 +219,31 @@ class OutgoingInvoiceID(Resource):
     @api.marshal_with(outgoing_invoice_model)
     def patch(self, id):
         invoice = OutgoingInvoice.query.filter_by(outgoing_invoice_id=id).first_or_404()
-        data = api.payload
-
-        for key, value in data.items():
-            if key != 'items':
-                setattr(invoice, key, value)
-
-        if 'items' in data:
-            for item in invoice.items:
-                product = Product.query.filter_by(name=item.product_name).first()
-                product.current_stock += item.quantity
-
-            OutgoingInvoiceItem.query.filter_by(outgoing_invoice_id=id).delete()
-
-            for item_data in data['items']:
-                product = Product.query.filter_by(name=item_data['product_name']).first()
-                if not product:
-                    api.abort(400, f"Product with name '{item_data['product_name']}' not found")
-
-                quantity = Decimal(str(item_data['quantity']))
-                if product.current_stock < quantity:
-                    api.abort(400, f"Not enough stock for product {product.name}. Available: {product.current_stock}, Requested: {quantity}")
-
-                unit_price = Decimal(str(item_data['unit_price']))
-                total_price = quantity * unit_price
-                vat_percentage = item_data.get('vat_percentage')
-                if vat_percentage is not None:
-                    try:
-                        vat_percentage = Decimal(str(vat_percentage))
-                    except (TypeError, ValueError, decimal.InvalidOperation):
-                        vat_percentage = Decimal('20.0')
-                    else:
-                        vat_percentage = Decimal('20.0')
-                vat_amount = total_price / 6 if vat_percentage > 0 else Decimal('0')
-
-                discount = Decimal(str(item_data.get('discount', '0')))
-                if discount > 0:
-                    total_price = total_price * (1 - discount / 100)
-
-                new_item = OutgoingInvoiceItem(
-                    outgoing_invoice_id=id,
-                    product_name=product.name,
-                    product_description=item_data.get('product_description'),
-                    quantity=quantity,
-                    unit_of_measure=item_data['unit_of_measure'],
-                    unit_price=unit_price,
-                    total_price=total_price,
-                    vat_percentage=vat_percentage,
-                    vat_amount=vat_amount,
-                    discount=discount,
-                    account_number=item_data.get('account_number')
-                )
-                db.session.add(new_item)
-                product.current_stock -= quantity
-
+        try:
+            invoices.update_outgoing_invoice(invoice, api.payload)
+        except invoices.InvoiceError as e:
+            api.abort(400, str(e))
         db.session.commit()
+        documents.invalidate(id)
         return invoice
 
     @api.doc('delete_outgoing_invoice')
     @api.response(204, 'Outgoing Invoice deleted')
     def delete(self, id):
         invoice = OutgoingInvoice.query.filter_by(outgoing_invoice_id=id).first_or_404()
-
-        for item in invoice.items:
-            product = Product.query.filter_by(name=item.product_name).first()
-            product.current_stock += item.quantity
-
-        db.session.delete(invoice)
+        invoices.delete_outgoing_invoice(invoice)
         db.session.commit()
+        documents.invalidate(id)
         return '', 204
 
 @api.route('/next-invoice-number')
+@api.param('organization_id', 'The organization of the invoice (for per-organization series)')
+@api.param('date', 'The invoice date, YYYY-MM-DD (for per-year series)')
 class NextInvoiceNumber(Resource):
     def get(self):
-        last_invoice = OutgoingInvoice.query.order_by(OutgoingInvoice.outgoing_invoice_id.desc()).first()
-        new_id = (last_invoice.outgoing_invoice_id if last_invoice else 0) + 1
-        new_number = f"out{new_id:03}"
-        return {'next_invoice_number': new_number}
\ No newline at end of file
+        organization_id = request.args.get('organization_id', type=int)
+        try:
+            date = invoices.parse_datetime(request.args.get('date'))
+        except invoices.InvoiceError as e:
+            api.abort(400, str(e))
+        return {'next_invoice_number': allocator.peek('out', organization_id, date)}
\ No newline at end of file
@@ -0,0 +1,94 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from flask import current_app, request
+from flask_restx import abort, inputs, reqparse
+from sqlalchemy import DateTime, tuple_
+
+pagination_parser = reqparse.RequestParser()
+pagination_parser.add_argument('limit', type=int, location='args',
+                               help='Maximum number of rows to return')
+pagination_parser.add_argument('after', type=str, location='args',
+                               help='Cursor taken from the X-Next-Cursor header of the previous page')
+
+date_range_parser = pagination_parser.copy()
+date_range_parser.add_argument('date_from', type=inputs.date, location='args',
+                               help='Only rows dated on or after this day (YYYY-MM-DD)')
+date_range_parser.add_argument('date_to', type=inputs.date, location='args',
+                               help='Only rows dated on or before this day (YYYY-MM-DD)')
+date_range_parser.add_argument('storage_id', type=int, location='args',
+                               help='Only rows for this storage')
+
+
+def filter_date_range(query, column, args):
+    '''Restrict ``column`` to the requested days with plain range predicates.
+
+    Comparing the raw column (instead of ``func.date(column)``) keeps the
+    predicate usable by a btree index on ``column``.
+    '''
+    if args.get('date_from'):
+        query = query.filter(column >= args['date_from'])
+    if args.get('date_to'):
+        query = query.filter(column < args['date_to'] + timedelta(days=1))
+    return query
+
+
+def encode_cursor(values):
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+            for column, value in zip(columns, values)
+        ]
+    except (binascii.Error, TypeError, ValueError):
+        abort(400, 'Invalid pagination cursor')
+
+
+def page_limit(args):
+    limit = args.get('limit') or current_app.config['API_DEFAULT_PAGE_SIZE']
+    return max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+
+def next_page_headers(cursor):
+    params = [(key, value) for key, value in request.args.items(multi=True) if key != 'after']
+    params.append(('after', cursor))
+    return {
+        'X-Next-Cursor': cursor,
+        'Link': f'<{request.base_url}?{urlencode(params)}>; rel="next"',
+    }
+
+
+def keyset_page(query, order_by, args, descending=False):
+    '''Return one page of ``query`` ordered by the unique key ``order_by``.
+
+    ``order_by`` must end with the primary key so the sort order is stable.
+    Instead of OFFSET the page starts right after the row encoded in the
+    ``after`` cursor, so every page costs the same index range scan no matter
+    how deep into the table it is.  Returns ``(rows, headers)``; the headers
+    carry the cursor of the next page when there is one.
+    '''
+    limit = page_limit(args)
+    if args.get('after'):
+        values = decode_cursor(args['after'], order_by)
+        key = tuple_(*order_by)
+        bound = tuple_(*values, types=[column.type for column in order_by])
+        query = query.filter(key < bound if descending else key > bound)
+
+    ordering = [column.desc() if descending else column.asc() for column in order_by]
+    rows = query.order_by(*ordering).limit(limit + 1).all()
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers = next_page_headers(encode_cursor([getattr(rows[-1], column.key) for column in order_by]))
+    return rows, headers
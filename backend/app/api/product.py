@@ -1,9 +1,13 @@
-from flask_restx import Namespace, Resource, fields
-from flask import request
-from app.models import Product
+from flask_restx import Namespace, Resource, fields, marshal
+from flask import current_app, request
+from sqlalchemy import delete
+from app.models import Inventory, Product
 from app.extensions import db
-from datetime import datetime
-from sqlalchemy import func
+from app.services import fifo, ledger, product_search
+from datetime import datetime, timedelta
+from . import fast_list
+from .bulk import csv_import_parser, import_csv_upload, import_report_model
+from .pagination import date_range_parser, filter_date_range, keyset_page
 
 api = Namespace('products', description='Product operations')
 
@@ -18,13 +22,36 @@ product_model = api.model('Product', {
     'storage_id': fields.Integer(description='The storage identifier')
 })
 
+product_rows = fast_list.Rows(product_model, Product)
+
+product_name_model = api.model('ProductName', {
+    'product_id': fields.Integer(description='The product unique identifier'),
+    'name': fields.String(description='The product name'),
+})
+
+def result_limit(default):
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+product_import_report_model = import_report_model(api, 'Product')
+
 @api.route('/')
 class ProductList(Resource):
     @api.doc('list_products')
-    @api.marshal_list_with(product_model)
+    @api.expect(date_range_parser)
+    @api.response(200, 'Success', [product_model])
     def get(self):
-        '''List all products'''
-        return Product.query.all()
+        '''List products one page at a time'''
+        args = date_range_parser.parse_args()
+        fast = fast_list.enabled()
+        query = product_rows.query() if fast else Product.query
+        query = filter_date_range(query, Product.date, args)
+        if args.get('storage_id'):
+            query = query.filter(Product.storage_id == args['storage_id'])
+        products, headers = keyset_page(query, [Product.product_id], args)
+        if fast:
+            return product_rows.marshal(products), 200, headers
+        return marshal(products, product_model, mask=request.headers.get('X-Fields')), 200, headers
 
     @api.doc('create_product')
     @api.expect(product_model)
@@ -41,6 +68,11 @@ class ProductList(Resource):
             storage_id=api.payload.get('storage_id')
         )
         db.session.add(new_product)
+        db.session.flush()
+        ledger.record_quantities('product', new_product.product_id, new_product.date, new_product.storage_id,
+                                 {new_product.product_id: new_product.current_stock or 0})
+        fifo.open_lots([{'product_id': new_product.product_id, 'current_stock': new_product.current_stock,
+                         'date': new_product.date, 'unit_price': new_product.unit_price}])
         db.session.commit()
         return new_product, 201
 
@@ -58,10 +90,21 @@ class ProductList(Resource):
         if not product:
             return {'message': 'Product not found'}, 404
 
+        db.session.execute(delete(Inventory).where(Inventory.product_id == product.product_id))
         db.session.delete(product)
         db.session.commit()
         return '', 204
 
+@api.route('/import')
+class ProductImport(Resource):
+    @api.doc('import_products', description='CSV columns: name, unit_price, unit_of_measure and storage_id; optional description and current_stock. '
+             'Rows are matched on name; existing products are updated.')
+    @api.expect(csv_import_parser)
+    @api.marshal_with(product_import_report_model)
+    def post(self):
+        '''Create or update products from a CSV upload (text/csv, gzip or multipart ``file``)'''
+        return import_csv_upload(api, 'products')
+
 @api.route('/<int:id>')
 @api.param('id', 'The product identifier')
 @api.response(404, 'Product not found')
@@ -98,7 +141,8 @@ class ProductsByDate(Resource):
         except ValueError:
             return [], 400
 
-        products = Product.query.filter(func.date(Product.date) == filter_date).all()
+        start = datetime.combine(filter_date, datetime.min.time())
+        products = Product.query.filter(Product.date >= start, Product.date < start + timedelta(days=1)).all()
 
         return products
 
@@ -106,10 +150,22 @@ class ProductsByDate(Resource):
 class ProductSearch(Resource):
     @api.doc('search_products')
     @api.param('name', 'The partial product name to search')
+    @api.param('limit', 'Maximum number of products to return')
     @api.marshal_list_with(product_model)
     def get(self):
-        '''Search products by name with stock greater than 0'''
+        '''Search products by name with stock greater than 0, best matches first'''
         name = request.args.get('name', '')
-        products = Product.query.filter(Product.name.ilike(f'%{name}%'), Product.current_stock > 0).all()
-        return products
+        return product_search.search_products(name, result_limit(current_app.config['PRODUCT_SEARCH_LIMIT']))
 
+@api.route('/autocomplete')
+class ProductAutocomplete(Resource):
+    @api.doc('autocomplete_products')
+    @api.param('prefix', 'The start of the product name (case-insensitive)')
+    @api.param('limit', 'Maximum number of names to return')
+    @api.marshal_list_with(product_name_model)
+    def get(self):
+        '''Product names starting with a prefix, in alphabetical order'''
+        prefix = request.args.get('prefix', '')
+        if not prefix:
+            return []
+        return product_search.autocomplete(prefix, result_limit(current_app.config['PRODUCT_SEARCH_LIMIT']))
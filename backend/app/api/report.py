@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta
+from flask_restx import Namespace, Resource, fields, inputs, reqparse
+from app.services import rollups
+from .pagination import page_limit
+
+api = Namespace('reports', description='Sales and purchase reports from the daily rollups')
+
+report_parser = reqparse.RequestParser()
+report_parser.add_argument('date_from', type=inputs.date, location='args',
+                           help='First day of the report (YYYY-MM-DD); default: 364 days before date_to')
+report_parser.add_argument('date_to', type=inputs.date, location='args',
+                           help='Last day of the report (YYYY-MM-DD); default: today')
+
+ranking_parser = report_parser.copy()
+ranking_parser.add_argument('limit', type=int, location='args', help='Maximum number of rows to return')
+
+period_parser = report_parser.copy()
+period_parser.add_argument('period', type=str, location='args', default='month',
+                           choices=('day', 'week', 'month', 'year'),
+                           help='day, week (ISO), month (default) or year')
+
+measure_fields = {
+    'quantity': fields.Float(description='Units on the invoice lines'),
+    'amount': fields.Float(description='Sum of the lines total_price'),
+    'vat': fields.Float(description='Sum of the lines vat_amount'),
+    'discount': fields.Float(description='Amount taken off by line discounts'),
+    'line_count': fields.Integer(description='Number of invoice lines'),
+    'invoice_count': fields.Integer(description='Number of invoices'),
+}
+
+
+def report_model(name, key, field):
+    return api.model(name, {key: field, **measure_fields})
+
+
+sales_by_product_model = report_model('SalesByProduct', 'product_name', fields.String())
+sales_by_customer_model = report_model('SalesByCustomer', 'customer_id', fields.Integer())
+sales_by_storage_model = report_model('SalesByStorage', 'storage_id', fields.Integer())
+purchases_by_supplier_model = report_model('PurchasesBySupplier', 'supplier_id', fields.Integer())
+period_model = report_model('ReportPeriod', 'period', fields.String(description='2024-05-31, 2024-W22, 2024-05 or 2024'))
+
+
+def report_range(args):
+    date_to = (args.get('date_to') or datetime.utcnow()).date()
+    date_from = args['date_from'].date() if args.get('date_from') else date_to - timedelta(days=364)
+    if date_from > date_to:
+        api.abort(400, 'date_from must not be after date_to')
+    return date_from, date_to
+
+
+def optional_id(key):
+    return int(key) if key else None
+
+
+def ranking(rollup, dimension, key, convert):
+    args = ranking_parser.parse_args()
+    rows = rollups.by_dimension(rollup, dimension, *report_range(args), page_limit(args))
+    for row in rows:
+        row[key] = convert(row.pop('dimension_key'))
+    return rows
+
+
+def periods(rollup):
+    args = period_parser.parse_args()
+    return rollups.by_period(rollup, args['period'], *report_range(args))
+
+
+@api.route('/sales/by-product')
+class SalesByProduct(Resource):
+    @api.doc('sales_by_product')
+    @api.expect(ranking_parser)
+    @api.marshal_list_with(sales_by_product_model)
+    def get(self):
+        '''Sales per product over a range of days, largest amount first'''
+        return ranking(rollups.SALES, 'product', 'product_name', str)
+
+@api.route('/sales/by-customer')
+class SalesByCustomer(Resource):
+    @api.doc('sales_by_customer')
+    @api.expect(ranking_parser)
+    @api.marshal_list_with(sales_by_customer_model)
+    def get(self):
+        '''Sales per customer over a range of days, largest amount first'''
+        return ranking(rollups.SALES, 'customer', 'customer_id', optional_id)
+
+@api.route('/sales/by-storage')
+class SalesByStorage(Resource):
+    @api.doc('sales_by_storage')
+    @api.expect(ranking_parser)
+    @api.marshal_list_with(sales_by_storage_model)
+    def get(self):
+        '''Sales per storage over a range of days, largest amount first'''
+        return ranking(rollups.SALES, 'storage', 'storage_id', optional_id)
+
+@api.route('/sales/by-period')
+class SalesByPeriod(Resource):
+    @api.doc('sales_by_period')
+    @api.expect(period_parser)
+    @api.marshal_list_with(period_model)
+    def get(self):
+        '''Sales per day, week, month or year, oldest first'''
+        return periods(rollups.SALES)
+
+@api.route('/purchases/by-supplier')
+class PurchasesBySupplier(Resource):
+    @api.doc('purchases_by_supplier')
+    @api.expect(ranking_parser)
+    @api.marshal_list_with(purchases_by_supplier_model)
+    def get(self):
+        '''Purchases per supplier over a range of days, largest amount first'''
+        return ranking(rollups.PURCHASES, 'supplier', 'supplier_id', optional_id)
+
+@api.route('/purchases/by-period')
+class PurchasesByPeriod(Resource):
+    @api.doc('purchases_by_period')
+    @api.expect(period_parser)
+    @api.marshal_list_with(period_model)
+    def get(self):
+        '''Purchases per day, week, month or year, oldest first'''
+        return periods(rollups.PURCHASES)
@@ -1,6 +1,9 @@
 from flask_restx import Namespace, Resource, fields
 from app.models import Storage
 from app.extensions import db
+from app.services import reference_cache
+from .conditional import conditional
+from .pagination import keyset_page, pagination_parser
 
 api = Namespace('storages', description='Storage operations')
 
@@ -14,9 +17,14 @@ storage_model = api.model('Storage', {
 @api.route('/')
 class StorageList(Resource):
     @api.doc('list_storages')
+    @api.expect(pagination_parser)
+    @conditional('storage')
     @api.marshal_list_with(storage_model)
     def get(self):
-        return Storage.query.all()
+        args = pagination_parser.parse_args()
+        storages, headers = reference_cache.page(
+            Storage, lambda: keyset_page(Storage.query, [Storage.storage_id], args))
+        return storages, 200, headers
 
     @api.doc('create_storage')
     @api.expect(storage_model)
@@ -36,6 +44,7 @@ class StorageList(Resource):
 @api.response(404, 'Storage not found')
 class StorageItem(Resource):
     @api.doc('get_storage')
+    @conditional('storage')
     @api.marshal_with(storage_model)
     def get(self, id):
-        return Storage.query.get_or_404(id)
+        return reference_cache.get_or_404(Storage, id)
@@ -1,6 +1,9 @@
 from flask_restx import Namespace, Resource, fields
 from app.models import Supplier
 from app.extensions import db
+from .bulk import csv_import_parser, import_csv_upload, import_report_model
+from .conditional import conditional
+from .pagination import keyset_page, pagination_parser
 
 api = Namespace('suppliers', description='Supplier operations')
 
@@ -11,12 +14,18 @@ supplier_model = api.model('Supplier', {
     'address': fields.String(),
 })
 
+supplier_import_report_model = import_report_model(api, 'Supplier')
+
 @api.route('/')
 class SupplierList(Resource):
     @api.doc('list_suppliers')
+    @api.expect(pagination_parser)
+    @conditional('supplier')
     @api.marshal_list_with(supplier_model)
     def get(self):
-        return Supplier.query.all()
+        args = pagination_parser.parse_args()
+        suppliers, headers = keyset_page(Supplier.query, [Supplier.supplier_id], args)
+        return suppliers, 200, headers
 
     @api.doc('create_supplier')
     @api.expect(supplier_model)
@@ -31,11 +40,22 @@ class SupplierList(Resource):
         db.session.commit()
         return new_supplier, 201
 
+@api.route('/import')
+class SupplierImport(Resource):
+    @api.doc('import_suppliers', description='CSV columns: name; optional contact_info and address. '
+             'Rows are matched on name; existing suppliers are updated.')
+    @api.expect(csv_import_parser)
+    @api.marshal_with(supplier_import_report_model)
+    def post(self):
+        '''Create or update suppliers from a CSV upload (text/csv, gzip or multipart ``file``)'''
+        return import_csv_upload(api, 'suppliers')
+
 @api.route('/<int:id>')
 @api.param('id', 'The supplier identifier')
 @api.response(404, 'Supplier not found')
 class SupplierItem(Resource):
     @api.doc('get_supplier')
+    @conditional('supplier')
     @api.marshal_with(supplier_model)
     def get(self, id):
         return Supplier.query.get_or_404(id)
\ No newline at end of file
@@ -0,0 +1,286 @@
+import csv
+import json
+import os
+import signal
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import select
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.extensions import db
+from app.models import Customer, Employee, Organization, Product, Storage
+from app.services import csv_import, fifo, jobs, ledger, query_plans, rollups
+
+stock_cli = AppGroup('stock', help='Stock maintenance and verification commands.')
+
+
+@stock_cli.command('stress')
+@click.option('--stock', 'initial_stock', default=50, show_default=True, help='Units on hand before the run.')
+@click.option('--sales', default=200, show_default=True, help='Number of one-unit sales to fire.')
+@click.option('--workers', default=16, show_default=True, help='Number of concurrent clients.')
+def stock_stress(initial_stock, sales, workers):
+    """Fire parallel sales at one SKU and check that nothing is oversold.
+
+    A throwaway product is created and sold through POST /api/outgoing-invoices/
+    from many threads at once. Afterwards exactly min(sales, stock) sales must
+    have succeeded and the stock must equal what was not sold. The invoices and
+    the product are removed again, but invoice numbers are consumed, so run it
+    against a staging database.
+    """
+    customer = Customer.query.first()
+    organization = Organization.query.first()
+    storage = Storage.query.first()
+    employee = Employee.query.first()
+    if not all((customer, organization, storage, employee)):
+        raise click.ClickException('Needs at least one customer, organization, storage and employee.')
+
+    name = f'stress-{uuid.uuid4().hex[:12]}'
+    product = Product(name=name, unit_price=1, current_stock=initial_stock, unit_of_measure='pc',
+                      date=datetime.utcnow(), storage_id=storage.storage_id)
+    db.session.add(product)
+    db.session.commit()
+    product_id = product.product_id
+
+    payload = {
+        'date': datetime.utcnow().isoformat(),
+        'customer_id': customer.customer_id,
+        'organization_id': organization.organization_id,
+        'storage_id': storage.storage_id,
+        'responsible_person_id': employee.employee_id,
+        'comment': 'stock stress test',
+        'items': [{'product_name': name, 'quantity': 1, 'unit_of_measure': 'pc', 'unit_price': 1}],
+    }
+    client = current_app.test_client()
+
+    def sell(_):
+        response = client.post('/api/outgoing-invoices/', json=payload)
+        return response.status_code, (response.get_json(silent=True) or {}).get('outgoing_invoice_id')
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(sell, range(sales)))
+
+    created = [invoice_id for status, invoice_id in results if status == 201]
+    refused = sum(1 for status, _ in results if status == 400)
+    errors = len(results) - len(created) - refused
+    db.session.expire_all()
+    final_stock = db.session.get(Product, product_id).current_stock
+
+    click.echo(f'sold {len(created)}, refused {refused}, errors {errors}, '
+               f'stock {initial_stock} -> {final_stock}')
+
+    for invoice_id in created:
+        client.delete(f'/api/outgoing-invoices/{invoice_id}')
+    db.session.delete(db.session.get(Product, product_id))
+    db.session.commit()
+
+    expected_sold = min(sales, initial_stock)
+    if final_stock < 0 or final_stock != initial_stock - len(created) or len(created) > initial_stock:
+        raise click.ClickException('Stock was oversold.')
+    if len(created) != expected_sold:
+        raise click.ClickException(f'Expected {expected_sold} successful sales, got {len(created)}.')
+    click.echo('OK: no oversell.')
+
+
+@stock_cli.command('checkpoint')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Write checkpoints up to this date (default: today).')
+def stock_checkpoint(until):
+    """Write the missing monthly stock checkpoints.
+
+    Point-in-time stock queries start from the newest checkpoint before the
+    requested date, so run this regularly (e.g. nightly from cron) to keep
+    them bounded to one month of movements.
+    """
+    written = 0
+    for as_of, pairs in ledger.write_checkpoints(until):
+        click.echo(f'{as_of:%Y-%m-%d}: {pairs} product/storage balances')
+        written += 1
+    click.echo(f'{written} checkpoint(s) written.')
+
+
+@stock_cli.command('recost')
+@click.option('--product', 'names', multiple=True, help='Only replay this product (repeatable; default: all).')
+@click.option('--batch-size', default=fifo.BATCH_SIZE, show_default=True,
+              help='Products replayed per transaction.')
+def stock_recost(names, batch_size):
+    """Replay FIFO costing from the first lot and sale of each product.
+
+    Refills every inventory lot and recomputes the cost of goods sold of
+    every outgoing line, writing only what changed. Invoices keep their
+    products' costing up to date on their own; run this after the migration
+    that adds the lots, or after editing invoice lines or lots by hand.
+    """
+    query = select(Product.product_id).order_by(Product.product_id)
+    if names:
+        query = query.where(Product.name.in_(names))
+    product_ids = db.session.execute(query).scalars().all()
+    if names and len(product_ids) != len(set(names)):
+        raise click.ClickException('Unknown product name(s).')
+    lots = lines = 0
+    for start in range(0, len(product_ids), batch_size):
+        changed = fifo.recost(product_ids[start:start + batch_size], batch_size)
+        db.session.commit()
+        lots += changed[0]
+        lines += changed[1]
+        click.echo(f'{min(start + batch_size, len(product_ids))}/{len(product_ids)} products', err=True)
+    click.echo(f'{len(product_ids)} product(s) replayed: {lots} lot(s) and {lines} line(s) updated.')
+
+
+perf_cli = AppGroup('perf', help='Performance checks.')
+
+
+@perf_cli.command('explain')
+@click.option('--min-rows', default=10000, show_default=True,
+              help='Tables with at least this many rows must not be scanned sequentially.')
+def perf_explain(min_rows):
+    """EXPLAIN the main query of each hot endpoint and fail on sequential scans.
+
+    Run it against a database seeded with realistic volumes; on small tables
+    the planner rightly prefers a sequential scan, so those are not reported.
+    Exits non-zero when a large table is scanned, for use in CI.
+    """
+    checked, problems = query_plans.sequential_scans(min_rows)
+    db.session.rollback()
+    for name, table, rows in problems:
+        click.echo(f'{name}: sequential scan on {table} ({rows} rows)')
+    if problems:
+        raise click.ClickException(f'{len(problems)} sequential scan(s) on large tables.')
+    click.echo(f'OK: {checked} queries checked, no sequential scans on tables with {min_rows}+ rows.')
+
+
+import_cli = AppGroup('import', help='Bulk CSV import commands.')
+
+
+def register_import_command(entity):
+    model, key, parsers = csv_import.IMPORTS[entity]
+    required = ', '.join(column for column, parse in parsers.items() if parse.required)
+    optional = ', '.join(column for column, parse in parsers.items() if not parse.required)
+
+    @import_cli.command(entity, help=(
+        f"Create or update {entity} from a CSV file (gzip allowed, '-' for stdin).\n\n"
+        f"Columns: {required} (required); {optional} (optional). Rows are matched on {key}; "
+        f"existing {entity} are updated. Invalid rows are skipped and listed at the end."
+    ))
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--batch-size', type=int, default=None,
+                  help='Rows merged per transaction (default: CSV_IMPORT_BATCH_SIZE).')
+    @click.option('--rejects', type=click.File('w'), default=None,
+                  help='Also write every rejected row as "line,error" CSV to this file.')
+    def command(source, batch_size, rejects):
+        writer = csv.writer(rejects) if rejects else None
+        if writer:
+            writer.writerow(['line', 'error'])
+
+        def reject(line, error):
+            if writer:
+                writer.writerow([line, error])
+
+        def progress(report):
+            click.echo(f"{report['inserted']} inserted, {report['updated']} updated, "
+                       f"{report['rejected']} rejected so far", err=True)
+
+        try:
+            report = csv_import.import_csv(entity, source, batch_size or current_app.config['CSV_IMPORT_BATCH_SIZE'],
+                                           on_reject=reject, on_batch=progress)
+        except csv_import.CsvImportError as e:
+            raise click.ClickException(str(e))
+
+        for error in report['errors']:
+            click.echo(f"line {error['line']}: {error['error']}")
+        hidden = report['rejected'] - len(report['errors'])
+        if hidden:
+            click.echo(f'... and {hidden} more rejected row(s)')
+        click.echo(f"{entity}: {report['inserted']} inserted, {report['updated']} updated, "
+                   f"{report['rejected']} rejected.")
+
+
+for entity in csv_import.IMPORTS:
+    register_import_command(entity)
+
+
+reports_cli = AppGroup('reports', help='Sales and purchase rollup commands.')
+
+
+@reports_cli.command('rebuild')
+@click.option('--from', 'date_from', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='First day to rebuild (default: the oldest invoice).')
+@click.option('--to', 'date_to', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Last day to rebuild (default: the newest invoice).')
+@click.option('--chunk-days', default=31, show_default=True, help='Days rebuilt per transaction.')
+@click.option('--workers', default=4, show_default=True, help='Date ranges rebuilt in parallel.')
+def reports_rebuild(date_from, date_to, chunk_days, workers):
+    """Recompute the daily sales and purchase rollups from the invoice lines.
+
+    The range is cut into chunks of --chunk-days days. Each chunk replaces its
+    days in one transaction, and the chunks run on parallel connections. Run
+    it after the migration that creates the rollup tables, and whenever they
+    are suspected to have drifted. SQLite allows one writer, so it always uses
+    a single worker.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        workers = 1
+    app = current_app._get_current_object()
+    jobs = []
+    for rollup in (rollups.SALES, rollups.PURCHASES):
+        bounds = rollups.invoice_date_range(rollup)
+        if bounds is None and not (date_from and date_to):
+            continue
+        start = date_from or bounds[0]
+        end = date_to + timedelta(days=1) if date_to else bounds[1]
+        jobs.extend((rollup, chunk) for chunk in rollups.date_chunks(start, end, chunk_days))
+
+    def rebuild(job):
+        rollup, (start, end) = job
+        with app.app_context():
+            rollups.rebuild(rollup, start, end)
+            db.session.commit()
+        return rollup.table.name, start, end
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for table, start, end in pool.map(rebuild, jobs):
+            click.echo(f'{table}: {start:%Y-%m-%d} to {end - timedelta(days=1):%Y-%m-%d}')
+    click.echo(f'{len(jobs)} range(s) rebuilt.')
+
+
+jobs_cli = AppGroup('jobs', help='Background job commands.')
+
+
+@jobs_cli.command('worker')
+@click.option('--processes', type=int, default=None, help='Jobs run at the same time (default: JOB_WORKERS).')
+@click.option('--once', is_flag=True, help='Exit once no job is queued or running instead of polling forever.')
+def jobs_worker(processes, once):
+    """Run the queued jobs in a pool of worker processes.
+
+    Jobs are claimed from the job table, so any number of workers may run
+    against one database; the per-type limits (JOB_CONCURRENCY) hold across
+    all of them on PostgreSQL and SQLite. SIGTERM or Ctrl-C stops claiming
+    new jobs and waits for the running ones to finish.
+    """
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    processes = processes or current_app.config['JOB_WORKERS']
+    worker = jobs.Worker(current_app._get_current_object(), max(1, processes),
+                         os.environ.get('FLASK_CONFIG', 'production'))
+    click.echo(f'Job worker running {max(1, processes)} process(es).', err=True)
+    worker.run(stop, once=once)
+
+
+@jobs_cli.command('enqueue')
+@click.argument('job_type')
+@click.argument('params', default='{}')
+def jobs_enqueue(job_type, params):
+    """Queue a JOB_TYPE job with PARAMS given as a JSON object, e.g. from cron."""
+    try:
+        job = jobs.enqueue(job_type, json.loads(params))
+    except ValueError as e:
+        raise click.ClickException(f'PARAMS is not valid JSON: {e}')
+    except jobs.JobError as e:
+        raise click.ClickException(str(e))
+    db.session.commit()
+    click.echo(job.job_id)
@@ -0,0 +1,120 @@
+import gzip
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+# Suffix added to the ETag of a compressed representation, so the strong
+# validator still identifies the bytes on the wire.
+ETAG_SUFFIXES = {'br': '-br', 'gzip': '-gzip'}
+
+
+def encodings():
+    '''Content codings this process can produce, in order of preference.'''
+    available = ('br', 'gzip') if brotli else ('gzip',)
+    return [encoding for encoding in current_app.config['COMPRESS_ALGORITHMS'] if encoding in available]
+
+
+def negotiate():
+    '''The coding to use for the current request, or ``None``.'''
+    accepted = request.accept_encodings
+    best, best_quality = None, 0
+    for encoding in encodings():
+        quality = accepted[encoding] or accepted['*']
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressor(encoding):
+    '''Object with ``compress(data)``/``flush()`` for streaming ``encoding``.'''
+    if encoding == 'br':
+        return BrotliStream(current_app.config['COMPRESS_BROTLI_QUALITY'])
+    return GzipStream(current_app.config['COMPRESS_LEVEL'])
+
+
+class GzipStream:
+    def __init__(self, level):
+        self.compressobj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        # A sync flush per chunk lets the client decode each chunk on arrival.
+        return self.compressobj.compress(data) + self.compressobj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressobj.flush(zlib.Z_FINISH)
+
+
+class BrotliStream:
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL'], mtime=0)
+
+
+def compressed_chunks(chunks, stream):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if chunk:
+            yield stream.compress(chunk)
+    yield stream.finish()
+
+
+def eligible(response):
+    return (
+        request.path.startswith('/api/')
+        and 200 <= response.status_code < 300 and response.status_code != 204
+        and response.mimetype in current_app.config['COMPRESS_MIMETYPES']
+        and 'Content-Encoding' not in response.headers
+        and not response.direct_passthrough
+    )
+
+
+def compress_response(response):
+    if not eligible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    if not response.is_streamed and (response.content_length or 0) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compressed_chunks(response.response, compressor(encoding))
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compress_body(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag + ETAG_SUFFIXES[encoding])
+    return response
+
+
+def init_app(app):
+    '''Compress ``/api/*`` responses with gzip, or brotli when installed and preferred by the client.
+
+    Buffered responses are compressed when they reach ``COMPRESS_MIN_SIZE``
+    bytes; streamed ones (the exports) are compressed chunk by chunk as
+    they are produced.  Register it after ``instrumentation`` so the
+    compression time is part of the measured request.
+    '''
+    if app.config['COMPRESS_MIN_SIZE'] < 0:
+        return
+    app.after_request(compress_response)
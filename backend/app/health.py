@@ -0,0 +1,23 @@
+from flask import Blueprint, jsonify
+from sqlalchemy import text
+
+from app.extensions import db
+
+health_bp = Blueprint('health', __name__)
+
+
+@health_bp.route('/healthz')
+def healthz():
+    '''Liveness: the worker is up and serving requests.'''
+    return jsonify(status='ok')
+
+
+@health_bp.route('/readyz')
+def readyz():
+    '''Readiness: the database answers a trivial query on a pooled connection.'''
+    try:
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+    except Exception as e:
+        return jsonify(status='unavailable', error=e.__class__.__name__), 503
+    return jsonify(status='ok')
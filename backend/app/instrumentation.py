@@ -0,0 +1,139 @@
+import time
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask_restx import marshalling
+from sqlalchemy import event
+
+from .extensions import db
+from .metrics import registry
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by API namespace.', ('namespace',))
+requests_total = registry.counter(
+    'http_requests_total', 'Requests by endpoint, method and status.', ('endpoint', 'method', 'status'))
+sql_queries = registry.counter(
+    'http_request_sql_queries_total', 'SQL statements executed while serving each endpoint.', ('endpoint',))
+sql_seconds = registry.counter(
+    'http_request_sql_seconds_total', 'Time spent executing SQL for each endpoint.', ('endpoint',))
+marshal_seconds = registry.counter(
+    'http_request_marshal_seconds_total', 'Time spent marshalling response objects for each endpoint.', ('endpoint',))
+serialize_seconds = registry.counter(
+    'http_request_serialize_seconds_total', 'Time spent encoding JSON responses for each endpoint.', ('endpoint',))
+
+
+def namespace():
+    '''``outgoing-invoices`` for ``/api/outgoing-invoices/<int:id>``; the first path segment otherwise.'''
+    rule = request.url_rule.rule if request.url_rule else ''
+    parts = [part for part in rule.split('/') if part]
+    if not parts:
+        return 'unmatched' if request.url_rule is None else 'root'
+    if parts[0] == 'api' and len(parts) > 1:
+        return parts[1]
+    if parts[0].startswith('<'):
+        # The static files and the single-page app catch-all.
+        return 'frontend'
+    return parts[0]
+
+
+def start_request():
+    g.timing_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    g.marshal_time = 0.0
+    g.marshal_depth = 0
+    g.serialize_time = 0.0
+
+
+def finish_request(response):
+    if 'timing_start' not in g:
+        return response
+    total = time.perf_counter() - g.timing_start
+    endpoint = request.endpoint or 'unmatched'
+
+    request_duration.observe(total, namespace())
+    requests_total.inc(endpoint, request.method, response.status_code)
+    sql_queries.inc(endpoint, amount=g.sql_count)
+    sql_seconds.inc(endpoint, amount=g.sql_time)
+    marshal_seconds.inc(endpoint, amount=g.marshal_time)
+    serialize_seconds.inc(endpoint, amount=g.serialize_time)
+
+    app_time = max(total - g.sql_time - g.marshal_time - g.serialize_time, 0)
+    response.headers['Server-Timing'] = ', '.join((
+        f'db;dur={g.sql_time * 1000:.2f};desc="{g.sql_count} queries"',
+        f'marshal;dur={g.marshal_time * 1000:.2f}',
+        f'serialize;dur={g.serialize_time * 1000:.2f}',
+        f'app;dur={app_time * 1000:.2f}',
+        f'total;dur={total * 1000:.2f}',
+    ))
+    return response
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.timing_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_time += time.perf_counter() - context.timing_start
+
+
+def timed_marshal(marshal):
+    '''Wrap a marshalling function so its time is recorded, once for the outermost call.
+
+    Nested models marshal through the same function, hence the depth
+    guard.  SQL run meanwhile (lazy loads of relationships) is already
+    counted as ``db`` and is left out.
+    '''
+    @wraps(marshal)
+    def wrapper(*args, **kwargs):
+        if not has_request_context() or 'marshal_time' not in g or g.marshal_depth:
+            return marshal(*args, **kwargs)
+        g.marshal_depth += 1
+        start, sql_time = time.perf_counter(), g.sql_time
+        try:
+            return marshal(*args, **kwargs)
+        finally:
+            g.marshal_depth -= 1
+            g.marshal_time += time.perf_counter() - start - (g.sql_time - sql_time)
+    return wrapper
+
+
+def timed_representation(representation):
+    '''Wrap a flask-restx representation so JSON encoding time is recorded.'''
+    @wraps(representation)
+    def wrapper(data, code, headers=None):
+        start = time.perf_counter()
+        response = representation(data, code, headers)
+        if 'serialize_time' in g:
+            g.serialize_time += time.perf_counter() - start
+        return response
+    return wrapper
+
+
+def init_app(app, api):
+    '''Time every request and report it as ``Server-Timing`` headers and ``/metrics`` series.
+
+    ``db`` is time spent in SQL, ``marshal`` turning objects into dicts
+    (flask-restx ``marshal``/``marshal_with`` and the fast list path),
+    ``serialize`` the JSON encoding of flask-restx responses and ``app``
+    everything else (routing, ORM hydration, the view).  The cost is a
+    couple of ``perf_counter`` calls per statement and request.
+    '''
+    if not app.config['REQUEST_TIMING']:
+        return
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    # ``marshal``, ``marshal_with`` and nested fields all end up in
+    # ``_marshal``, looked up at call time; the ``marshal`` name modules
+    # imported from flask_restx cannot be patched after the fact.
+    if not getattr(marshalling._marshal, '__wrapped__', None):
+        marshalling._marshal = timed_marshal(marshalling._marshal)
+    for mediatype, representation in list(api.representations.items()):
+        if not getattr(representation, '__wrapped__', None):
+            api.representations[mediatype] = timed_representation(representation)
@@ -0,0 +1,251 @@
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from flask import Blueprint, Response
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# Seconds; suits both pool checkout waits and request latencies.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def state(self):
+        with self.lock:
+            return dict(self.values)
+
+    def samples(self, state):
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+                for labels, value in sorted(state.items())]
+
+
+class Gauge(Metric):
+    '''A gauge whose values are read from ``callback`` at scrape time.
+
+    ``callback`` returns ``{label_values: value}``.
+    '''
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, callback):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def state(self):
+        return dict(self.callback())
+
+    def samples(self, state):
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+                for labels, value in sorted(state.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def state(self):
+        with self.lock:
+            return {labels: [list(counts), total] for labels, (counts, total) in self.series.items()}
+
+    def samples(self, state):
+        lines = []
+        bucket_names = self.labelnames + ('le',)
+        for labels, (counts, total) in sorted(state.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(bucket_names, labels + (format_value(bound),))} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    '''Metrics rendered in the Prometheus text format.
+
+    On its own a registry reports the process it lives in.  Under gunicorn
+    every worker also writes its state to ``worker-<pid>.json`` in a shared
+    directory (``share``), and a scrape adds up the files of all workers, so
+    ``/metrics`` reports the whole server whichever worker answers.  The
+    master folds the counters and histograms of an exited worker into
+    ``archive.json`` (``mark_dead``), so totals survive worker recycling;
+    gauges are summed over the live workers only.
+    '''
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.app = None
+        self.directory = None
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames, callback):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def state(self):
+        '''``{name: (type, {labels: value})}`` of this process.'''
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: (metric.type, metric.state()) for metric in metrics}
+
+    def share(self, app, directory, interval):
+        '''Write this process's state to ``directory`` every ``interval`` seconds (and on ``flush``).
+
+        Gauge callbacks read the app's engine and caches, so the state is
+        taken inside ``app``'s context.
+        '''
+        self.app = app
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        def write_periodically():
+            while True:
+                time.sleep(interval)
+                self.flush()
+
+        threading.Thread(target=write_periodically, daemon=True, name='metrics-flush').start()
+
+    def flush(self):
+        if self.directory:
+            with self.app.app_context():
+                state = self.state()
+            write_state(os.path.join(self.directory, f'worker-{os.getpid()}.json'), state)
+
+    def collect(self):
+        '''This process's live state plus, when shared, that of the other workers and the archive.'''
+        state = self.state()
+        if self.directory:
+            own = os.path.join(self.directory, f'worker-{os.getpid()}.json')
+            paths = [path for path in glob.glob(os.path.join(self.directory, 'worker-*.json')) if path != own]
+            for path in paths + [os.path.join(self.directory, 'archive.json')]:
+                merge_state(state, read_state(path) or {})
+        return state
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        state = self.collect()
+        lines = []
+        for metric in metrics:
+            lines += metric.header()
+            lines += metric.samples(state.get(metric.name, (metric.type, {}))[1])
+        return '\n'.join(lines) + '\n'
+
+
+def mark_dead(pid, directory):
+    '''Fold the counters and histograms of the exited worker ``pid`` into the archive.'''
+    path = os.path.join(directory, f'worker-{pid}.json')
+    dead = read_state(path)
+    if dead is None:
+        return
+    archive_path = os.path.join(directory, 'archive.json')
+    archive = read_state(archive_path) or {}
+    merge_state(archive, dead, gauges=False)
+    write_state(archive_path, archive)
+    os.remove(path)
+
+
+def merge_state(state, other, gauges=True):
+    '''Add the state of another process into ``state``: values are summed, histogram buckets one by one.'''
+    for name, (kind, values) in other.items():
+        if kind == 'gauge' and not gauges:
+            continue
+        merged = state.setdefault(name, (kind, {}))[1]
+        for labels, value in values.items():
+            if kind == 'histogram':
+                counts, total = merged.get(labels, ([0] * len(value[0]), 0.0))
+                merged[labels] = [[mine + theirs for mine, theirs in zip(counts, value[0])], total + value[1]]
+            else:
+                merged[labels] = merged.get(labels, 0) + value
+
+
+def write_state(path, state):
+    '''Write a registry state atomically, so a scrape never reads half a file.'''
+    payload = {name: {'type': kind, 'values': [[list(labels), value] for labels, value in values.items()]}
+               for name, (kind, values) in state.items()}
+    descriptor, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(descriptor, 'w') as output:
+        json.dump(payload, output)
+    os.replace(partial, path)
+
+
+def read_state(path):
+    try:
+        with open(path) as source:
+            payload = json.load(source)
+    except (FileNotFoundError, ValueError):
+        return None
+    return {name: (metric['type'], {tuple(labels): value for labels, value in metric['values']})
+            for name, metric in payload.items()}
+
+
+registry = Registry()
+registry.gauge('process_info', 'Worker processes reporting to this scrape.', ('pid',), lambda: {(os.getpid(),): 1})
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,5 +1,7 @@
+from datetime import datetime
 from app.extensions import db
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import relationship
 
 # (Organization, Storage, Employee, Supplier, Product, Service, IncomingInvoice,
@@ -54,7 +56,16 @@ class Product(db.Model):
     date = db.Column(db.DateTime, nullable=False)
     storage_id = db.Column(db.Integer, db.ForeignKey('storage.storage_id'), nullable=False)
     storage = db.relationship('Storage', backref=db.backref('products', lazy=True))
+    __table_args__ = (
+        # Trigram index for ``name ILIKE '%term%'`` search; PostgreSQL only.
+        db.Index('ix_product_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_product_storage_id', 'storage_id', 'product_id'),
+        db.Index('ix_product_date', 'date', 'product_id'),
+    )
 
+event.listen(Product.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
 
 class Service(db.Model):
     __tablename__ = 'service'
@@ -94,7 +105,18 @@ class IncomingInvoice(db.Model):
     contract_id = db.Column(db.Integer, db.ForeignKey('contract.contract_id'))
     responsible_person_id = db.Column(db.Integer, db.ForeignKey('employee.employee_id'))
     comment = db.Column(db.Text)
-    items = db.relationship('IncomingInvoiceItem', back_populates='invoice', cascade="all, delete-orphan")
+    # Kept equal to the sums over ``items`` by app.services.invoices.
+    total_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0, server_default='0')
+    vat_total = db.Column(db.Numeric(14, 2), nullable=False, default=0, server_default='0')
+    discount_total = db.Column(db.Numeric(14, 2), nullable=False, default=0, server_default='0')
+    line_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    items = db.relationship('IncomingInvoiceItem', back_populates='invoice', cascade="all, delete-orphan", lazy='selectin',
+                            order_by='IncomingInvoiceItem.incoming_invoice_item_id')
+    __table_args__ = (
+        db.Index('ix_incominginvoice_date', 'date', 'incoming_invoice_id'),
+        db.Index('ix_incominginvoice_counter_agent_date', 'counter_agent_id', 'date', 'incoming_invoice_id'),
+        db.Index('ix_incominginvoice_storage_date', 'storage_id', 'date', 'incoming_invoice_id'),
+    )
 
 class IncomingInvoiceItem(db.Model):
     __tablename__ = 'incominginvoiceitem'
@@ -110,6 +132,10 @@ class IncomingInvoiceItem(db.Model):
     vat_amount = db.Column(db.Numeric(10, 2), nullable=False)
     account_number = db.Column(db.String(20))
     invoice = db.relationship('IncomingInvoice', back_populates='items')
+    __table_args__ = (
+        db.Index('ix_incominginvoiceitem_invoice_id', 'incoming_invoice_id'),
+        db.Index('ix_incominginvoiceitem_product_name', 'product_name'),
+    )
 
 class OutgoingInvoice(db.Model):
     __tablename__ = 'outgoinginvoice'
@@ -123,7 +149,18 @@ class OutgoingInvoice(db.Model):
     contract_id = db.Column(db.Integer, db.ForeignKey('contract.contract_id'))
     payment_document = db.Column(db.String(255))
     comment = db.Column(db.Text)
-    items = db.relationship('OutgoingInvoiceItem', back_populates='invoice', cascade="all, delete-orphan")
+    # Kept equal to the sums over ``items`` by app.services.invoices.
+    total_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0, server_default='0')
+    vat_total = db.Column(db.Numeric(14, 2), nullable=False, default=0, server_default='0')
+    discount_total = db.Column(db.Numeric(14, 2), nullable=False, default=0, server_default='0')
+    line_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    items = db.relationship('OutgoingInvoiceItem', back_populates='invoice', cascade="all, delete-orphan", lazy='selectin',
+                            order_by='OutgoingInvoiceItem.outgoing_invoice_item_id')
+    __table_args__ = (
+        db.Index('ix_outgoinginvoice_date', 'date', 'outgoing_invoice_id'),
+        db.Index('ix_outgoinginvoice_customer_date', 'customer_id', 'date', 'outgoing_invoice_id'),
+        db.Index('ix_outgoinginvoice_storage_date', 'storage_id', 'date', 'outgoing_invoice_id'),
+    )
 
 class OutgoingInvoiceItem(db.Model):
     __tablename__ = 'outgoinginvoiceitem'
@@ -139,15 +176,125 @@ class OutgoingInvoiceItem(db.Model):
     vat_amount = db.Column(db.Numeric(10, 2), nullable=False)
     discount = db.Column(db.Numeric(10, 2), default=0)
     account_number = db.Column(db.String(20))
+    # FIFO cost of the goods sold on this line, kept by app.services.fifo.
+    cogs = db.Column(db.Numeric(12, 2))
     invoice = db.relationship('OutgoingInvoice', back_populates='items')
+    __table_args__ = (
+        db.Index('ix_outgoinginvoiceitem_invoice_id', 'outgoing_invoice_id'),
+        db.Index('ix_outgoinginvoiceitem_product_name', 'product_name'),
+    )
+
+class InvoiceNumberSeries(db.Model):
+    __tablename__ = 'invoicenumberseries'
+    series = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False)
+
+class TableVersion(db.Model):
+    '''Change counter of a reference table, bumped by every write to it (see ``services.table_versions``).'''
+    __tablename__ = 'tableversion'
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Job(db.Model):
+    '''A unit of background work, run by ``flask jobs worker`` (see ``services.jobs``).'''
+    __tablename__ = 'job'
+    job_id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.String(255))
+    result = db.Column(db.JSON)
+    result_file = db.Column(db.String(255))
+    result_type = db.Column(db.String(100))
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=1)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after', 'job_id'),
+        db.Index('ix_job_type_status', 'job_type', 'status'),
+    )
+
+class StockMovement(db.Model):
+    __tablename__ = 'stockmovement'
+    movement_id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.product_id', ondelete='CASCADE'), nullable=False)
+    storage_id = db.Column(db.Integer, db.ForeignKey('storage.storage_id'))
+    movement_date = db.Column(db.DateTime, nullable=False)
+    quantity = db.Column(db.Numeric(12, 3), nullable=False)
+    source_type = db.Column(db.String(20), nullable=False)
+    source_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_stockmovement_movement_date', 'movement_date'),
+        db.Index('ix_stockmovement_product_storage_date', 'product_id', 'storage_id', 'movement_date'),
+        db.Index('ix_stockmovement_source', 'source_type', 'source_id'),
+    )
+
+class StockCheckpoint(db.Model):
+    __tablename__ = 'stockcheckpoint'
+    checkpoint_id = db.Column(db.Integer, primary_key=True)
+    as_of = db.Column(db.DateTime, nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.product_id', ondelete='CASCADE'), nullable=False)
+    storage_id = db.Column(db.Integer, db.ForeignKey('storage.storage_id'))
+    balance = db.Column(db.Numeric(12, 3), nullable=False)
+
+class DailySales(db.Model):
+    '''Outgoing invoice lines summed per day and per customer, storage, product or in ``total`` (see ``services.rollups``).'''
+    __tablename__ = 'dailysales'
+    rollup_id = db.Column(db.Integer, primary_key=True)
+    dimension = db.Column(db.String(20), nullable=False)
+    dimension_key = db.Column(db.String(100), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    quantity = db.Column(db.Numeric(14, 3), nullable=False, default=0)
+    amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    vat = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    discount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    line_count = db.Column(db.Integer, nullable=False, default=0)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        db.UniqueConstraint('dimension', 'day', 'dimension_key', name='uq_dailysales_dimension_day_key'),
+    )
+
+class DailyPurchases(db.Model):
+    '''Incoming invoice lines summed per day and per supplier or in ``total``.'''
+    __tablename__ = 'dailypurchases'
+    rollup_id = db.Column(db.Integer, primary_key=True)
+    dimension = db.Column(db.String(20), nullable=False)
+    dimension_key = db.Column(db.String(100), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    quantity = db.Column(db.Numeric(14, 3), nullable=False, default=0)
+    amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    vat = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    discount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    line_count = db.Column(db.Integer, nullable=False, default=0)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        db.UniqueConstraint('dimension', 'day', 'dimension_key', name='uq_dailypurchases_dimension_day_key'),
+    )
 
 class Inventory(db.Model):
+    '''A FIFO cost lot: ``quantity`` bought at ``purchase_price``, ``remaining`` of it not sold yet (see ``services.fifo``).'''
     __tablename__ = 'inventory'
     inventory_id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.product_id'))
     quantity = db.Column(db.Numeric(10, 3), nullable=False)
     purchase_date = db.Column(db.DateTime, nullable=False)
     purchase_price = db.Column(db.Numeric(10, 2), nullable=False)
+    remaining = db.Column(db.Numeric(10, 3), nullable=False, default=0, server_default='0')
+    source_type = db.Column(db.String(20))
+    source_id = db.Column(db.Integer)
+    __table_args__ = (
+        db.Index('ix_inventory_product_date', 'product_id', 'purchase_date', 'inventory_id'),
+        db.Index('ix_inventory_source', 'source_type', 'source_id'),
+    )
 
 
 
@@ -0,0 +1,68 @@
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+from .extensions import db
+from .metrics import registry
+
+checkout_wait = registry.histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a connection from the pool.')
+checkout_timeouts = registry.counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts that gave up after pool_timeout.')
+invalidations = registry.counter(
+    'db_pool_invalidations_total', 'Pooled connections discarded as dead (e.g. after a database restart).')
+
+
+class TimedQueuePool(QueuePool):
+    '''QueuePool that records how long each checkout waited for a connection.'''
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            checkout_timeouts.inc()
+            raise
+        finally:
+            checkout_wait.observe(time.perf_counter() - start)
+
+
+def pool_status():
+    pool = db.engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {
+        ('size',): pool.size(),
+        ('checked_in',): pool.checkedin(),
+        ('in_use',): pool.checkedout(),
+        ('overflow',): max(pool.overflow(), 0),
+    }
+
+
+registry.gauge('db_pool_connections', 'Connections in the pool by state.', ('state',), pool_status)
+
+
+def init_app(app):
+    '''Install the timed pool and the engine hooks; call in place of ``db.init_app``.
+
+    With ``DB_PGBOUNCER`` the statement timeout cannot be a connection
+    startup option (PgBouncer in transaction mode hands the server
+    connection to other clients between transactions), so it is set with
+    ``SET LOCAL`` at the start of every transaction instead.
+    '''
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+            app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}), poolclass=TimedQueuePool
+        )
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'invalidate', lambda *args: invalidations.inc())
+
+    timeout = app.config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and app.config['DB_PGBOUNCER'] and engine.dialect.name == 'postgresql':
+        @event.listens_for(engine, 'begin')
+        def set_statement_timeout(connection):
+            connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout)}')
@@ -0,0 +1,299 @@
+import csv
+import gzip
+import io
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import Column, Integer, MetaData, Table, bindparam, exists, insert, select, update
+
+from app.extensions import db
+from app.models import Customer, Product, Storage, Supplier
+from . import fifo, ledger, product_search, table_versions
+
+# Rejected rows kept for the report; the rest are only counted.
+MAX_REPORTED_ERRORS = 1000
+
+
+class CsvImportError(Exception):
+    '''A CSV file or row that cannot be imported; the message is meant for the client.'''
+
+
+def text(length=None, required=False):
+    def parse(value, context):
+        value = (value or '').strip()
+        if not value:
+            if required:
+                raise CsvImportError('is required')
+            return None
+        if length and len(value) > length:
+            raise CsvImportError(f'is longer than {length} characters')
+        return value
+    parse.required = required
+    return parse
+
+
+def amount(required=False, default=None):
+    def parse(value, context):
+        value = (value or '').strip()
+        if not value:
+            if required:
+                raise CsvImportError('is required')
+            return default
+        try:
+            number = Decimal(value)
+        except InvalidOperation:
+            raise CsvImportError(f"'{value}' is not a number")
+        if not number.is_finite() or number < 0:
+            raise CsvImportError(f"'{value}' must be zero or positive")
+        return number
+    parse.required = required
+    return parse
+
+
+def storage(value, context):
+    value = (value or '').strip()
+    if not value:
+        raise CsvImportError('is required')
+    if not value.isdigit() or int(value) not in context['storage_ids']:
+        raise CsvImportError(f"'{value}' is not an existing storage")
+    return int(value)
+
+
+storage.required = True
+
+# For each entity: the model, the column rows are matched on, and
+# ``{column: parser}``.  A row whose key already exists updates that row.
+IMPORTS = {
+    'products': (Product, 'name', {
+        'name': text(100, required=True),
+        'description': text(),
+        'unit_price': amount(required=True),
+        'current_stock': amount(default=Decimal(0)),
+        'unit_of_measure': text(20, required=True),
+        'storage_id': storage,
+    }),
+    'customers': (Customer, 'name', {
+        'name': text(100, required=True),
+        'contact_info': text(255),
+        'address': text(),
+    }),
+    'suppliers': (Supplier, 'name', {
+        'name': text(100, required=True),
+        'contact_info': text(255),
+        'address': text(),
+    }),
+}
+
+# Stock of existing products only changes through invoices.
+INSERT_ONLY_COLUMNS = {'current_stock', 'date'}
+
+
+class _RawStream(io.RawIOBase):
+    '''Adapt any object with ``read(size)`` to ``io.BufferedReader``.'''
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_csv(stream):
+    '''Text reader over a binary ``stream``, gunzipped when it starts with the gzip magic.'''
+    buffered = io.BufferedReader(_RawStream(stream), 1 << 16)
+    if buffered.peek(2)[:2] == b'\x1f\x8b':
+        buffered = gzip.GzipFile(fileobj=buffered)
+    return io.TextIOWrapper(buffered, encoding='utf-8-sig', newline='')
+
+
+def validated_rows(reader, parsers, context, reject):
+    '''Yield ``(line, values)`` for valid rows and pass the others to ``reject``.'''
+    for row in reader:
+        line = reader.line_num
+        if None in row:
+            reject(line, 'has more fields than the header')
+            continue
+        values = {}
+        try:
+            for column, parse in parsers.items():
+                try:
+                    values[column] = parse(row.get(column), context)
+                except CsvImportError as e:
+                    raise CsvImportError(f'{column} {e}')
+        except CsvImportError as e:
+            reject(line, str(e))
+            continue
+        yield line, values
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_supported(connection):
+    return connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2'
+
+
+def staging_table(table, columns):
+    return Table(
+        f'import_{table.name}', MetaData(),
+        Column('line', Integer, nullable=False),
+        *(Column(column, table.c[column].type) for column in columns),
+        prefixes=['TEMPORARY'], postgresql_on_commit='DROP',
+    )
+
+
+def upsert_copy(table, key, batch):
+    '''Load ``batch`` with COPY into a temporary table and merge it with two set-based statements.
+
+    Returns ``(updated, inserted_rows)``; within the batch the last row of
+    each key wins.
+    '''
+    columns = list(batch[0][1])
+    staging = staging_table(table, columns)
+    connection = db.session.connection()
+    staging.create(connection)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for line, values in batch:
+        writer.writerow([line] + [values[column] for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.driver_connection.cursor()
+    cursor.copy_expert(f'COPY {staging.name} (line, {", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+    latest = (
+        select(staging).distinct(staging.c[key]).order_by(staging.c[key], staging.c.line.desc())
+    ).subquery('latest')
+    updated = db.session.execute(
+        update(table)
+        .where(table.c[key] == latest.c[key])
+        .values({column: latest.c[column] for column in columns if column not in INSERT_ONLY_COLUMNS | {key}})
+    ).rowcount
+    new_rows = select(*(latest.c[column] for column in columns)).where(
+        ~exists().where(table.c[key] == latest.c[key]))
+    inserted = db.session.execute(
+        insert(table).from_select(columns, new_rows).returning(*table.c)
+    ).mappings().all()
+    return updated, inserted
+
+
+def upsert_batched(table, key, batch):
+    '''Merge ``batch`` with a lookup of the existing keys, an executemany UPDATE and a bulk INSERT.'''
+    latest = {values[key]: values for _, values in batch}
+    primary_key = table.primary_key.columns[0]
+    existing = {}
+    keys = list(latest)
+    for start in range(0, len(keys), 500):
+        existing.update(db.session.execute(
+            select(table.c[key], primary_key).where(table.c[key].in_(keys[start:start + 500]))
+        ).all())
+
+    updates = [
+        dict({f'b_{column}': value for column, value in values.items()
+              if column not in INSERT_ONLY_COLUMNS | {key}}, b_id=existing[name])
+        for name, values in latest.items() if name in existing
+    ]
+    if updates:
+        columns = [column[2:] for column in updates[0] if column != 'b_id']
+        db.session.execute(
+            update(table).where(primary_key == bindparam('b_id'))
+            .values({column: bindparam(f'b_{column}') for column in columns}),
+            updates,
+        )
+
+    inserts = [values for name, values in latest.items() if name not in existing]
+    inserted = []
+    if inserts:
+        inserted = db.session.execute(insert(table).returning(*table.c), inserts).mappings().all()
+    return len(updates), inserted
+
+
+def record_opening_stock(products):
+    '''Post new products like ``POST /api/products/`` does: an opening movement and lot, and the autocomplete index.'''
+    ledger.record([
+        {'product_id': product['product_id'], 'storage_id': product['storage_id'],
+         'movement_date': product['date'], 'quantity': product['current_stock'] or 0,
+         'source_type': 'product', 'source_id': product['product_id']}
+        for product in products
+    ])
+    fifo.open_lots(products)
+    for product in products:
+        product_search.queue_name_change(db.session, added=(product['product_id'], product['name']))
+
+
+def import_csv(entity, stream, batch_size, on_reject=None, on_batch=None):
+    '''Import the CSV in binary ``stream`` (optionally gzipped) into ``entity``.
+
+    Rows are parsed and validated as they are read and merged
+    ``batch_size`` at a time, one transaction per batch, so memory does not
+    grow with the file.  On PostgreSQL each batch is loaded with ``COPY``;
+    other databases use batched INSERT and UPDATE statements.  Invalid rows
+    are skipped and reported with their line number.  ``on_reject(line,
+    error)`` sees every rejected row and ``on_batch(report)`` runs after each
+    commit.
+    '''
+    model, key, parsers = IMPORTS[entity]
+    table = model.__table__
+    reader = csv.DictReader(open_csv(stream))
+    try:
+        header = reader.fieldnames or []
+    except (UnicodeDecodeError, OSError, csv.Error) as e:
+        raise CsvImportError(f'Unreadable CSV file: {e}')
+    missing = [column for column, parse in parsers.items() if parse.required and column not in header]
+    if missing:
+        raise CsvImportError(f"Missing column(s): {', '.join(missing)}")
+    unknown = [column for column in header if column not in parsers]
+    if unknown:
+        raise CsvImportError(f"Unknown column(s): {', '.join(unknown)}")
+    # Columns left out of the file keep their current values on update.
+    parsers = {column: parse for column, parse in parsers.items() if column in header}
+
+    report = {'inserted': 0, 'updated': 0, 'rejected': 0, 'errors': []}
+
+    def reject(line, error):
+        report['rejected'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'error': error})
+        if on_reject:
+            on_reject(line, error)
+
+    context = {}
+    if entity == 'products':
+        context['storage_ids'] = set(db.session.execute(select(Storage.storage_id)).scalars())
+    use_copy = copy_supported(db.session.connection())
+    upsert = upsert_copy if use_copy else upsert_batched
+
+    try:
+        for batch in batches(validated_rows(reader, parsers, context, reject), batch_size):
+            if entity == 'products':
+                now = datetime.utcnow()
+                for _, values in batch:
+                    values['date'] = now
+            updated, inserted = upsert(table, key, batch)
+            if entity == 'products':
+                record_opening_stock(inserted)
+            if table.name in table_versions.VERSIONED_TABLES and (updated or inserted):
+                # Core statements bypass the flush hook that bumps the version.
+                table_versions.bump(db.session, [table.name])
+            db.session.commit()
+            report['updated'] += updated
+            report['inserted'] += len(inserted)
+            if on_batch:
+                on_batch(report)
+    except (UnicodeDecodeError, OSError, csv.Error) as e:
+        db.session.rollback()
+        raise CsvImportError(f'Unreadable CSV file after line {reader.line_num}: {e}')
+    return report
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from decimal import Decimal
+
+from flask import current_app
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from sqlalchemy import select
+
+from app.extensions import db
+from app.models import Contract, Customer, Employee, Organization, OutgoingInvoice, OutgoingInvoiceItem, Storage
+
+try:
+    import weasyprint
+except (ImportError, OSError):  # WeasyPrint is optional (and needs Pango); without it only HTML is offered
+    weasyprint = None
+
+FORMATS = {
+    'html': 'text/html; charset=utf-8',
+    'pdf': 'application/pdf',
+}
+TEMPLATE = 'invoices/outgoing.html'
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
+# Invoices loaded per query by ``load``.
+BATCH_SIZE = 500
+
+invoice_table = OutgoingInvoice.__table__
+item_table = OutgoingInvoiceItem.__table__
+
+environment = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(['html']))
+_template_version = None
+_pool = None
+
+
+class DocumentError(Exception):
+    pass
+
+
+def check_format(document_format):
+    if document_format == 'pdf' and weasyprint is None:
+        raise DocumentError('PDF rendering needs WeasyPrint (pip install weasyprint); use format=html')
+
+
+def template_version():
+    '''Digest of the template source, so editing it retires every cached document.'''
+    global _template_version
+    if _template_version is None:
+        source, _, _ = environment.loader.get_source(environment, TEMPLATE)
+        _template_version = hashlib.sha1(source.encode()).hexdigest()[:12]
+    return _template_version
+
+
+def text(value):
+    if value is None:
+        return None
+    if isinstance(value, Decimal):
+        return f'{value:f}'
+    return str(value)
+
+
+def money(value):
+    return f'{Decimal(value or 0):.2f}'
+
+
+def load(invoice_ids):
+    '''The render context of each invoice in ``invoice_ids``, in that order; unknown ids are skipped.
+
+    Plain strings and dicts only, so a context pickles cheaply to a pool
+    process and hashes to the same version wherever it is built.
+    '''
+    header = (
+        select(invoice_table, Customer.name.label('customer_name'), Customer.contact_info, Customer.address,
+               Organization.name.label('organization_name'), Storage.name.label('storage_name'),
+               Employee.first_name, Employee.last_name, Contract.contract_number)
+        .join(Customer, Customer.customer_id == invoice_table.c.customer_id)
+        .join(Organization, Organization.organization_id == invoice_table.c.organization_id)
+        .join(Storage, Storage.storage_id == invoice_table.c.storage_id)
+        .join(Employee, Employee.employee_id == invoice_table.c.responsible_person_id)
+        .outerjoin(Contract, Contract.contract_id == invoice_table.c.contract_id)
+    )
+    contexts = {}
+    for start in range(0, len(invoice_ids), BATCH_SIZE):
+        chunk = invoice_ids[start:start + BATCH_SIZE]
+        for row in db.session.execute(header.where(invoice_table.c.outgoing_invoice_id.in_(chunk))).mappings():
+            contexts[row['outgoing_invoice_id']] = {
+                'outgoing_invoice_id': row['outgoing_invoice_id'],
+                'number': row['number'],
+                'date': row['date'].isoformat(),
+                'customer': {'name': row['customer_name'], 'contact_info': row['contact_info'],
+                             'address': row['address']},
+                'organization': row['organization_name'],
+                'storage': row['storage_name'],
+                'responsible_person': f"{row['first_name']} {row['last_name']}",
+                'contract_number': row['contract_number'],
+                'payment_document': row['payment_document'],
+                'comment': row['comment'],
+                'total_amount': money(row['total_amount']),
+                'vat_total': money(row['vat_total']),
+                'discount_total': money(row['discount_total']),
+                'items': [],
+            }
+        items = db.session.execute(
+            select(item_table).where(item_table.c.outgoing_invoice_id.in_(chunk))
+            .order_by(item_table.c.outgoing_invoice_id, item_table.c.outgoing_invoice_item_id)
+        ).mappings()
+        for item in items:
+            contexts[item['outgoing_invoice_id']]['items'].append({
+                'product_name': item['product_name'],
+                'product_description': item['product_description'],
+                'quantity': text(item['quantity']),
+                'unit_of_measure': item['unit_of_measure'],
+                'unit_price': money(item['unit_price']),
+                'discount': money(item['discount']) if item['discount'] else None,
+                'vat_percentage': text(item['vat_percentage']),
+                'vat_amount': money(item['vat_amount']),
+                'total_price': money(item['total_price']),
+            })
+    return [contexts[invoice_id] for invoice_id in invoice_ids if invoice_id in contexts]
+
+
+def version(context):
+    '''Content version of a document: changes whenever anything printed on it (or the template) does.'''
+    payload = json.dumps(context, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(f'{template_version()}|{payload}'.encode()).hexdigest()[:20]
+
+
+def cache_root():
+    return current_app.config['RENDER_CACHE_DIR'] or os.path.join(tempfile.gettempdir(), 'invoice-documents')
+
+
+def cache_path(context, document_format):
+    return os.path.join(cache_root(), str(context['outgoing_invoice_id']),
+                        f'{version(context)}.{document_format}')
+
+
+def invalidate(invoice_id):
+    '''Drop every cached document of an invoice; call it after the invoice is changed or deleted.'''
+    shutil.rmtree(os.path.join(cache_root(), str(invoice_id)), ignore_errors=True)
+
+
+def render(context, document_format):
+    html = environment.get_template(TEMPLATE).render(invoice=context)
+    if document_format == 'pdf':
+        return weasyprint.HTML(string=html, base_url=TEMPLATE_DIR).write_pdf()
+    return html.encode()
+
+
+def render_to(context, document_format, path):
+    '''Render into ``path`` through a temporary file, so readers never see half a document.'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(descriptor, 'wb') as output:
+        output.write(render(context, document_format))
+    os.replace(partial, path)
+    return path
+
+
+def render_job(args):
+    return render_to(*args)
+
+
+def pool(workers):
+    '''The process pool of this (gunicorn) worker, started on the first batch.'''
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked: a forked child would inherit the
+        # worker's pooled database connections.
+        _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def discard_pool(wait=False):
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+
+
+def documents(contexts, document_format):
+    '''Paths of the documents of ``contexts``, rendering those not cached yet.
+
+    A handful is rendered inline; larger batches are spread over a pool of
+    ``RENDER_WORKERS`` processes (default: one per core).
+    '''
+    paths = [cache_path(context, document_format) for context in contexts]
+    missing = [(context, document_format, path) for context, path in zip(contexts, paths)
+               if not os.path.exists(path)]
+    workers = current_app.config['RENDER_WORKERS'] or os.cpu_count() or 1
+    if len(missing) < max(current_app.config['RENDER_POOL_MIN'], 2) or workers == 1:
+        for args in missing:
+            render_to(*args)
+    else:
+        chunksize = max(1, len(missing) // (workers * 4))
+        try:
+            list(pool(workers).map(render_job, missing, chunksize=chunksize))
+        except BrokenProcessPool:
+            # A render process died; start a new pool next time and finish
+            # this batch here.
+            discard_pool()
+            for args in missing:
+                if not os.path.exists(args[2]):
+                    render_to(*args)
+    return paths
+
+
+def batch_ids(date_from, date_to, storage_id=None, customer_id=None, limit=None):
+    '''Ids of the invoices dated ``date_from`` to ``date_to`` (both days included), in date order.'''
+    query = (
+        select(invoice_table.c.outgoing_invoice_id)
+        .where(invoice_table.c.date >= date_from, invoice_table.c.date < date_to + timedelta(days=1))
+        .order_by(invoice_table.c.date, invoice_table.c.outgoing_invoice_id)
+    )
+    if storage_id:
+        query = query.where(invoice_table.c.storage_id == storage_id)
+    if customer_id:
+        query = query.where(invoice_table.c.customer_id == customer_id)
+    return db.session.execute(query.limit(limit)).scalars().all()
+
+
+def filename(context, document_format):
+    return f"invoice-{context['number'].replace('/', '-')}.{document_format}"
+
+
+def archive(contexts, paths, document_format, output):
+    '''Write the documents as a ZIP to the binary file ``output``; PDFs are stored, HTML deflated.'''
+    compression = zipfile.ZIP_STORED if document_format == 'pdf' else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(output, 'w', compression) as bundle:
+        for context, path in zip(contexts, paths):
+            bundle.write(path, filename(context, document_format))
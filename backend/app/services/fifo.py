@@ -0,0 +1,245 @@
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import groupby
+
+from sqlalchemy import bindparam, delete, exists, func, insert, literal, select, update
+
+from app.extensions import db
+from app.models import IncomingInvoice, IncomingInvoiceItem, Inventory, OutgoingInvoice, OutgoingInvoiceItem, Product
+
+lot_table = Inventory.__table__
+sale_table = OutgoingInvoiceItem.__table__
+product_table = Product.__table__
+incoming_table = IncomingInvoice.__table__
+incoming_item_table = IncomingInvoiceItem.__table__
+outgoing_table = OutgoingInvoice.__table__
+
+CENT = Decimal('0.01')
+# Products replayed per round trip by ``recost``.
+BATCH_SIZE = 500
+
+
+def units(value, scale):
+    '''``value`` as a whole number of ``10 ** -scale`` (thousandths of a unit, cents).'''
+    return int(Decimal(str(value or 0)).scaleb(scale).to_integral_value(ROUND_HALF_UP))
+
+
+def amount(cost):
+    '''A cost in thousandths of a unit times cents, as a Decimal amount.'''
+    return Decimal(cost).scaleb(-5).quantize(CENT, ROUND_HALF_UP)
+
+
+def consume(lots, sales, fallback_price):
+    '''Cost ``sales`` of one product against its lot queue, FIFO.
+
+    ``lots`` are ``[lot_id, purchase_date, remaining, price]`` lists in
+    queue order and ``sales`` are ``(item_id, date, quantity)`` in date
+    order, with quantities in thousandths and prices in cents.  A sale takes
+    from the oldest lots bought at or before its date; what they cannot
+    cover (stock that predates the lots) is costed at ``fallback_price``.
+    ``remaining`` is decremented in place.  Returns ``{item_id: cost}``.
+    '''
+    costs = {}
+    head = available = 0
+    for item_id, day, quantity in sales:
+        while available < len(lots) and lots[available][1] <= day:
+            available += 1
+        cost = 0
+        while quantity > 0 and head < available:
+            lot = lots[head]
+            take = min(quantity, lot[2])
+            cost += take * lot[3]
+            lot[2] -= take
+            quantity -= take
+            if lot[2] <= 0:
+                head += 1
+        costs[item_id] = cost + quantity * fallback_price
+    return costs
+
+
+def sales_by_product():
+    '''Outgoing lines joined to their invoice and, by name, to their product.'''
+    return (
+        sale_table
+        .join(outgoing_table, outgoing_table.c.outgoing_invoice_id == sale_table.c.outgoing_invoice_id)
+        .join(product_table, product_table.c.name == sale_table.c.product_name)
+    )
+
+
+def lot_rows(*where):
+    return db.session.execute(
+        select(lot_table.c.product_id, lot_table.c.inventory_id, lot_table.c.purchase_date,
+               lot_table.c.quantity, lot_table.c.remaining, lot_table.c.purchase_price)
+        .where(*where)
+        .order_by(lot_table.c.product_id, lot_table.c.purchase_date, lot_table.c.inventory_id)
+    ).all()
+
+
+def sale_rows(*where):
+    return db.session.execute(
+        select(product_table.c.product_id, sale_table.c.outgoing_invoice_item_id, outgoing_table.c.date,
+               sale_table.c.quantity, sale_table.c.cogs)
+        .select_from(sales_by_product())
+        .where(*where)
+        .order_by(product_table.c.product_id, outgoing_table.c.date, sale_table.c.outgoing_invoice_item_id)
+    ).all()
+
+
+def run(lots, sales, full):
+    '''Replay ``sales`` against ``lots`` per product and write back what changed.
+
+    With ``full`` the lots start from their purchased ``quantity``;
+    otherwise from what is ``remaining``, which continues the queue after
+    the sales already costed.
+    '''
+    product_ids = {row[0] for row in lots} | {row[0] for row in sales}
+    prices = dict(db.session.execute(
+        select(product_table.c.product_id, product_table.c.unit_price)
+        .where(product_table.c.product_id.in_(product_ids))
+    ).all()) if product_ids else {}
+    lots_of = {product_id: list(rows) for product_id, rows in groupby(lots, key=lambda row: row[0])}
+    sales_of = {product_id: list(rows) for product_id, rows in groupby(sales, key=lambda row: row[0])}
+
+    lot_updates, sale_updates = [], []
+    for product_id in sorted(product_ids):
+        rows = lots_of.get(product_id, [])
+        queue = [[lot_id, day, units(quantity if full else remaining, 3), units(price, 2)]
+                 for _, lot_id, day, quantity, remaining, price in rows]
+        product_sales = sales_of.get(product_id, [])
+        costs = consume(queue, [(item_id, day, units(quantity, 3)) for _, item_id, day, quantity, _ in product_sales],
+                        units(prices.get(product_id), 2))
+        for (_, lot_id, _, _, remaining, _), (_, _, left, _) in zip(rows, queue):
+            if left != units(remaining, 3):
+                lot_updates.append({'b_id': lot_id, 'b_remaining': Decimal(left).scaleb(-3)})
+        for _, item_id, _, _, cogs in product_sales:
+            cost = amount(costs[item_id])
+            if cogs is None or Decimal(str(cogs)) != cost:
+                sale_updates.append({'b_id': item_id, 'b_cogs': cost})
+
+    if lot_updates:
+        db.session.execute(
+            update(lot_table).where(lot_table.c.inventory_id == bindparam('b_id'))
+            .values(remaining=bindparam('b_remaining')),
+            lot_updates,
+        )
+    if sale_updates:
+        db.session.execute(
+            update(sale_table).where(sale_table.c.outgoing_invoice_item_id == bindparam('b_id'))
+            .values(cogs=bindparam('b_cogs')),
+            sale_updates,
+        )
+    return len(lot_updates), len(sale_updates)
+
+
+def recost(product_ids, batch_size=BATCH_SIZE):
+    '''Replay the whole history of ``product_ids``, e.g. after a back-dated invoice.
+
+    Reads every lot and sale of ``batch_size`` products per round trip and
+    writes only the lots and lines whose values changed.  Returns the number
+    of ``(lots, lines)`` updated.
+    '''
+    product_ids = sorted(set(product_ids))
+    lots_changed = lines_changed = 0
+    for start in range(0, len(product_ids), batch_size):
+        chunk = product_ids[start:start + batch_size]
+        changed = run(lot_rows(lot_table.c.product_id.in_(chunk)),
+                      sale_rows(product_table.c.product_id.in_(chunk)), full=True)
+        lots_changed += changed[0]
+        lines_changed += changed[1]
+    return lots_changed, lines_changed
+
+
+def open_lots(products):
+    '''Opening lots for new products, from ``current_stock`` at ``unit_price``.'''
+    rows = [
+        {'product_id': product['product_id'], 'quantity': product['current_stock'],
+         'remaining': product['current_stock'], 'purchase_date': product['date'],
+         'purchase_price': product['unit_price'], 'source_type': 'product', 'source_id': product['product_id']}
+        for product in products if (product['current_stock'] or 0) > 0
+    ]
+    if rows:
+        db.session.execute(insert(lot_table), rows)
+
+
+def add_lots(invoice_ids, product_ids=None):
+    '''One lot per line of the incoming invoices ``invoice_ids``, bought at the invoice date and line price.'''
+    items = incoming_item_table.c
+    query = (
+        select(product_table.c.product_id, items.quantity, items.quantity, incoming_table.c.date,
+               items.unit_price, literal('incoming'), incoming_table.c.incoming_invoice_id)
+        .select_from(incoming_item_table
+                     .join(incoming_table, incoming_table.c.incoming_invoice_id == items.incoming_invoice_id)
+                     .join(product_table, product_table.c.name == items.product_name))
+        .where(incoming_table.c.incoming_invoice_id.in_(invoice_ids))
+        .order_by(items.incoming_invoice_item_id)
+    )
+    if product_ids is not None:
+        query = query.where(product_table.c.product_id.in_(product_ids))
+    db.session.execute(insert(lot_table).from_select(
+        ['product_id', 'quantity', 'remaining', 'purchase_date', 'purchase_price', 'source_type', 'source_id'],
+        query,
+    ))
+
+
+def drop_lots(invoice_id, product_ids=None):
+    statement = delete(lot_table).where(lot_table.c.source_type == 'incoming', lot_table.c.source_id == invoice_id)
+    if product_ids is not None:
+        statement = statement.where(lot_table.c.product_id.in_(product_ids))
+    db.session.execute(statement)
+
+
+def replace_lots(invoice_id, product_ids):
+    '''Re-create the lots ``product_ids`` hold from a patched incoming invoice and replay those products.'''
+    if not product_ids:
+        return
+    drop_lots(invoice_id, product_ids)
+    add_lots([invoice_id], product_ids)
+    recost(product_ids)
+
+
+def receive(invoice_ids):
+    '''Add the lots of new incoming invoices.
+
+    A lot dated at or before a sale of its product changes what that sale
+    consumed, so those products are replayed in full.
+    '''
+    add_lots(invoice_ids)
+    sold_since = (
+        select(sale_table.c.outgoing_invoice_item_id)
+        .select_from(sales_by_product())
+        .where(product_table.c.product_id == lot_table.c.product_id,
+               outgoing_table.c.date >= lot_table.c.purchase_date)
+    )
+    backdated = db.session.execute(
+        select(lot_table.c.product_id).distinct()
+        .where(lot_table.c.source_type == 'incoming', lot_table.c.source_id.in_(invoice_ids), exists(sold_since))
+    ).scalars().all()
+    recost(backdated)
+
+
+def issue(invoice_ids):
+    '''Cost the lines of new outgoing invoices from the open lots of their products.
+
+    Products that already have a sale dated after one of the new lines are
+    replayed in full; for the others the new lines simply continue the
+    queue.
+    '''
+    new_lines = sale_table.c.outgoing_invoice_id.in_(invoice_ids)
+    new_sales = sale_rows(new_lines)
+    first_new = {}
+    for product_id, _, day, _, _ in new_sales:
+        first_new.setdefault(product_id, day)
+    if not first_new:
+        return
+    last_old = dict(db.session.execute(
+        select(product_table.c.product_id, func.max(outgoing_table.c.date))
+        .select_from(sales_by_product())
+        .where(~new_lines, product_table.c.product_id.in_(list(first_new)))
+        .group_by(product_table.c.product_id)
+    ).all())
+    backdated = {product_id for product_id, day in first_new.items()
+                 if last_old.get(product_id) is not None and last_old[product_id] > day}
+    appended = sorted(set(first_new) - backdated)
+    if appended:
+        run(lot_rows(lot_table.c.product_id.in_(appended), lot_table.c.remaining > 0),
+            [row for row in new_sales if row[0] not in backdated], full=False)
+    recost(backdated)
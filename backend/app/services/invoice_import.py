@@ -0,0 +1,135 @@
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.extensions import db
+from . import invoices, stock
+
+
+class PayloadError(Exception):
+    '''Stands in for a payload that could not be parsed, so it is rejected with the others.'''
+
+
+def validate_payloads(payloads, prepare):
+    '''Validate ``(index, payload)`` pairs before any of them is written.
+
+    Returns ``(valid, rejected)`` where ``valid`` holds ``(index, prepared)``
+    pairs and ``rejected`` maps indexes to their result entries.
+    '''
+    valid, rejected = [], {}
+    for index, data in payloads:
+        if isinstance(data, PayloadError):
+            rejected[index] = {'index': index, 'error': str(data)}
+            continue
+        if not isinstance(data, dict):
+            rejected[index] = {'index': index, 'error': 'Invoice must be a JSON object'}
+            continue
+        try:
+            valid.append((index, prepare(data)))
+        except invoices.InvoiceError as e:
+            rejected[index] = {'index': index, 'error': str(e)}
+    return valid, rejected
+
+
+def screen_outgoing(batch):
+    '''Split an outgoing batch into invoices that fit the stock and those that do not.
+
+    Invoices are checked in order against one in-memory copy of the stock,
+    so an invoice is rejected when the invoices before it in the batch have
+    already used up what it needs.
+    '''
+    names = {line['product_name'] for _, (_, lines) in batch for line in lines}
+    available = {name: product.current_stock or 0 for name, product in stock.products_by_name(names).items()}
+
+    accepted, rejected = [], {}
+    for index, prepared in batch:
+        needed = invoices.line_quantities(prepared[1])
+        error = None
+        for name, quantity in needed.items():
+            if name not in available:
+                error = f"Product with name '{name}' not found"
+            elif available[name] < quantity:
+                error = f"Not enough stock for product {name}. Available: {available[name]}, Requested: {quantity}"
+            if error:
+                break
+        if error:
+            rejected[index] = {'index': index, 'error': error}
+            continue
+        for name, quantity in needed.items():
+            available[name] -= quantity
+        accepted.append((index, prepared))
+    return accepted, rejected
+
+
+def validated_batches(payloads, batch_size, prepare, results):
+    '''Yield the valid invoices of ``payloads`` in batches of ``batch_size``, recording rejects in ``results``.
+
+    A list is already in memory, so all of it is validated before the first
+    batch is yielded; a stream is validated one batch at a time as it is read.
+    '''
+    if isinstance(payloads, list):
+        valid, rejected = validate_payloads(enumerate(payloads), prepare)
+        results.update(rejected)
+        for start in range(0, len(valid), batch_size):
+            yield valid[start:start + batch_size]
+        return
+    numbered = enumerate(payloads)
+    while chunk := list(islice(numbered, batch_size)):
+        valid, rejected = validate_payloads(chunk, prepare)
+        results.update(rejected)
+        yield valid
+
+
+def import_invoices(payloads, batch_size, prepare, insert, id_attribute, screen=None):
+    '''Create invoices from ``payloads``, a list or a stream, committing every ``batch_size`` invoices.
+
+    A streamed body is pulled one batch at a time, so it is never held in
+    memory whole.  Each batch is written with the set-based insert of a
+    single create, so stock updates are summed per product across the
+    batch.  A batch that fails is rolled back on its own and the import
+    carries on.
+    '''
+    results = {}
+    for batch in validated_batches(payloads, batch_size, prepare, results):
+        try:
+            if screen:
+                batch, rejected = screen(batch)
+                results.update(rejected)
+            if not batch:
+                continue
+            created = insert([prepared for _, prepared in batch])
+            entries = [
+                {'index': index, 'id': getattr(invoice, id_attribute), 'number': invoice.number}
+                for (index, _), invoice in zip(batch, created)
+            ]
+            db.session.commit()
+        except (invoices.InvoiceError, SQLAlchemyError) as e:
+            db.session.rollback()
+            if isinstance(e, invoices.InvoiceError):
+                error = f'Batch failed: {e}'
+            else:
+                # The driver's message carries the statement and its parameters.
+                current_app.logger.exception('Bulk invoice import batch failed')
+                error = 'Batch failed: database error'
+            for index, _ in batch:
+                results[index] = {'index': index, 'error': error}
+            continue
+        results.update((entry['index'], entry) for entry in entries)
+
+    ordered = [results[index] for index in sorted(results)]
+    created_count = sum(1 for entry in ordered if 'error' not in entry)
+    return {'created': created_count, 'rejected': len(ordered) - created_count, 'results': ordered}
+
+
+def import_incoming_invoices(payloads, batch_size):
+    return import_invoices(
+        payloads, batch_size, invoices.prepare_incoming, invoices.insert_incoming_invoices, 'incoming_invoice_id'
+    )
+
+
+def import_outgoing_invoices(payloads, batch_size):
+    return import_invoices(
+        payloads, batch_size, invoices.prepare_outgoing, invoices.insert_outgoing_invoices, 'outgoing_invoice_id',
+        screen=screen_outgoing,
+    )
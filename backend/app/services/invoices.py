@@ -0,0 +1,585 @@
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from flask_restx import inputs
+from sqlalchemy import bindparam, delete, insert, select, update
+
+from app.extensions import db
+from app.models import (
+    Contract, Employee, IncomingInvoice, IncomingInvoiceItem, Operation, Organization, OutgoingInvoice,
+    OutgoingInvoiceItem, Storage,
+)
+from . import fifo, ledger, reference_cache, rollups, stock
+from .numbering import allocator
+
+INCOMING_HEADER_FIELDS = (
+    'date', 'counter_agent_id', 'operation_id', 'contract_id', 'organization_id',
+    'storage_id', 'responsible_person_id', 'comment',
+)
+OUTGOING_HEADER_FIELDS = (
+    'date', 'customer_id', 'organization_id', 'contract_id', 'storage_id',
+    'responsible_person_id', 'payment_document', 'comment',
+)
+INCOMING_REQUIRED_FIELDS = ('date', 'operation_id')
+OUTGOING_REQUIRED_FIELDS = ('date', 'customer_id', 'organization_id', 'storage_id', 'responsible_person_id')
+LINE_REQUIRED_FIELDS = ('product_name', 'quantity', 'unit_of_measure', 'unit_price')
+REFERENCE_FIELDS = {
+    'organization_id': Organization,
+    'storage_id': Storage,
+    'responsible_person_id': Employee,
+    'operation_id': Operation,
+    'contract_id': Contract,
+}
+
+CENT = Decimal('0.01')
+MILLI = Decimal('0.001')
+
+
+class InvoiceError(Exception):
+    '''An invoice payload that cannot be applied; the message is meant for the client.'''
+
+
+def parse_datetime(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return inputs.datetime_from_iso8601(value).replace(tzinfo=None)
+    except ValueError:
+        raise InvoiceError(f"Invalid date '{value}'")
+
+
+def to_decimal(value, field):
+    try:
+        return Decimal(str(value))
+    except (TypeError, ValueError, InvalidOperation):
+        raise InvoiceError(f"Invalid {field} '{value}'")
+
+
+def cents(value):
+    return to_decimal(value, 'amount').quantize(CENT, ROUND_HALF_UP)
+
+
+def vat_rate(value):
+    try:
+        return Decimal(str(value if value is not None else 20))
+    except (TypeError, ValueError, InvalidOperation):
+        return Decimal('20')
+
+
+def require(data, fields):
+    missing = [field for field in fields if data.get(field) in (None, '')]
+    if missing:
+        raise InvoiceError(f"Missing required field(s): {', '.join(missing)}")
+
+
+def incoming_line(item_data):
+    '''Column values of an ``IncomingInvoiceItem`` built from a request line.'''
+    require(item_data, LINE_REQUIRED_FIELDS)
+    quantity = to_decimal(item_data['quantity'], 'quantity')
+    unit_price = to_decimal(item_data['unit_price'], 'unit_price')
+    vat_percentage = vat_rate(item_data.get('vat_percentage'))
+    total_price = quantity * unit_price
+    return {
+        'product_name': item_data['product_name'],
+        'product_description': item_data.get('product_description'),
+        'quantity': quantity,
+        'unit_of_measure': item_data['unit_of_measure'],
+        'unit_price': unit_price,
+        'total_price': cents(total_price),
+        'vat_percentage': vat_percentage,
+        'vat_amount': cents(total_price / 6) if vat_percentage > 0 else Decimal('0'),
+        'account_number': item_data.get('account_number'),
+    }
+
+
+def outgoing_line(item_data):
+    '''Column values of an ``OutgoingInvoiceItem`` built from a request line.'''
+    require(item_data, LINE_REQUIRED_FIELDS)
+    quantity = to_decimal(item_data['quantity'], 'quantity')
+    unit_price = to_decimal(item_data['unit_price'], 'unit_price')
+    vat_percentage = vat_rate(item_data.get('vat_percentage'))
+    total_price = quantity * unit_price
+    vat_amount = cents(total_price / 6) if vat_percentage > 0 else Decimal('0')
+
+    discount = to_decimal(item_data.get('discount') or '0', 'discount')
+    if discount > 0:
+        total_price = total_price * (1 - discount / 100)
+
+    return {
+        'product_name': item_data['product_name'],
+        'product_description': item_data.get('product_description'),
+        'quantity': quantity,
+        'unit_of_measure': item_data['unit_of_measure'],
+        'unit_price': unit_price,
+        'total_price': cents(total_price),
+        'vat_percentage': vat_percentage,
+        'vat_amount': vat_amount,
+        'discount': discount,
+        'account_number': item_data.get('account_number'),
+    }
+
+
+def line_amounts(line):
+    '''``(amount, vat, discount)`` of a line, in cents like the item columns store them.
+
+    ``discount`` is what a discounted line would have cost at ``quantity *
+    unit_price``, minus its ``total_price``.
+    '''
+    amount = cents(line['total_price'])
+    discount = Decimal(0)
+    if (line.get('discount') or 0) > 0:
+        gross = to_decimal(line['quantity'], 'quantity').quantize(MILLI, ROUND_HALF_UP) * cents(line['unit_price'])
+        discount = cents(gross - amount)
+    return amount, cents(line['vat_amount']), discount
+
+
+def invoice_totals(lines):
+    '''Header totals of ``lines``, summed from the amounts as the item columns store them.'''
+    total_amount = vat_total = discount_total = Decimal(0)
+    for line in lines:
+        amount, vat, discount = line_amounts(line)
+        total_amount += amount
+        vat_total += vat
+        discount_total += discount
+    return {
+        'total_amount': total_amount,
+        'vat_total': vat_total,
+        'discount_total': discount_total,
+        'line_count': len(lines),
+    }
+
+
+def rollup_lines(lines):
+    '''``lines`` as the ``(product_name, quantity, amount, vat, discount)`` tuples ``rollups`` sums.'''
+    return [
+        (line['product_name'], to_decimal(line['quantity'], 'quantity').quantize(MILLI, ROUND_HALF_UP),
+         *line_amounts(line))
+        for line in lines
+    ]
+
+
+def stored_lines(item_model, id_column, invoice_id):
+    '''The lines stored for one invoice in line order, as mappings with the keys ``incoming_line``/``outgoing_line`` use.'''
+    table = item_model.__table__
+    return db.session.execute(
+        select(table).where(table.c[id_column] == invoice_id).order_by(*table.primary_key)
+    ).mappings().all()
+
+
+def diff_lines(stored, submitted, lines, item_key):
+    '''Match the ``lines`` built from ``submitted`` request lines against the ``stored`` ones, in one pass.
+
+    A request line carrying a stored line's id (``item_key``) updates that
+    line; the others take the stored lines of the same product in line
+    order.  Returns ``(updates, inserts, deletes)``: ``(row, line)`` pairs
+    whose values differ, lines without a match, and rows left unmatched.
+    '''
+    by_id = {row[item_key]: row for row in stored}
+    matched = [None] * len(lines)
+    for index, item_data in enumerate(submitted):
+        item_id = item_data.get(item_key)
+        if item_id is None:
+            continue
+        if by_id.get(item_id) is None:
+            raise InvoiceError(f'Invoice line {item_id} not found on this invoice')
+        matched[index] = by_id[item_id]
+        by_id[item_id] = None
+
+    unclaimed = defaultdict(list)
+    for row in reversed(stored):
+        if by_id[row[item_key]] is not None:
+            unclaimed[row['product_name']].append(row)
+    updates, inserts = [], []
+    for index, line in enumerate(lines):
+        row = matched[index]
+        if row is None and unclaimed[line['product_name']]:
+            row = unclaimed[line['product_name']].pop()
+        if row is None:
+            inserts.append(line)
+        elif any(row[column] != value for column, value in line.items()):
+            updates.append((row, line))
+    deletes = [row for rows in unclaimed.values() for row in rows]
+    return updates, inserts, deletes
+
+
+def write_line_changes(item_model, id_column, invoice_id, updates, inserts, deletes):
+    '''Apply a ``diff_lines`` result with at most one DELETE, one executemany UPDATE and one INSERT.'''
+    table = item_model.__table__
+    key = list(table.primary_key)[0]
+    if deletes:
+        db.session.execute(delete(table).where(key.in_([row[key.name] for row in deletes])))
+    if updates:
+        columns = list(updates[0][1])
+        db.session.execute(
+            update(table).where(key == bindparam('b_id'))
+            .values({column: bindparam(f'b_{column}') for column in columns}),
+            [dict({f'b_{column}': line[column] for column in columns}, b_id=row[key.name]) for row, line in updates],
+        )
+    insert_lines(item_model, id_column, [(invoice_id, inserts)])
+
+
+def line_deltas(updates, inserts, deletes):
+    '''Net quantity change per product name of a ``diff_lines`` result; every product touched is a key.'''
+    return stock.quantities_by_name(
+        [(line['product_name'], line['quantity']) for line in inserts]
+        + [(line['product_name'], line['quantity']) for _, line in updates]
+        + [(row['product_name'], -row['quantity']) for row, _ in updates]
+        + [(row['product_name'], -row['quantity']) for row in deletes]
+    )
+
+
+def named_product_ids(names):
+    return [product.product_id for product in stock.products_by_name(names).values()]
+
+
+def store_totals(invoice, totals):
+    for key, value in totals.items():
+        setattr(invoice, key, value)
+
+
+def check_references(values):
+    '''Make sure referenced organizations, storages, etc. exist; lookups go through the reference cache.'''
+    for field, model in REFERENCE_FIELDS.items():
+        value = values.get(field)
+        if value is None:
+            continue
+        try:
+            value = values[field] = int(value)
+        except (TypeError, ValueError):
+            raise InvoiceError(f"Invalid {field} '{value}'")
+        if not reference_cache.exists(model, value):
+            raise InvoiceError(f'{model.__name__} {value} not found')
+
+
+def header_values(data, fields):
+    values = {field: data[field] for field in fields if field in data}
+    if 'date' in values:
+        values['date'] = parse_datetime(values['date'])
+    check_references(values)
+    return values
+
+
+def apply_header(invoice, data, fields):
+    for key, value in header_values(data, fields).items():
+        setattr(invoice, key, value)
+
+
+def line_quantities(lines):
+    return stock.quantities_by_name((line['product_name'], line['quantity']) for line in lines)
+
+
+def item_quantities(items):
+    return stock.quantities_by_name((item.product_name, item.quantity) for item in items)
+
+
+def insert_lines(model, invoice_column, invoice_lines):
+    '''Insert the lines of every ``(invoice_id, lines)`` pair with one executemany INSERT.'''
+    rows = [dict(line, **{invoice_column: invoice_id}) for invoice_id, lines in invoice_lines for line in lines]
+    if rows:
+        db.session.execute(insert(model), rows)
+
+
+def post_movements(source_type, id_attribute, invoice_lines, product_ids, sign):
+    '''Write one ledger movement per invoice and product of ``(invoice, lines)`` pairs.'''
+    ledger.record([
+        {
+            'product_id': product_ids[name],
+            'storage_id': invoice.storage_id,
+            'movement_date': invoice.date,
+            'quantity': sign * quantity,
+            'source_type': source_type,
+            'source_id': getattr(invoice, id_attribute),
+        }
+        for invoice, lines in invoice_lines
+        for name, quantity in line_quantities(lines).items()
+    ])
+
+
+def receive_lines(invoice_lines):
+    '''Put the products of incoming ``(invoice, lines)`` pairs into stock.
+
+    Unknown products are created; quantities are summed per product across
+    all invoices, and each product ends up at the date and storage of the
+    last invoice that received it.  Returns ``{product_name: product_id}``.
+    '''
+    quantities = line_quantities(line for _, lines in invoice_lines for line in lines)
+    products = stock.products_by_name(quantities)
+
+    placement = {}
+    new_products = {}
+    for invoice, lines in invoice_lines:
+        for line in lines:
+            name = line['product_name']
+            placement[name] = (invoice.date, invoice.storage_id)
+            if name not in products and name not in new_products:
+                new_products[name] = {
+                    'name': name,
+                    'description': line['product_description'],
+                    'unit_price': line['unit_price'],
+                    'unit_of_measure': line['unit_of_measure'],
+                    'current_stock': quantities[name],
+                }
+    for name, row in new_products.items():
+        row['date'], row['storage_id'] = placement[name]
+    product_ids = {name: product.product_id for name, product in products.items()}
+    product_ids.update(stock.create_products(list(new_products.values())))
+    stock.receive_stock({
+        products[name].product_id: (quantity, *placement[name])
+        for name, quantity in quantities.items() if name in products
+    })
+    return product_ids
+
+
+def issue_lines(lines, returned=None):
+    '''Take stock for outgoing ``lines``, refusing to oversell.
+
+    ``returned`` maps product names to quantities that go back to stock
+    first (the previous lines of a patched invoice).  Duplicate lines and
+    returns are folded into one net change per product before the atomic
+    conditional decrement in ``stock.take_stock``.  Returns
+    ``{product_name: product_id}``.
+    '''
+    returned = returned or {}
+    quantities = line_quantities(lines)
+    products = stock.products_by_name(set(quantities) | set(returned))
+
+    missing = [name for name in quantities if name not in products]
+    if missing:
+        raise InvoiceError(f"Product with name '{missing[0]}' not found")
+
+    deltas = defaultdict(Decimal)
+    for name, quantity in returned.items():
+        if name in products:
+            deltas[products[name].product_id] += quantity
+    for name, quantity in quantities.items():
+        deltas[products[name].product_id] -= quantity
+
+    refused = stock.take_stock(deltas)
+    if refused:
+        available = stock.stock_levels(refused)
+        name = next(name for name, product in products.items() if product.product_id == refused[0])
+        raise InvoiceError(
+            f"Not enough stock for product {name}. "
+            f"Available: {available[refused[0]] + returned.get(name, 0)}, Requested: {quantities[name]}"
+        )
+    return {name: product.product_id for name, product in products.items()}
+
+
+def take_back(quantities, names):
+    '''Remove received ``{product_id: quantity}`` from stock, refusing to go below zero.
+
+    Goods that were already issued cannot be un-received, so deleting a
+    receipt or lowering a received quantity goes through the same atomic
+    conditional decrement as a sale.  ``names`` maps product ids to names
+    for the error message.
+    '''
+    refused = stock.take_stock({product_id: -quantity for product_id, quantity in quantities.items()})
+    if refused:
+        available = stock.stock_levels(refused)
+        product_id = refused[0]
+        raise InvoiceError(
+            f"Not enough stock to take back product {names.get(product_id, product_id)}. "
+            f"Available: {available[product_id]}, Requested: {quantities[product_id]}"
+        )
+
+
+def prepare_incoming(data):
+    '''Validate an incoming invoice payload into ``(header, lines)``; only references are looked up.'''
+    require(data, INCOMING_REQUIRED_FIELDS)
+    return header_values(data, INCOMING_HEADER_FIELDS), [incoming_line(item_data) for item_data in data.get('items') or []]
+
+
+def prepare_outgoing(data):
+    '''Validate an outgoing invoice payload into ``(header, lines)``; only references are looked up.'''
+    require(data, OUTGOING_REQUIRED_FIELDS)
+    return header_values(data, OUTGOING_HEADER_FIELDS), [outgoing_line(item_data) for item_data in data.get('items') or []]
+
+
+def insert_incoming_invoices(prepared):
+    '''Create every ``(header, lines)`` in ``prepared`` with a fixed number of statements.'''
+    new_invoices = [
+        IncomingInvoice(number=allocator.allocate('inv', header.get('organization_id'), header['date']),
+                        **header, **invoice_totals(lines))
+        for header, lines in prepared
+    ]
+    db.session.add_all(new_invoices)
+    db.session.flush()
+
+    invoice_lines = [(invoice, lines) for invoice, (_, lines) in zip(new_invoices, prepared)]
+    product_ids = receive_lines(invoice_lines)
+    post_movements('incoming', 'incoming_invoice_id', invoice_lines, product_ids, 1)
+    insert_lines(IncomingInvoiceItem, 'incoming_invoice_id',
+                 [(invoice.incoming_invoice_id, lines) for invoice, lines in invoice_lines])
+    fifo.receive([invoice.incoming_invoice_id for invoice, _ in invoice_lines])
+    rollups.post(rollups.PURCHASES, [(invoice, rollup_lines(lines)) for invoice, lines in invoice_lines])
+    return new_invoices
+
+
+def insert_outgoing_invoices(prepared):
+    '''Create every ``(header, lines)`` in ``prepared`` with a fixed number of statements.'''
+    # Numbers are handed out once the stock check has passed, so a refused
+    # invoice does not leave a gap in the series.
+    allocator.prefetch('out', [(header.get('organization_id'), header['date']) for header, _ in prepared])
+    product_ids = issue_lines([line for _, lines in prepared for line in lines])
+    new_invoices = [
+        OutgoingInvoice(number=allocator.allocate('out', header.get('organization_id'), header['date']),
+                        **header, **invoice_totals(lines))
+        for header, lines in prepared
+    ]
+    db.session.add_all(new_invoices)
+    db.session.flush()
+
+    invoice_lines = [(invoice, lines) for invoice, (_, lines) in zip(new_invoices, prepared)]
+    post_movements('outgoing', 'outgoing_invoice_id', invoice_lines, product_ids, -1)
+    insert_lines(OutgoingInvoiceItem, 'outgoing_invoice_id',
+                 [(invoice.outgoing_invoice_id, lines) for invoice, lines in invoice_lines])
+    fifo.issue([invoice.outgoing_invoice_id for invoice, _ in invoice_lines])
+    rollups.post(rollups.SALES, [(invoice, rollup_lines(lines)) for invoice, lines in invoice_lines])
+    return new_invoices
+
+
+def create_incoming_invoice(data):
+    return insert_incoming_invoices([prepare_incoming(data)])[0]
+
+
+def create_outgoing_invoice(data):
+    return insert_outgoing_invoices([prepare_outgoing(data)])[0]
+
+
+def moved(invoice, placement):
+    return (invoice.date, invoice.storage_id) != placement
+
+
+def update_incoming_invoice(invoice, data):
+    '''Patch an incoming invoice; with ``items``, only the lines that differ are written.
+
+    Stock, ledger, rollups and FIFO lots change by the net difference of
+    the changed lines, so patching one line of a long invoice touches that
+    line and its product only.
+    '''
+    stored = stored_lines(IncomingInvoiceItem, 'incoming_invoice_id', invoice.incoming_invoice_id)
+    posted_lines = rollup_lines(stored)
+    posted = rollups.posting(rollups.PURCHASES, invoice, posted_lines)
+    placement = (invoice.date, invoice.storage_id)
+    apply_header(invoice, data, INCOMING_HEADER_FIELDS)
+    if 'items' not in data:
+        if moved(invoice, placement):
+            ledger.move('incoming', invoice.incoming_invoice_id, invoice.date, invoice.storage_id)
+        if invoice.date != placement[0]:
+            fifo.replace_lots(invoice.incoming_invoice_id, named_product_ids(name for name, *_ in posted_lines))
+        rollups.change(rollups.PURCHASES, posted, rollups.posting(rollups.PURCHASES, invoice, posted_lines))
+        return invoice
+
+    submitted = data['items'] or []
+    lines = [incoming_line(item_data) for item_data in submitted]
+    updates, inserts, deletes = diff_lines(stored, submitted, lines, 'incoming_invoice_item_id')
+    write_line_changes(IncomingInvoiceItem, 'incoming_invoice_id', invoice.incoming_invoice_id,
+                       updates, inserts, deletes)
+
+    deltas = line_deltas(updates, inserts, deletes)
+    product_ids = restock(invoice, deltas, inserts + [line for _, line in updates])
+    if moved(invoice, placement):
+        ledger.move('incoming', invoice.incoming_invoice_id, invoice.date, invoice.storage_id)
+    ledger.record_quantities('incoming', invoice.incoming_invoice_id, invoice.date, invoice.storage_id, {
+        product_ids[name]: delta for name, delta in deltas.items() if name in product_ids
+    })
+    store_totals(invoice, invoice_totals(lines))
+    rollups.change(rollups.PURCHASES, posted, rollups.posting(rollups.PURCHASES, invoice, rollup_lines(lines)))
+    touched = set(product_ids.values())
+    if invoice.date != placement[0]:
+        # Every lot of the invoice changes date, not only the patched lines'.
+        touched.update(named_product_ids({row['product_name'] for row in stored} | set(deltas)
+                                         | {line['product_name'] for line in lines}))
+    fifo.replace_lots(invoice.incoming_invoice_id, sorted(touched))
+    db.session.expire(invoice, ['items'])
+    return invoice
+
+
+def restock(invoice, deltas, lines):
+    '''Apply the net ``{product_name: delta}`` of a patched incoming invoice to ``current_stock``.
+
+    Existing products are received or taken back; products the invoice
+    names for the first time are created from their line.  Raises
+    ``InvoiceError`` when taking back would make stock negative.  Returns
+    ``{product_name: product_id}`` for every product in ``deltas``.
+    '''
+    products = stock.products_by_name(deltas)
+    new_products = {}
+    for line in lines:
+        name = line['product_name']
+        if name not in products and name not in new_products:
+            new_products[name] = {
+                'name': name,
+                'description': line['product_description'],
+                'unit_price': line['unit_price'],
+                'unit_of_measure': line['unit_of_measure'],
+                'current_stock': deltas[name],
+                'date': invoice.date,
+                'storage_id': invoice.storage_id,
+            }
+    # More of a product is a receipt, which also moves it to the invoice's
+    # date and storage as a create does; less must not oversell.
+    stock.receive_stock({
+        products[name].product_id: (delta, invoice.date, invoice.storage_id)
+        for name, delta in deltas.items() if name in products and delta > 0
+    })
+    take_back({products[name].product_id: -delta for name, delta in deltas.items() if name in products and delta < 0},
+              {product.product_id: name for name, product in products.items()})
+    product_ids = {name: product.product_id for name, product in products.items()}
+    product_ids.update(stock.create_products(list(new_products.values())))
+    return product_ids
+
+
+def delete_incoming_invoice(invoice):
+    lines = stored_lines(IncomingInvoiceItem, 'incoming_invoice_id', invoice.incoming_invoice_id)
+    rollups.change(rollups.PURCHASES, rollups.posting(rollups.PURCHASES, invoice, rollup_lines(lines)))
+    fifo.drop_lots(invoice.incoming_invoice_id)
+    fifo.recost(named_product_ids(line['product_name'] for line in lines))
+    received = ledger.reverse('incoming', invoice.incoming_invoice_id)
+    take_back(received, {product.product_id: name for name, product in
+                         stock.products_by_name(line['product_name'] for line in lines).items()})
+    db.session.delete(invoice)
+
+
+def update_outgoing_invoice(invoice, data):
+    posted_lines = rollup_lines(stored_lines(OutgoingInvoiceItem, 'outgoing_invoice_id', invoice.outgoing_invoice_id))
+    posted = rollups.posting(rollups.SALES, invoice, posted_lines)
+    placement = (invoice.date, invoice.storage_id)
+    apply_header(invoice, data, OUTGOING_HEADER_FIELDS)
+    if 'items' not in data:
+        if moved(invoice, placement):
+            ledger.move('outgoing', invoice.outgoing_invoice_id, invoice.date, invoice.storage_id)
+        if invoice.date != placement[0]:
+            fifo.recost(named_product_ids(name for name, *_ in posted_lines))
+        rollups.change(rollups.SALES, posted, rollups.posting(rollups.SALES, invoice, posted_lines))
+        return invoice
+
+    lines = [outgoing_line(item_data) for item_data in data['items'] or []]
+    returned = item_quantities(invoice.items)
+    db.session.execute(
+        delete(OutgoingInvoiceItem).where(OutgoingInvoiceItem.outgoing_invoice_id == invoice.outgoing_invoice_id)
+    )
+    product_ids = issue_lines(lines, returned)
+    insert_lines(OutgoingInvoiceItem, 'outgoing_invoice_id', [(invoice.outgoing_invoice_id, lines)])
+    ledger.sync('outgoing', invoice.outgoing_invoice_id, invoice.date, invoice.storage_id, {
+        product_ids[name]: -quantity for name, quantity in line_quantities(lines).items()
+    })
+    store_totals(invoice, invoice_totals(lines))
+    rollups.change(rollups.SALES, posted, rollups.posting(rollups.SALES, invoice, rollup_lines(lines)))
+    fifo.recost(product_ids.values())
+    db.session.expire(invoice, ['items'])
+    return invoice
+
+
+def delete_outgoing_invoice(invoice):
+    lines = stored_lines(OutgoingInvoiceItem, 'outgoing_invoice_id', invoice.outgoing_invoice_id)
+    rollups.change(rollups.SALES, rollups.posting(rollups.SALES, invoice, rollup_lines(lines)))
+    returned = item_quantities(invoice.items)
+    products = stock.products_by_name(returned)
+    stock.adjust_stock({
+        products[name].product_id: quantity for name, quantity in returned.items() if name in products
+    })
+    ledger.reverse('outgoing', invoice.outgoing_invoice_id)
+    db.session.delete(invoice)
+    db.session.flush()
+    fifo.recost(product.product_id for product in products.values())
@@ -0,0 +1,241 @@
+'''The handlers behind ``POST /api/jobs/``; importing this module registers them.'''
+import csv
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select, tuple_
+
+from app.extensions import db
+from app.models import (
+    IncomingInvoice, IncomingInvoiceItem, OutgoingInvoice, OutgoingInvoiceItem, Product,
+)
+from . import csv_import, documents, fifo, ledger, rollups
+from .jobs import JobError, job_type
+
+EXPORTS = {
+    'incoming': (IncomingInvoice, IncomingInvoiceItem, IncomingInvoice.incoming_invoice_id,
+                 IncomingInvoiceItem.incoming_invoice_id),
+    'outgoing': (OutgoingInvoice, OutgoingInvoiceItem, OutgoingInvoice.outgoing_invoice_id,
+                 OutgoingInvoiceItem.outgoing_invoice_id),
+}
+
+
+def parse_day(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return date.fromisoformat(str(value)).isoformat()
+    except ValueError:
+        raise JobError(f'{name} must be a YYYY-MM-DD date')
+
+
+def day_arg(params, name):
+    return params.get(name) and datetime.fromisoformat(params[name])
+
+
+def validate_export(params):
+    if params.get('invoices') not in EXPORTS:
+        raise JobError(f"invoices must be one of: {', '.join(EXPORTS)}")
+    if params.get('format', 'csv') not in ('csv', 'ndjson'):
+        raise JobError('format must be csv or ndjson')
+    storage_id = params.get('storage_id')
+    if storage_id is not None and not isinstance(storage_id, int):
+        raise JobError('storage_id must be an integer')
+    return {'invoices': params['invoices'], 'format': params.get('format', 'csv'), 'storage_id': storage_id,
+            'date_from': parse_day(params, 'date_from'), 'date_to': parse_day(params, 'date_to')}
+
+
+@job_type('export', concurrency=2, max_attempts=2, validate=validate_export)
+def export(context):
+    '''Write every invoice line with its invoice header to a CSV or NDJSON file.
+
+    Rows are read in keyset pages of ``EXPORT_BATCH_SIZE`` in export order,
+    one short transaction each, so the job reports progress between pages
+    and never holds a snapshot open for the whole export.
+    '''
+    from app.api.export import EXPORT_FORMATS, csv_chunks, csv_line, item_export_statement, ndjson_chunks
+
+    params = context.params
+    invoice_model, item_model, id_column, foreign_key = EXPORTS[params['invoices']]
+    args = {'date_from': day_arg(params, 'date_from'), 'date_to': day_arg(params, 'date_to'),
+            'storage_id': params.get('storage_id')}
+    statement = item_export_statement(invoice_model, item_model, id_column, foreign_key, args)
+    columns = [column.name for column in statement.selected_columns]
+    order = [invoice_model.date, id_column, list(item_model.__table__.primary_key)[0]]
+    positions = [columns.index(column.name) for column in order]
+    total = db.session.execute(select(func.count()).select_from(statement.order_by(None).subquery())).scalar()
+    db.session.commit()
+
+    export_format = params['format']
+    chunks = csv_chunks if export_format == 'csv' else ndjson_chunks
+    filename = f"{params['invoices']}-invoice-items.{export_format}"
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    written, last = 0, None
+    with open(context.result_path(filename, EXPORT_FORMATS[export_format]), 'w', newline='') as output:
+        if export_format == 'csv':
+            output.write(csv_line(columns))
+        while True:
+            page = statement if last is None else statement.where(tuple_(*order) > tuple_(*last))
+            rows = db.session.execute(page.limit(batch_size)).all()
+            db.session.commit()
+            if not rows:
+                break
+            output.writelines(chunks(columns, [rows]))
+            written += len(rows)
+            last = [rows[-1][position] for position in positions]
+            context.progress(written * 100 // max(total, 1), f'{written}/{total} rows')
+    return {'rows': written}
+
+
+def validate_import(params):
+    if params.get('entity') not in csv_import.IMPORTS:
+        raise JobError(f"entity must be one of: {', '.join(csv_import.IMPORTS)}")
+    batch_size = params.get('batch_size')
+    if batch_size is not None and (not isinstance(batch_size, int) or batch_size < 1):
+        raise JobError('batch_size must be a positive integer')
+    return {'entity': params['entity'], 'batch_size': batch_size}
+
+
+@job_type('import', validate=validate_import)
+def import_file(context):
+    '''Import an uploaded CSV file; rejected rows are written to a CSV result.
+
+    Not retried: the batches committed before a failure stay imported.
+    '''
+    params = context.params
+    batch_size = params.get('batch_size') or current_app.config['CSV_IMPORT_BATCH_SIZE']
+    path = context.input_path()
+    with open(path, 'rb') as source, \
+            open(context.result_path('rejected.csv', 'text/csv'), 'w', newline='') as rejects:
+        writer = csv.writer(rejects)
+        writer.writerow(['line', 'error'])
+        size = max(source.seek(0, 2), 1)
+        source.seek(0)
+
+        def batch_done(report):
+            context.progress(min(source.tell() * 100 // size, 99),
+                             f"{report['inserted']} inserted, {report['updated']} updated, "
+                             f"{report['rejected']} rejected")
+
+        try:
+            report = csv_import.import_csv(params['entity'], source, batch_size,
+                                           on_reject=lambda line, error: writer.writerow([line, error]),
+                                           on_batch=batch_done)
+        except csv_import.CsvImportError as e:
+            raise JobError(str(e))
+    return report
+
+
+def validate_rebuild(params):
+    chunk_days = params.get('chunk_days') or 31
+    if not isinstance(chunk_days, int) or chunk_days < 1:
+        raise JobError('chunk_days must be a positive integer')
+    return {'date_from': parse_day(params, 'date_from'), 'date_to': parse_day(params, 'date_to'),
+            'chunk_days': chunk_days}
+
+
+@job_type('reports_rebuild', validate=validate_rebuild)
+def reports_rebuild(context):
+    '''Recompute the daily sales and purchase rollups, one chunk of days per transaction.'''
+    params = context.params
+    date_from, date_to = day_arg(params, 'date_from'), day_arg(params, 'date_to')
+    chunks = []
+    for rollup in (rollups.SALES, rollups.PURCHASES):
+        bounds = rollups.invoice_date_range(rollup)
+        if bounds is None and not (date_from and date_to):
+            continue
+        start = date_from or bounds[0]
+        end = date_to + timedelta(days=1) if date_to else bounds[1]
+        chunks.extend((rollup, chunk) for chunk in rollups.date_chunks(start, end, params['chunk_days']))
+    db.session.commit()
+    for done, (rollup, (start, end)) in enumerate(chunks, 1):
+        rollups.rebuild(rollup, start, end)
+        db.session.commit()
+        context.progress(done * 100 // len(chunks), f'{rollup.table.name}: {start:%Y-%m-%d}')
+    return {'ranges': len(chunks)}
+
+
+def validate_documents(params):
+    if params.get('format', 'pdf') not in documents.FORMATS:
+        raise JobError(f"format must be one of: {', '.join(documents.FORMATS)}")
+    try:
+        documents.check_format(params.get('format', 'pdf'))
+    except documents.DocumentError as e:
+        raise JobError(str(e))
+    date_from, date_to = parse_day(params, 'date_from'), parse_day(params, 'date_to')
+    if not (date_from and date_to):
+        raise JobError('date_from and date_to are required')
+    for name in ('storage_id', 'customer_id'):
+        if params.get(name) is not None and not isinstance(params[name], int):
+            raise JobError(f'{name} must be an integer')
+    return {'format': params.get('format', 'pdf'), 'date_from': date_from, 'date_to': date_to,
+            'storage_id': params.get('storage_id'), 'customer_id': params.get('customer_id')}
+
+
+@job_type('invoice_documents', max_attempts=2, validate=validate_documents)
+def invoice_documents(context):
+    '''Render the printable documents of the outgoing invoices in a date range into a ZIP.'''
+    params = context.params
+    document_format = params['format']
+    invoice_ids = documents.batch_ids(day_arg(params, 'date_from'), day_arg(params, 'date_to'),
+                                      params.get('storage_id'), params.get('customer_id'))
+    db.session.commit()
+    contexts, paths = [], []
+    try:
+        for start in range(0, len(invoice_ids), documents.BATCH_SIZE):
+            chunk = documents.load(invoice_ids[start:start + documents.BATCH_SIZE])
+            db.session.commit()
+            contexts.extend(chunk)
+            paths.extend(documents.documents(chunk, document_format))
+            context.progress(len(contexts) * 90 // len(invoice_ids), f'{len(contexts)}/{len(invoice_ids)} invoices')
+    finally:
+        # A job process exits by joining its children, which would wait
+        # forever on pool processes nobody told to stop.
+        documents.discard_pool(wait=True)
+    with open(context.result_path(f"invoices-{params['date_from']}-{params['date_to']}.zip", 'application/zip'),
+              'wb') as output:
+        documents.archive(contexts, paths, document_format, output)
+    return {'invoices': len(contexts)}
+
+
+def validate_recost(params):
+    names = params.get('products') or []
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise JobError('products must be a list of product names')
+    return {'products': names}
+
+
+@job_type('stock_recost', validate=validate_recost)
+def stock_recost(context):
+    '''Replay FIFO costing of the named products (default: all), a batch per transaction.'''
+    names = context.params['products']
+    query = select(Product.product_id).order_by(Product.product_id)
+    if names:
+        query = query.where(Product.name.in_(names))
+    product_ids = db.session.execute(query).scalars().all()
+    if names and len(product_ids) != len(set(names)):
+        raise JobError('Unknown product name(s)')
+    lots = lines = 0
+    for start in range(0, len(product_ids), fifo.BATCH_SIZE):
+        changed = fifo.recost(product_ids[start:start + fifo.BATCH_SIZE])
+        db.session.commit()
+        lots += changed[0]
+        lines += changed[1]
+        done = min(start + fifo.BATCH_SIZE, len(product_ids))
+        context.progress(done * 100 // len(product_ids), f'{done}/{len(product_ids)} products')
+    return {'products': len(product_ids), 'lots': lots, 'lines': lines}
+
+
+def validate_checkpoint(params):
+    return {'until': parse_day(params, 'until')}
+
+
+@job_type('stock_checkpoint', validate=validate_checkpoint)
+def stock_checkpoint(context):
+    '''Write the missing monthly stock checkpoints.'''
+    written = []
+    for as_of, _ in ledger.write_checkpoints(day_arg(context.params, 'until')):
+        written.append(as_of.date().isoformat())
+        context.progress(0, f'{as_of:%Y-%m-%d} written')
+    return {'checkpoints': written}
@@ -0,0 +1,361 @@
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select, text, update
+
+from app.extensions import db
+from app.models import Job
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+INPUT_FILE = 'input'
+# Key of the PostgreSQL advisory lock taken while claiming a job; it only
+# has to be the same in every worker.
+CLAIM_LOCK = 720431
+
+job_table = Job.__table__
+
+
+class JobError(Exception):
+    '''A job that cannot run as asked; the message is meant for the client and the job is not retried.'''
+
+
+class JobCancelled(Exception):
+    '''Raised inside a running job once its cancellation was requested.'''
+
+
+class JobType:
+    def __init__(self, name, run, concurrency, max_attempts, validate):
+        self.name = name
+        self.run = run
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.validate = validate
+        self.description = (run.__doc__ or '').strip().split('\n')[0]
+
+
+JOB_TYPES = {}
+
+
+def job_type(name, concurrency=1, max_attempts=1, validate=None):
+    '''Register ``run(context)`` as the handler of ``name`` jobs.
+
+    ``validate(params)`` checks the parameters when the job is queued and
+    returns them normalized, or raises ``JobError``.  The first line of the
+    handler's docstring describes the type in ``GET /api/jobs/types``.
+    '''
+    def register(run):
+        JOB_TYPES[name] = JobType(name, run, concurrency, max_attempts, validate)
+        return run
+    return register
+
+
+def job_dir(job_id):
+    '''Where the upload and the result file of a job live; the API and the workers must share it.'''
+    root = current_app.config['JOB_RESULT_DIR'] or os.path.join(tempfile.gettempdir(), 'jobs')
+    return os.path.join(root, str(job_id))
+
+
+def concurrency_limits():
+    '''``{job_type: running jobs allowed}``: the registered defaults, overridden by ``JOB_CONCURRENCY``.'''
+    limits = {name: kind.concurrency for name, kind in JOB_TYPES.items()}
+    for item in current_app.config['JOB_CONCURRENCY']:
+        name, _, value = item.partition('=')
+        if name.strip() in limits and value.strip().isdigit():
+            limits[name.strip()] = int(value)
+    return limits
+
+
+def enqueue(name, params=None):
+    '''Queue a ``name`` job and return it; the caller commits.'''
+    kind = JOB_TYPES.get(name)
+    if kind is None:
+        raise JobError(f"Unknown job type '{name}'")
+    params = params or {}
+    if not isinstance(params, dict):
+        raise JobError('params must be a JSON object')
+    if kind.validate:
+        params = kind.validate(params)
+    job = Job(job_type=name, params=params, status=QUEUED, max_attempts=kind.max_attempts,
+              run_after=datetime.utcnow())
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def cancel(job_id):
+    '''Cancel a queued job at once, or ask a running one to stop at its next progress report.
+
+    Returns ``False`` if the job had already finished.
+    '''
+    now = datetime.utcnow()
+    queued = db.session.execute(
+        update(job_table).where(job_table.c.job_id == job_id, job_table.c.status == QUEUED)
+        .values(status=CANCELLED, finished_at=now, message='Cancelled')
+    ).rowcount
+    running = queued or db.session.execute(
+        update(job_table).where(job_table.c.job_id == job_id, job_table.c.status == RUNNING)
+        .values(cancel_requested=True)
+    ).rowcount
+    return bool(queued or running)
+
+
+def claim(limits):
+    '''Start the oldest due job whose type is below its concurrency limit.
+
+    Returns ``(job_id, job_type)``, or ``None`` when nothing can start.  The
+    claiming UPDATE re-counts the running jobs of the type in its own
+    ``WHERE``, so where writes are serialized (SQLite) two workers cannot
+    both take the last free slot.  PostgreSQL evaluates that count on a
+    snapshot that misses a concurrent claim, so there the count and the
+    claim also run under an advisory lock, which holds across workers on
+    several hosts.
+    '''
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': CLAIM_LOCK})
+    running = dict(db.session.execute(
+        select(job_table.c.job_type, func.count()).where(job_table.c.status == RUNNING)
+        .group_by(job_table.c.job_type)
+    ).all())
+    open_types = [name for name, limit in limits.items() if running.get(name, 0) < limit]
+    now = datetime.utcnow()
+    row = open_types and db.session.execute(
+        select(job_table.c.job_id, job_table.c.job_type)
+        .where(job_table.c.status == QUEUED, job_table.c.run_after <= now, job_table.c.job_type.in_(open_types))
+        .order_by(job_table.c.run_after, job_table.c.job_id)
+        .limit(1)
+    ).first()
+    others = job_table.alias('running_job')
+    claimed = row and db.session.execute(
+        update(job_table).where(
+            job_table.c.job_id == row.job_id,
+            job_table.c.status == QUEUED,
+            select(func.count()).select_from(others)
+            .where(others.c.job_type == row.job_type, others.c.status == RUNNING)
+            .scalar_subquery() < limits[row.job_type],
+        )
+        .values(status=RUNNING, attempts=job_table.c.attempts + 1, started_at=now, heartbeat_at=now,
+                cancel_requested=False, message=None)
+    ).rowcount
+    db.session.commit()
+    return tuple(row) if claimed else None
+
+
+def finish(job_id, status, **values):
+    db.session.execute(
+        update(job_table).where(job_table.c.job_id == job_id)
+        .values(status=status, finished_at=datetime.utcnow(), **values)
+    )
+    db.session.commit()
+
+
+def retry_or_fail(job_id, attempts, max_attempts, error):
+    '''Queue a failed attempt again after an exponential delay, or fail the job for good.'''
+    if attempts < max_attempts:
+        delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** (attempts - 1)
+        db.session.execute(
+            update(job_table).where(job_table.c.job_id == job_id)
+            .values(status=QUEUED, error=error, message=f'Retrying after attempt {attempts} failed',
+                    run_after=datetime.utcnow() + timedelta(seconds=delay))
+        )
+        db.session.commit()
+    else:
+        finish(job_id, FAILED, error=error)
+
+
+class JobContext:
+    '''What a handler gets: its ``params``, progress reporting and the files of its job.'''
+
+    def __init__(self, job_id, params):
+        self.job_id = job_id
+        self.params = params
+        self.result_file = None
+        self.result_type = None
+
+    def progress(self, percent, message=None):
+        '''Record progress (0-100) and raise ``JobCancelled`` if the job was cancelled.
+
+        The update is committed at once on its own connection, so call it
+        between the handler's transactions.
+        '''
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(job_table).where(job_table.c.job_id == self.job_id)
+                .values(progress=max(0, min(int(percent), 100)), message=message and message[:255],
+                        heartbeat_at=datetime.utcnow())
+            )
+            cancelled = connection.execute(
+                select(job_table.c.cancel_requested).where(job_table.c.job_id == self.job_id)
+            ).scalar()
+        if cancelled:
+            raise JobCancelled()
+
+    def input_path(self):
+        return os.path.join(job_dir(self.job_id), INPUT_FILE)
+
+    def result_path(self, filename, content_type):
+        '''The path to write the downloadable result to; it is served as ``filename``.'''
+        directory = job_dir(self.job_id)
+        os.makedirs(directory, exist_ok=True)
+        self.result_file, self.result_type = filename, content_type
+        return os.path.join(directory, filename)
+
+
+def run_job(job_id):
+    '''Run one claimed job to its end: succeeded, cancelled, failed, or queued for another attempt.'''
+    job = db.session.get(Job, job_id)
+    kind = JOB_TYPES.get(job.job_type)
+    attempts, max_attempts = job.attempts, job.max_attempts
+    context = JobContext(job_id, dict(job.params or {}))
+    db.session.commit()
+    try:
+        if kind is None:
+            raise JobError(f"Unknown job type '{job.job_type}'")
+        result = kind.run(context)
+    except JobCancelled:
+        db.session.rollback()
+        finish(job_id, CANCELLED, message='Cancelled')
+    except JobError as e:
+        db.session.rollback()
+        finish(job_id, FAILED, error=str(e))
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Job %s (%s) failed', job_id, kind.name)
+        retry_or_fail(job_id, attempts, max_attempts, f'{type(e).__name__}: {e}')
+    else:
+        finish(job_id, SUCCEEDED, progress=100, message=None, error=None, result=result,
+               result_file=context.result_file, result_type=context.result_type)
+
+
+def requeue_stale(exclude):
+    '''Recover jobs left running by a worker that died: retried if attempts remain, failed otherwise.'''
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_STALE_SECONDS'])
+    stale = db.session.execute(
+        select(job_table.c.job_id, job_table.c.attempts, job_table.c.max_attempts)
+        .where(job_table.c.status == RUNNING, job_table.c.heartbeat_at < cutoff,
+               job_table.c.job_id.not_in(exclude))
+    ).all()
+    db.session.commit()
+    for job_id, attempts, max_attempts in stale:
+        retry_or_fail(job_id, attempts, max_attempts, 'The worker running the job stopped')
+    return len(stale)
+
+
+def remove_old_files():
+    '''Delete the upload and result directories of jobs finished more than ``JOB_RESULT_TTL`` seconds ago.'''
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_RESULT_TTL'])
+    old = db.session.execute(
+        select(job_table.c.job_id).where(job_table.c.status.in_(FINISHED), job_table.c.finished_at < cutoff,
+                                         job_table.c.result_file.is_not(None))
+    ).scalars().all()
+    for job_id in old:
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+    if old:
+        db.session.execute(update(job_table).where(job_table.c.job_id.in_(old)).values(result_file=None))
+    db.session.commit()
+
+
+_process_app = None
+
+
+def init_process(config_name):
+    '''Pool process initializer: build the app once per process and let the parent handle Ctrl-C.'''
+    global _process_app
+    from app import create_app
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _process_app = create_app(config_name)
+
+
+def execute(job_id):
+    with _process_app.app_context():
+        run_job(job_id)
+        db.session.remove()
+
+
+class Worker:
+    '''Claims jobs from the table and runs them in a pool of ``processes`` processes.
+
+    The dispatching loop runs in the calling process: it keeps the pool
+    busy within each type's concurrency limit, heartbeats the jobs it runs
+    and recovers the jobs of workers that died.  A pool process that
+    crashes fails its job over to ``retry_or_fail`` and the pool is rebuilt.
+    '''
+
+    def __init__(self, app, processes, config_name='production'):
+        self.app = app
+        self.processes = processes
+        self.config_name = config_name
+        self.running = {}
+        self.pool = None
+
+    def start_pool(self):
+        # Spawned rather than forked: a forked child would inherit the
+        # dispatcher's pooled database connections.
+        self.pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=init_process, initargs=(self.config_name,))
+
+    def fill(self):
+        limits = concurrency_limits()
+        while len(self.running) < self.processes:
+            claimed = claim(limits)
+            if claimed is None:
+                return
+            job_id, _ = claimed
+            self.running[self.pool.submit(execute, job_id)] = job_id
+
+    def reap(self, done):
+        broken = False
+        for future in done:
+            job_id = self.running.pop(future)
+            error = future.exception()
+            if error is not None:
+                # The process died or the job could not be handed over;
+                # run_job never got to record the outcome.
+                broken = True
+                job = db.session.get(Job, job_id)
+                db.session.refresh(job)
+                attempts, max_attempts, status = job.attempts, job.max_attempts, job.status
+                db.session.commit()
+                if status == RUNNING:
+                    retry_or_fail(job_id, attempts, max_attempts, f'{type(error).__name__}: {error}')
+        if broken and self.running == {}:
+            self.pool.shutdown(cancel_futures=True)
+            self.start_pool()
+
+    def heartbeat(self):
+        if self.running:
+            db.session.execute(
+                update(job_table).where(job_table.c.job_id.in_(list(self.running.values())),
+                                        job_table.c.status == RUNNING)
+                .values(heartbeat_at=datetime.utcnow())
+            )
+            db.session.commit()
+
+    def run(self, stop, once=False):
+        '''Dispatch until ``stop`` (a ``threading.Event``) is set; with ``once``, until the queue is empty.'''
+        poll_interval = self.app.config['JOB_POLL_INTERVAL']
+        self.start_pool()
+        try:
+            while not stop.is_set():
+                requeue_stale(list(self.running.values()))
+                self.fill()
+                if once and not self.running:
+                    return
+                done, _ = wait(list(self.running), timeout=poll_interval, return_when=FIRST_COMPLETED)
+                self.reap(done)
+                self.heartbeat()
+                if not self.running and not done:
+                    remove_old_files()
+                    stop.wait(poll_interval)
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,218 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import DateTime, Integer, Numeric, bindparam, delete, exists, func, insert, literal, select, union_all, update
+
+from app.extensions import db
+from app.models import StockCheckpoint, StockMovement
+
+movement_table = StockMovement.__table__
+checkpoint_table = StockCheckpoint.__table__
+
+
+def record(movements):
+    '''Append ``movements`` to the ledger with one executemany INSERT.
+
+    Each movement is a dict with ``product_id``, ``storage_id``,
+    ``movement_date``, signed ``quantity``, ``source_type`` and
+    ``source_id``.  Backdated movements are carried into the checkpoints
+    that follow them, so existing checkpoints stay exact.
+    '''
+    rows = [dict(movement, created_at=datetime.utcnow()) for movement in movements if movement['quantity']]
+    if not rows:
+        return
+    db.session.execute(insert(movement_table), rows)
+    latest = db.session.execute(select(func.max(checkpoint_table.c.as_of))).scalar()
+    if latest is not None and latest > min(row['movement_date'] for row in rows):
+        carry_forward(rows)
+
+
+def carry_forward(rows):
+    '''Add backdated movements to every checkpoint taken after them.'''
+    c = checkpoint_table.c
+    params = [
+        {'b_product_id': row['product_id'], 'b_storage_id': row['storage_id'],
+         'b_date': row['movement_date'], 'b_quantity': row['quantity']}
+        for row in rows
+    ]
+    product_id = bindparam('b_product_id', type_=Integer)
+    storage_id = bindparam('b_storage_id', type_=Integer)
+    movement_date = bindparam('b_date', type_=DateTime)
+    # Checkpoints only hold pairs that had stock history at the time; give
+    # the pair a zero row at every later checkpoint before adding to it.
+    later = checkpoint_table.alias('later')
+    same_pair = (
+        (c.as_of == later.c.as_of)
+        & (c.product_id == product_id)
+        & c.storage_id.is_not_distinct_from(storage_id)
+    )
+    missing = (
+        select(later.c.as_of, product_id, storage_id, literal(0, Numeric(12, 3)))
+        .where(later.c.as_of > movement_date, ~exists().where(same_pair))
+        .distinct()
+    )
+    db.session.execute(
+        insert(checkpoint_table).from_select(['as_of', 'product_id', 'storage_id', 'balance'], missing), params
+    )
+    db.session.execute(
+        update(checkpoint_table)
+        .where(
+            c.as_of > movement_date,
+            c.product_id == product_id,
+            c.storage_id.is_not_distinct_from(storage_id),
+        )
+        .values(balance=c.balance + bindparam('b_quantity', type_=Numeric(12, 3))),
+        params,
+    )
+
+
+def record_quantities(source_type, source_id, movement_date, storage_id, quantities):
+    '''Record one movement per product from signed ``{product_id: quantity}``.'''
+    record([
+        {
+            'product_id': product_id,
+            'storage_id': storage_id,
+            'movement_date': movement_date,
+            'quantity': quantity,
+            'source_type': source_type,
+            'source_id': source_id,
+        }
+        for product_id, quantity in sorted(quantities.items())
+    ])
+
+
+def source_balances(source_type, source_id):
+    '''Net quantity a document has moved, per product, storage and date.'''
+    m = movement_table.c
+    return db.session.execute(
+        select(m.product_id, m.storage_id, m.movement_date, func.sum(m.quantity))
+        .where(m.source_type == source_type, m.source_id == source_id)
+        .group_by(m.product_id, m.storage_id, m.movement_date)
+    ).all()
+
+
+def reverse(source_type, source_id):
+    '''Cancel every movement of a document by appending offsetting entries.
+
+    The offsets keep the original dates and storages, so as-of queries see
+    the document as if it had never been posted.  Returns the cancelled net
+    quantity per product.
+    '''
+    balances = [row for row in source_balances(source_type, source_id) if row[3]]
+    record([
+        {
+            'product_id': product_id,
+            'storage_id': storage_id,
+            'movement_date': movement_date,
+            'quantity': -quantity,
+            'source_type': source_type,
+            'source_id': source_id,
+        }
+        for product_id, storage_id, movement_date, quantity in balances
+    ])
+    totals = defaultdict(Decimal)
+    for product_id, _, _, quantity in balances:
+        totals[product_id] += quantity
+    return totals
+
+
+def move(source_type, source_id, movement_date, storage_id):
+    '''Re-post a document's net movements at a new date and storage.'''
+    totals = reverse(source_type, source_id)
+    record_quantities(source_type, source_id, movement_date, storage_id, totals)
+
+
+def sync(source_type, source_id, movement_date, storage_id, quantities):
+    '''Bring a document's net movements to signed ``{product_id: quantity}``.
+
+    Only the difference to what is already posted is written.  If the
+    document moved to another date or storage, its old movements are
+    reversed first and the full quantities are posted at the new place.
+    '''
+    balances = [row for row in source_balances(source_type, source_id) if row[3]]
+    if any((row_date, row_storage) != (movement_date, storage_id) for _, row_storage, row_date, _ in balances):
+        reverse(source_type, source_id)
+        posted = {}
+    else:
+        posted = {product_id: quantity for product_id, _, _, quantity in balances}
+    record_quantities(source_type, source_id, movement_date, storage_id, {
+        product_id: quantities.get(product_id, 0) - posted.get(product_id, 0)
+        for product_id in set(quantities) | set(posted)
+    })
+
+
+def latest_checkpoint(moment):
+    return db.session.execute(
+        select(func.max(checkpoint_table.c.as_of)).where(checkpoint_table.c.as_of <= moment)
+    ).scalar()
+
+
+def balances_as_of(moment, storage_id=None):
+    '''Stock per ``(product_id, storage_id)`` counting every movement before ``moment``.
+
+    Reads the newest checkpoint at or before ``moment`` and adds only the
+    movements posted after it, so the cost is bounded by one checkpoint
+    interval no matter how far back ``moment`` is.
+    '''
+    checkpoint = latest_checkpoint(moment)
+    c = checkpoint_table.c
+    m = movement_table.c
+
+    movements = select(m.product_id, m.storage_id, m.quantity.label('quantity')).where(m.movement_date < moment)
+    if checkpoint is not None:
+        movements = movements.where(m.movement_date >= checkpoint)
+    if storage_id is not None:
+        movements = movements.where(m.storage_id == storage_id)
+    parts = [movements]
+
+    if checkpoint is not None:
+        checkpoints = select(c.product_id, c.storage_id, c.balance.label('quantity')).where(c.as_of == checkpoint)
+        if storage_id is not None:
+            checkpoints = checkpoints.where(c.storage_id == storage_id)
+        parts.append(checkpoints)
+
+    combined = union_all(*parts).subquery()
+    return db.session.execute(
+        select(combined.c.product_id, combined.c.storage_id, func.sum(combined.c.quantity))
+        .group_by(combined.c.product_id, combined.c.storage_id)
+    ).all()
+
+
+def next_month(moment):
+    return datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+
+
+def write_checkpoint(as_of):
+    '''Store the balance of every stocked product/storage pair at ``as_of``.'''
+    db.session.execute(delete(checkpoint_table).where(checkpoint_table.c.as_of == as_of))
+    # Pairs without stock are left out; a missing pair reads as zero.
+    rows = [
+        {'as_of': as_of, 'product_id': product_id, 'storage_id': storage_id, 'balance': balance}
+        for product_id, storage_id, balance in balances_as_of(as_of) if balance
+    ]
+    if rows:
+        db.session.execute(insert(checkpoint_table), rows)
+    return len(rows)
+
+
+def write_checkpoints(until=None):
+    '''Fill in the missing month-start checkpoints up to ``until`` (default: this month).
+
+    Months are processed oldest first and each one starts from the previous
+    checkpoint, so every month only replays its own movements.  Yields
+    ``(as_of, pair_count)`` after each checkpoint is committed.
+    '''
+    first_movement = db.session.execute(select(func.min(movement_table.c.movement_date))).scalar()
+    if first_movement is None:
+        return
+    until = until or datetime.utcnow()
+    existing = set(db.session.execute(select(checkpoint_table.c.as_of).distinct()).scalars())
+
+    as_of = next_month(first_movement)
+    while as_of <= until:
+        if as_of not in existing:
+            count = write_checkpoint(as_of)
+            db.session.commit()
+            yield as_of, count
+        as_of = next_month(as_of)
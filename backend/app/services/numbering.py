@@ -0,0 +1,145 @@
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models import IncomingInvoice, InvoiceNumberSeries, OutgoingInvoice
+
+series_table = InvoiceNumberSeries.__table__
+
+# The global series continue after the highest existing invoice id, so the
+# first allocated number cannot collide with numbers issued by the old
+# max(id) + 1 scheme.
+LEGACY_ID_COLUMNS = {
+    'inv': IncomingInvoice.incoming_invoice_id,
+    'out': OutgoingInvoice.outgoing_invoice_id,
+}
+
+
+class InvoiceNumberAllocator:
+    '''Hands out invoice numbers from blocks reserved in ``invoicenumberseries``.
+
+    A process reserves ``INVOICE_NUMBER_BLOCK_SIZE`` numbers of a series
+    with one atomic ``UPDATE ... RETURNING`` on its own connection, then
+    serves creates from memory until the block is used up.  Two workers can
+    never receive the same number; the price is a gap of at most one block
+    per worker when a worker exits.
+
+    ``INVOICE_NUMBER_SERIES`` selects the numbering series: ``global``
+    (``inv001``), ``organization`` (``inv3-001``), ``year`` (``inv2024-001``)
+    or ``organization_year`` (``inv3-2024-001``).
+    '''
+
+    def __init__(self):
+        self.reset()
+        if hasattr(os, 'register_at_fork'):
+            # Blocks reserved before a fork must not be served by every child.
+            os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        # {(database, series): [[start, end), ...]} numbers reserved and not handed out yet.
+        self.blocks = {}
+
+    def series_parts(self, prefix, organization_id=None, date=None):
+        mode = current_app.config['INVOICE_NUMBER_SERIES']
+        parts = [prefix]
+        if mode in ('organization', 'organization_year') and organization_id is not None:
+            parts.append(str(organization_id))
+        if mode in ('year', 'organization_year'):
+            parts.append(str((date or datetime.utcnow()).year))
+        return parts
+
+    def format(self, parts, value):
+        return parts[0] + ''.join(f'{part}-' for part in parts[1:]) + f'{value:03}'
+
+    def initial_value(self, connection, series):
+        column = LEGACY_ID_COLUMNS.get(series)
+        if column is None:
+            return 1
+        return (connection.execute(select(func.max(column))).scalar() or 0) + 1
+
+    def reserve(self, series, size=None):
+        '''Reserve the next block of ``series`` and return it as ``(start, end)``.'''
+        size = max(size or 0, current_app.config['INVOICE_NUMBER_BLOCK_SIZE'])
+        statement = (
+            update(series_table)
+            .where(series_table.c.series == series)
+            .values(next_value=series_table.c.next_value + size)
+            .returning(series_table.c.next_value)
+        )
+        for _ in range(2):
+            with db.engine.begin() as connection:
+                end = connection.execute(statement).scalar()
+            if end is not None:
+                return end - size, end
+            try:
+                with db.engine.begin() as connection:
+                    start = self.initial_value(connection, series)
+                    connection.execute(insert(series_table).values(series=series, next_value=start + size))
+                return start, start + size
+            except IntegrityError:
+                # Another worker created the series first; take a block from it.
+                continue
+        raise RuntimeError(f'Could not reserve invoice numbers for series {series}')
+
+    def series_key(self, prefix, organization_id, date):
+        parts = tuple(self.series_parts(prefix, organization_id, date))
+        series = ':'.join(parts)
+        return parts, series, (str(db.engine.url), series)
+
+    def prefetch(self, prefix, headers):
+        '''Reserve numbers for ``headers`` (``(organization_id, date)`` pairs) without handing them out.
+
+        Creates call this before their first write, so the ``allocate`` calls
+        that follow a successful stock check are served from memory: a
+        reservation on its own connection would wait on the transaction's
+        locks, and a refused invoice uses up no number.
+        '''
+        needed = Counter(self.series_key(prefix, organization_id, date) for organization_id, date in headers)
+        with self.lock:
+            for (parts, series, key), count in needed.items():
+                blocks = self.blocks.setdefault(key, [])
+                shortfall = count - sum(end - start for start, end in blocks)
+                if shortfall > 0:
+                    blocks.append(list(self.reserve(series, shortfall)))
+
+    def allocate(self, prefix, organization_id=None, date=None):
+        parts, series, key = self.series_key(prefix, organization_id, date)
+        with self.lock:
+            blocks = self.blocks.setdefault(key, [])
+            if not blocks:
+                blocks.append(list(self.reserve(series)))
+            block = blocks[0]
+            number = block[0]
+            block[0] += 1
+            if block[0] >= block[1]:
+                blocks.pop(0)
+        return self.format(parts, number)
+
+    def peek(self, prefix, organization_id=None, date=None):
+        '''The number this worker will hand out next; read-only, it never reserves a block.
+
+        Without a block in hand, that is the start of the next block the
+        series would hand out.
+        '''
+        parts, series, key = self.series_key(prefix, organization_id, date)
+        with self.lock:
+            blocks = self.blocks.get(key)
+            number = blocks[0][0] if blocks else None
+        if number is None:
+            with db.engine.connect() as connection:
+                number = connection.execute(
+                    select(series_table.c.next_value).where(series_table.c.series == series)
+                ).scalar()
+                if number is None:
+                    number = self.initial_value(connection, series)
+        return self.format(parts, number)
+
+
+allocator = InvoiceNumberAllocator()
@@ -0,0 +1,204 @@
+import bisect
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import case, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import Product
+
+PENDING_KEY = 'product_name_changes'
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_products(term, limit, in_stock=True):
+    '''Products whose name contains ``term``, best matches first.
+
+    On PostgreSQL the ``ILIKE`` is answered by the ``gin_trgm_ops`` index
+    and results are ranked by trigram similarity.  Other databases scan,
+    ranking names that start with ``term`` first and shorter names next.
+    '''
+    query = Product.query.filter(Product.name.ilike(f'%{escape_like(term)}%', escape='\\'))
+    if in_stock:
+        query = query.filter(Product.current_stock > 0)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        ranking = [func.similarity(Product.name, term).desc()]
+    else:
+        prefix = Product.name.ilike(f'{escape_like(term)}%', escape='\\')
+        ranking = [case((prefix, 0), else_=1), func.length(Product.name)]
+    return query.order_by(*ranking, Product.name).limit(limit).all()
+
+
+class ProductNameIndex:
+    '''Sorted in-memory list of product names for prefix autocomplete.
+
+    Names are kept casefolded next to their ``(product_id, name)`` so a
+    prefix lookup is one ``bisect`` plus a walk over the matches.  Changes
+    committed by this worker are applied straight away; the index is also
+    reloaded from the database every ``PRODUCT_NAME_INDEX_TTL`` seconds to
+    pick up changes made by other workers.  Only the first load blocks a
+    request: later reloads run on a background thread while the stale index
+    keeps serving, and the new lists are swapped in under the lock.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.keys = []
+        self.entries = []
+        self.loaded_at = None
+        self.reloader = None
+        # Changes applied while a load reads the table, replayed onto its result.
+        self.replay = None
+
+    def load(self, connection):
+        with self.lock:
+            self.replay = []
+        try:
+            rows = connection.execute(select(Product.product_id, Product.name)).all()
+            entries = sorted(((name.casefold(), product_id, name) for product_id, name in rows))
+            keys = [key for key, _, _ in entries]
+            entries = [(product_id, name) for _, product_id, name in entries]
+            with self.lock:
+                for change, product_id, name in self.replay:
+                    change(keys, entries, product_id, name)
+                self.keys, self.entries = keys, entries
+                self.loaded_at = time.monotonic()
+        finally:
+            with self.lock:
+                self.replay = None
+
+    def load_now(self, engine):
+        '''Load on this thread; threads arriving meanwhile wait for that load instead of starting their own.'''
+        with self.load_lock:
+            if self.loaded_at is None:
+                with engine.connect() as connection:
+                    self.load(connection)
+
+    def reload_in_background(self, engine):
+        with self.lock:
+            if self.reloader is not None and self.reloader.is_alive():
+                return
+            self.reloader = threading.Thread(target=self.reload, args=(engine,), daemon=True,
+                                             name='product-name-index')
+            self.reloader.start()
+
+    def reload(self, engine):
+        with self.load_lock, engine.connect() as connection:
+            self.load(connection)
+
+    def expired(self):
+        ttl = current_app.config['PRODUCT_NAME_INDEX_TTL']
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > ttl
+
+    def complete(self, prefix, limit):
+        key = prefix.casefold()
+        with self.lock:
+            start = bisect.bisect_left(self.keys, key)
+            matches = []
+            for position in range(start, min(start + limit, len(self.keys))):
+                if not self.keys[position].startswith(key):
+                    break
+                matches.append(self.entries[position])
+        return matches
+
+    def add(self, product_id, name):
+        with self.lock:
+            self.insert(self.keys, self.entries, product_id, name)
+            if self.replay is not None:
+                self.replay.append((self.insert, product_id, name))
+
+    def remove(self, product_id, name):
+        with self.lock:
+            self.delete(self.keys, self.entries, product_id, name)
+            if self.replay is not None:
+                self.replay.append((self.delete, product_id, name))
+
+    @staticmethod
+    def insert(keys, entries, product_id, name):
+        key = name.casefold()
+        position = bisect.bisect_left(keys, key)
+        end = bisect.bisect_right(keys, key, position)
+        if (product_id, name) in entries[position:end]:
+            return
+        keys.insert(position, key)
+        entries.insert(position, (product_id, name))
+
+    @staticmethod
+    def delete(keys, entries, product_id, name):
+        key = name.casefold()
+        position = bisect.bisect_left(keys, key)
+        while position < len(keys) and keys[position] == key:
+            if entries[position][0] == product_id:
+                del keys[position]
+                del entries[position]
+                return
+            position += 1
+
+
+indexes = {}
+
+
+def name_index():
+    '''The autocomplete index of the current database; a stale one is reloaded in the background.'''
+    index = indexes.setdefault(str(db.engine.url), ProductNameIndex())
+    if index.loaded_at is None:
+        index.load_now(db.engine)
+    elif index.expired():
+        index.reload_in_background(db.engine)
+    return index
+
+
+def autocomplete(prefix, limit):
+    return [{'product_id': product_id, 'name': name} for product_id, name in name_index().complete(prefix, limit)]
+
+
+def queue_name_change(session, removed=None, added=None):
+    '''Remember a product name change and apply it to the index once ``session`` commits.
+
+    ``removed`` and ``added`` are ``(product_id, name)`` pairs.
+    '''
+    session.info.setdefault(PENDING_KEY, []).append((removed, added))
+
+
+@event.listens_for(Product, 'after_insert')
+def product_inserted(mapper, connection, target):
+    queue_name_change(Session.object_session(target), added=(target.product_id, target.name))
+
+
+@event.listens_for(Product, 'after_update')
+def product_updated(mapper, connection, target):
+    history = inspect(target).attrs.name.history
+    if history.deleted and history.added:
+        queue_name_change(Session.object_session(target), removed=(target.product_id, history.deleted[0]),
+                          added=(target.product_id, history.added[0]))
+
+
+@event.listens_for(Product, 'after_delete')
+def product_deleted(mapper, connection, target):
+    queue_name_change(Session.object_session(target), removed=(target.product_id, target.name))
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_name_changes(session):
+    changes = session.info.pop(PENDING_KEY, None)
+    if not changes:
+        return
+    index = indexes.get(str(session.get_bind().url))
+    if index is None:
+        return
+    for removed, added in changes:
+        if removed:
+            index.remove(*removed)
+        if added:
+            index.add(*added)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_name_changes(session):
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,126 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, inspect, select, text, tuple_
+
+from app.extensions import db
+from app.models import (
+    IncomingInvoice, IncomingInvoiceItem, OutgoingInvoice, OutgoingInvoiceItem, Product, StockMovement,
+)
+
+
+def sample(column):
+    '''Some existing value of ``column`` to plug into the checked queries.'''
+    return db.session.execute(select(column).where(column.is_not(None)).limit(1)).scalar()
+
+
+def hot_queries():
+    '''``(name, statement)`` for the main query behind each hot endpoint.
+
+    The statements mirror what the endpoints run, with parameters taken from
+    rows that exist in the database, so the planner sees realistic values.
+    '''
+    now = datetime.utcnow()
+    year_ago = now - timedelta(days=365)
+    product_name = sample(Product.name) or ''
+    storage_id = sample(Product.storage_id) or 0
+
+    queries = [
+        ('product by name', select(Product).where(Product.name == product_name)),
+        ('products by names', select(Product).where(Product.name.in_([product_name, product_name + 'x']))),
+        ('products by storage', select(Product).where(Product.storage_id == storage_id)
+            .order_by(Product.product_id).limit(101)),
+        ('products by date', select(Product).where(Product.date >= now - timedelta(days=1), Product.date < now)),
+        ('stock movements as of', select(StockMovement.product_id, func.sum(StockMovement.quantity))
+            .where(StockMovement.movement_date >= now - timedelta(days=31), StockMovement.movement_date < now)
+            .group_by(StockMovement.product_id)),
+    ]
+
+    for invoice, item, id_column, item_foreign_key, party_column in (
+        (IncomingInvoice, IncomingInvoiceItem, IncomingInvoice.incoming_invoice_id,
+         IncomingInvoiceItem.incoming_invoice_id, IncomingInvoice.counter_agent_id),
+        (OutgoingInvoice, OutgoingInvoiceItem, OutgoingInvoice.outgoing_invoice_id,
+         OutgoingInvoiceItem.outgoing_invoice_id, OutgoingInvoice.customer_id),
+    ):
+        table = invoice.__tablename__
+        ordering = [invoice.date.desc(), id_column.desc()]
+        invoice_ids = [invoice_id for invoice_id, in db.session.execute(select(id_column).limit(100))] or [0]
+        queries += [
+            (f'{table} first page', select(invoice).order_by(*ordering).limit(101)),
+            (f'{table} next page', select(invoice)
+                .where(tuple_(invoice.date, id_column) < tuple_(now, sample(id_column) or 0))
+                .order_by(*ordering).limit(101)),
+            (f'{table} by date range', select(invoice)
+                .where(invoice.date >= year_ago, invoice.date < now).order_by(*ordering).limit(101)),
+            (f'{table} by storage', select(invoice)
+                .where(invoice.storage_id == (sample(invoice.storage_id) or 0)).order_by(*ordering).limit(101)),
+            (f'{table} by counterparty', select(invoice)
+                .where(party_column == (sample(party_column) or 0))
+                .order_by(*ordering).limit(101)),
+            (f'{table} items of page', select(item).where(item_foreign_key.in_(invoice_ids))),
+            (f'{table} items by product', select(item).where(item.product_name == product_name)),
+        ]
+    return queries
+
+
+def explain(connection, statement):
+    '''Return the plan of ``statement`` as a list of ``(node, table)`` pairs.'''
+    compiled = statement.compile(bind=connection, compile_kwargs={'render_postcompile': True})
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    if connection.dialect.name == 'postgresql':
+        plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        nodes, pending = [], [plan[0]['Plan']]
+        while pending:
+            node = pending.pop()
+            nodes.append((node['Node Type'], node.get('Relation Name')))
+            pending.extend(node.get('Plans', []))
+        return nodes
+
+    nodes = []
+    for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params):
+        detail = row[-1]
+        words = detail.replace('SCAN TABLE', 'SCAN').split()
+        if words[0] == 'SCAN' and 'INDEX' not in words:
+            nodes.append(('Seq Scan', words[1]))
+        else:
+            nodes.append((detail, None))
+    return nodes
+
+
+def table_sizes(connection):
+    if connection.dialect.name == 'postgresql':
+        rows = connection.execute(text(
+            "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+        ))
+        return {name: int(max(tuples, 0)) for name, tuples in rows}
+    return {
+        name: connection.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+        for name in inspect(connection).get_table_names()
+    }
+
+
+def sequential_scans(min_rows):
+    '''Run EXPLAIN on every hot query and report sequential scans of large tables.
+
+    Returns ``(checked, problems)`` where ``problems`` lists
+    ``(query_name, table, rows)`` for each scan of a table with at least
+    ``min_rows`` rows.
+    '''
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('ANALYZE'))
+    sizes = table_sizes(connection)
+
+    queries = hot_queries()
+    problems = []
+    for name, statement in queries:
+        for node, table in explain(connection, statement):
+            if node == 'Seq Scan' and sizes.get(table, 0) >= min_rows:
+                problems.append((name, table, sizes[table]))
+    return len(queries), problems
@@ -0,0 +1,294 @@
+import os
+import select as selectors
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import abort, current_app, has_app_context, request
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.metrics import registry
+from app.models import Contract, Employee, Operation, Organization, Storage
+from . import table_versions
+
+# Small, read-mostly tables that every invoice refers to.
+CACHED_TABLES = frozenset(model.__tablename__ for model in (Organization, Storage, Employee, Operation, Contract))
+MISSING = object()
+NOTIFY_CHANNEL = 'reference_cache'
+
+cache_requests = registry.counter(
+    'reference_cache_requests_total', 'Reference cache lookups by table and result.', ('table', 'result'))
+cache_invalidations = registry.counter(
+    'reference_cache_invalidations_total', 'Reference cache flushes by table and origin.', ('table', 'origin'))
+
+
+class TableCache:
+    '''Bounded LRU of one table's rows and pages, with a time-to-live per entry.
+
+    ``generation`` moves on every invalidation; a value loaded before an
+    invalidation is not stored, so a read racing a write cannot put the old
+    row back.
+
+    Entries remember the table version their request read, if any. A lookup
+    at another version misses, so a body never goes out under the ETag of a
+    version it was not loaded at, whatever the invalidation backend.
+    '''
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generation = 0
+
+    def get(self, key, version=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            value, loaded_version, expires = entry
+            if expires < time.monotonic() or (version is not None and version != loaded_version):
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, generation, version=None):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (value, version, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+class LocalInvalidation:
+    '''Invalidate this process only; other workers' reference checks catch up when entries expire.'''
+
+    def publish(self, table_names):
+        pass
+
+    def poll(self, cache_set):
+        pass
+
+
+class FileInvalidation:
+    '''Share invalidations through one file per table in a directory all workers can see.
+
+    A write touches the table's file; every lookup compares the file's
+    modification time with the one seen last, which is a single ``stat``.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.seen = {}
+
+    def path(self, table_name):
+        return os.path.join(self.directory, table_name)
+
+    def publish(self, table_names):
+        for table_name in table_names:
+            with open(self.path(table_name), 'a'):
+                pass
+            os.utime(self.path(table_name))
+            self.seen[table_name] = self.stamp(table_name)
+
+    def stamp(self, table_name):
+        try:
+            return os.stat(self.path(table_name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def poll(self, cache_set):
+        for table_name in cache_set.tables:
+            stamp = self.stamp(table_name)
+            if self.seen.setdefault(table_name, stamp) != stamp:
+                self.seen[table_name] = stamp
+                cache_set.clear(table_name, 'remote')
+
+
+class PostgresInvalidation:
+    '''Share invalidations with ``NOTIFY``; a daemon thread per worker ``LISTEN``s for them.'''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def publish(self, table_names):
+        with self.engine.connect() as connection:
+            for table_name in table_names:
+                connection.exec_driver_sql('SELECT pg_notify(%s, %s)', (NOTIFY_CHANNEL, table_name))
+            connection.commit()
+
+    def poll(self, cache_set):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, args=(cache_set,), daemon=True,
+                                                 name='reference-cache-listener')
+                self.listener.start()
+
+    def listen(self, cache_set):
+        connection = self.engine.raw_connection()
+        try:
+            driver_connection = connection.driver_connection
+            driver_connection.autocommit = True
+            driver_connection.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+            # Anything published before LISTEN took effect was missed.
+            cache_set.clear_all('remote')
+            while True:
+                if selectors.select([driver_connection], [], [], 60) == ([], [], []):
+                    continue
+                driver_connection.poll()
+                while driver_connection.notifies:
+                    notification = driver_connection.notifies.pop(0)
+                    if notification.payload in cache_set.tables:
+                        cache_set.clear(notification.payload, 'remote')
+        finally:
+            connection.close()
+
+
+class CacheSet:
+    '''The table caches of one database and the way they learn about other workers' writes.'''
+
+    def __init__(self, maxsize, ttl, invalidation):
+        self.tables = {table_name: TableCache(maxsize, ttl) for table_name in CACHED_TABLES}
+        self.invalidation = invalidation
+
+    def clear(self, table_name, origin):
+        self.tables[table_name].clear()
+        cache_invalidations.inc(table_name, origin)
+
+    def clear_all(self, origin):
+        for table_name in self.tables:
+            self.clear(table_name, origin)
+
+
+def invalidation_backend(app, engine):
+    backend = app.config['REFERENCE_CACHE_INVALIDATION']
+    if backend == 'file':
+        return FileInvalidation(app.config['REFERENCE_CACHE_DIR']
+                                or os.path.join(tempfile.gettempdir(), 'reference-cache'))
+    if backend == 'postgres':
+        if engine.dialect.name != 'postgresql':
+            raise RuntimeError('REFERENCE_CACHE_INVALIDATION=postgres needs a PostgreSQL database')
+        return PostgresInvalidation(engine)
+    return LocalInvalidation()
+
+
+cache_sets = {}
+cache_sets_lock = threading.Lock()
+
+
+def cache_set(engine=None):
+    '''The caches of the current database, or ``None`` when caching is off.'''
+    engine = engine or db.engine
+    key = str(engine.url)
+    caches = cache_sets.get(key)
+    if caches is None:
+        app = current_app
+        if app.config['REFERENCE_CACHE_SIZE'] <= 0 or app.config['REFERENCE_CACHE_TTL'] <= 0:
+            return None
+        with cache_sets_lock:
+            caches = cache_sets.get(key)
+            if caches is None:
+                caches = cache_sets[key] = CacheSet(app.config['REFERENCE_CACHE_SIZE'],
+                                                    app.config['REFERENCE_CACHE_TTL'],
+                                                    invalidation_backend(app, engine))
+    caches.invalidation.poll(caches)
+    return caches
+
+
+def cached(table_name, key, load):
+    '''Return ``load()`` through the cache of ``table_name``.'''
+    caches = cache_set()
+    if caches is None:
+        return load()
+    cache = caches.tables[table_name]
+    # The version ``conditional`` built this response's ETag from.
+    version = table_versions.seen(table_name)
+    value = cache.get(key, version)
+    if value is not MISSING:
+        cache_requests.inc(table_name, 'hit')
+        return value
+    cache_requests.inc(table_name, 'miss')
+    generation = cache.generation
+    value = load()
+    cache.put(key, value, generation, version)
+    return value
+
+
+def row_dict(instance):
+    return {attribute.key: getattr(instance, attribute.key) for attribute in inspect(instance).mapper.column_attrs}
+
+
+def get(model, id):
+    '''The row of ``model`` with primary key ``id`` as a dict, or ``None``.'''
+    table = model.__table__
+
+    def load():
+        row = db.session.execute(select(table).where(table.primary_key.columns[0] == id)).mappings().first()
+        return dict(row) if row else None
+
+    return cached(table.name, ('row', id), load)
+
+
+def get_or_404(model, id):
+    row = get(model, id)
+    if row is None:
+        abort(404)
+    return row
+
+
+def page(model, load):
+    '''Cache the ``(rows, headers)`` page that ``load()`` returns for the current request URL.'''
+    def load_dicts():
+        rows, headers = load()
+        return [row_dict(row) for row in rows], headers
+
+    return cached(model.__tablename__, ('page', request.url), load_dicts)
+
+
+def exists(model, id):
+    return get(model, id) is not None
+
+
+def entries():
+    return {
+        (table_name,): len(cache.entries)
+        for caches in list(cache_sets.values()) for table_name, cache in caches.tables.items()
+    }
+
+
+registry.gauge('reference_cache_entries', 'Rows and pages held by the reference cache.', ('table',), entries)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    '''Flush the caches of the tables this transaction wrote, here and in the other workers.'''
+    table_names = session.info.pop(table_versions.PENDING_KEY, None)
+    if not table_names or not has_app_context():
+        return
+    caches = cache_set(session.get_bind())
+    if caches is None:
+        return
+    table_names = sorted(table_names & CACHED_TABLES)
+    for table_name in table_names:
+        caches.clear(table_name, 'local')
+    if table_names:
+        caches.invalidation.publish(table_names)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changes(session):
+    session.info.pop(table_versions.PENDING_KEY, None)
@@ -0,0 +1,243 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import String, case, cast, delete, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.extensions import db
+from app.models import (
+    DailyPurchases, DailySales, IncomingInvoice, IncomingInvoiceItem, OutgoingInvoice, OutgoingInvoiceItem,
+)
+
+MEASURES = ('quantity', 'amount', 'vat', 'discount', 'line_count', 'invoice_count')
+TOTAL = 'total'
+PRODUCT = 'product'
+DIALECT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+class Rollup:
+    '''One daily rollup table and the invoices it summarizes.
+
+    Every invoice adds to one row per day for ``total`` and for each header
+    ``dimensions`` value (``{dimension: invoice attribute}``); with
+    ``by_product`` each of its products gets a row as well.
+    '''
+
+    def __init__(self, model, invoice_model, item_model, id_column, dimensions, by_product):
+        self.model = model
+        self.table = model.__table__
+        self.invoice_model = invoice_model
+        self.item_model = item_model
+        self.id_column = id_column
+        self.dimensions = dimensions
+        self.by_product = by_product
+
+
+SALES = Rollup(DailySales, OutgoingInvoice, OutgoingInvoiceItem, 'outgoing_invoice_id',
+               {'customer': 'customer_id', 'storage': 'storage_id'}, by_product=True)
+PURCHASES = Rollup(DailyPurchases, IncomingInvoice, IncomingInvoiceItem, 'incoming_invoice_id',
+                   {'supplier': 'counter_agent_id'}, by_product=False)
+
+
+def dimension_key(value):
+    return '' if value is None else str(value)
+
+
+def posting(rollup, invoice, lines):
+    '''What ``invoice`` adds to the rollup, as ``{(dimension, key, day): measures}``.
+
+    ``lines`` are ``(product_name, quantity, amount, vat, discount)``
+    tuples.  The header is read now, so a posting taken before a patch still
+    describes the invoice as it was.
+    '''
+    day = invoice.date.date()
+    keys = [(TOTAL, '')] + [
+        (dimension, dimension_key(getattr(invoice, attribute))) for dimension, attribute in rollup.dimensions.items()
+    ]
+    result = {}
+    for dimension, key in keys:
+        result[dimension, key, day] = [Decimal(0), Decimal(0), Decimal(0), Decimal(0), 0, 1]
+    for name, quantity, amount, vat, discount in lines:
+        targets = (keys + [(PRODUCT, name)]) if rollup.by_product else keys
+        for dimension, key in targets:
+            measures = result.setdefault((dimension, key, day), [Decimal(0), Decimal(0), Decimal(0), Decimal(0), 0, 1])
+            measures[0] += quantity
+            measures[1] += amount
+            measures[2] += vat
+            measures[3] += discount
+            measures[4] += 1
+    return result
+
+
+def change(rollup, before=None, after=None):
+    '''Apply the difference between two postings of one invoice (``None`` for "not there").'''
+    deltas = defaultdict(lambda: [0] * len(MEASURES))
+    for sign, posted in ((-1, before), (1, after)):
+        for row_key, measures in (posted or {}).items():
+            delta = deltas[row_key]
+            for index, value in enumerate(measures):
+                delta[index] += sign * value
+    apply(rollup, deltas)
+
+
+def post(rollup, invoice_lines):
+    '''Add new invoices, given as ``(invoice, lines)`` pairs, with one statement for the whole batch.'''
+    deltas = defaultdict(lambda: [0] * len(MEASURES))
+    for invoice, lines in invoice_lines:
+        for row_key, measures in posting(rollup, invoice, lines).items():
+            delta = deltas[row_key]
+            for index, value in enumerate(measures):
+                delta[index] += value
+    apply(rollup, deltas)
+
+
+def apply(rollup, deltas):
+    '''Add ``deltas`` to the rollup rows with an upsert, and drop rows no invoice contributes to anymore.
+
+    Rows are written in key order so concurrent writers lock them in the
+    same order.
+    '''
+    rows = [
+        dict(zip(MEASURES, measures), dimension=dimension, dimension_key=key, day=day)
+        for (dimension, key, day), measures in sorted(deltas.items())
+        if any(measures)
+    ]
+    if not rows:
+        return
+    table = rollup.table
+    dialect_insert = DIALECT_INSERTS.get(db.session.get_bind().dialect.name)
+    if dialect_insert:
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['dimension', 'day', 'dimension_key'],
+            set_={measure: table.c[measure] + statement.excluded[measure] for measure in MEASURES},
+        )
+        db.session.execute(statement, rows)
+    else:
+        for row in rows:
+            matched = db.session.execute(
+                update(table)
+                .where(table.c.dimension == row['dimension'], table.c.day == row['day'],
+                       table.c.dimension_key == row['dimension_key'])
+                .values({measure: table.c[measure] + row[measure] for measure in MEASURES})
+            ).rowcount
+            if not matched:
+                db.session.execute(insert(table), row)
+    if any(row['invoice_count'] < 0 for row in rows):
+        db.session.execute(delete(table).where(
+            table.c.invoice_count <= 0, table.c.day.in_({row['day'] for row in rows})))
+
+
+def rebuild_statements(rollup, start, end):
+    '''INSERT ... SELECT statements recomputing every dimension for invoices dated in ``[start, end)``.'''
+    invoices = rollup.invoice_model.__table__
+    items = rollup.item_model.__table__
+    invoice_id = invoices.c[rollup.id_column]
+    day = func.date(invoices.c.date)
+    amount = func.round(items.c.total_price, 2)
+    discount = literal(0)
+    if 'discount' in items.c:
+        gross = func.round(items.c.quantity, 3) * func.round(items.c.unit_price, 2)
+        discount = case((items.c.discount > 0, func.round(gross - amount, 2)), else_=0)
+    measures = (
+        func.coalesce(func.sum(func.round(items.c.quantity, 3)), 0),
+        func.coalesce(func.sum(amount), 0),
+        func.coalesce(func.sum(func.round(items.c.vat_amount, 2)), 0),
+        func.coalesce(func.sum(discount), 0),
+        func.count(items.primary_key.columns[0]),
+        func.count(invoice_id.distinct()),
+    )
+    in_range = (invoices.c.date >= start, invoices.c.date < end)
+    with_lines = invoices.outerjoin(items, items.c[rollup.id_column] == invoice_id)
+
+    keys = {TOTAL: literal('')}
+    for dimension, attribute in rollup.dimensions.items():
+        keys[dimension] = func.coalesce(cast(invoices.c[attribute], String), '')
+    columns = ['dimension', 'dimension_key', 'day', *MEASURES]
+    for dimension, key in keys.items():
+        query = select(literal(dimension), key, day, *measures).select_from(with_lines).where(*in_range)
+        query = query.group_by(day) if dimension == TOTAL else query.group_by(key, day)
+        yield insert(rollup.table).from_select(columns, query)
+    if rollup.by_product:
+        query = (
+            select(literal(PRODUCT), items.c.product_name, day, *measures)
+            .select_from(invoices.join(items, items.c[rollup.id_column] == invoice_id))
+            .where(*in_range).group_by(items.c.product_name, day)
+        )
+        yield insert(rollup.table).from_select(columns, query)
+
+
+def rebuild(rollup, start, end):
+    '''Replace the rollup rows of the days in ``[start, end)`` with totals computed from the invoice lines.'''
+    table = rollup.table
+    db.session.execute(delete(table).where(table.c.day >= start.date(), table.c.day < end.date()))
+    for statement in rebuild_statements(rollup, start, end):
+        db.session.execute(statement)
+
+
+def date_chunks(start, end, days):
+    '''``[start, end)`` cut into consecutive ranges of ``days`` days, aligned to midnight.'''
+    start = datetime.combine(start.date(), datetime.min.time())
+    while start < end:
+        yield start, min(start + timedelta(days=days), end)
+        start += timedelta(days=days)
+
+
+def invoice_date_range(rollup):
+    '''``(first day, day after the last)`` of the invoices behind ``rollup``, or ``None``.'''
+    first, last = db.session.execute(
+        select(func.min(rollup.invoice_model.date), func.max(rollup.invoice_model.date))
+    ).one()
+    if first is None:
+        return None
+    return (datetime.combine(first.date(), datetime.min.time()),
+            datetime.combine(last.date(), datetime.min.time()) + timedelta(days=1))
+
+
+def period_label(day, period):
+    if period == 'year':
+        return f'{day.year:04d}'
+    if period == 'month':
+        return f'{day.year:04d}-{day.month:02d}'
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f'{year:04d}-W{week:02d}'
+    return day.isoformat()
+
+
+def measure_columns(table):
+    return [func.sum(table.c[measure]).label(measure) for measure in MEASURES]
+
+
+def by_dimension(rollup, dimension, date_from, date_to, limit):
+    '''Totals per key of ``dimension`` for the days ``date_from`` to ``date_to``, largest amount first.
+
+    Only the rows of those days are read, whatever the length of history.
+    '''
+    table = rollup.table
+    rows = db.session.execute(
+        select(table.c.dimension_key, *measure_columns(table))
+        .where(table.c.dimension == dimension, table.c.day >= date_from, table.c.day <= date_to)
+        .group_by(table.c.dimension_key)
+        .order_by(func.sum(table.c.amount).desc(), table.c.dimension_key)
+        .limit(limit)
+    ).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def by_period(rollup, period, date_from, date_to):
+    '''Totals per day, ISO week, month or year for the days ``date_from`` to ``date_to``.'''
+    table = rollup.table
+    rows = db.session.execute(
+        select(table.c.day, *(table.c[measure] for measure in MEASURES))
+        .where(table.c.dimension == TOTAL, table.c.day >= date_from, table.c.day <= date_to)
+        .order_by(table.c.day)
+    ).all()
+    periods = {}
+    for day, *measures in rows:
+        label = period_label(day, period)
+        totals = periods.setdefault(label, [0] * len(MEASURES))
+        for index, value in enumerate(measures):
+            totals[index] += value
+    return [dict(zip(MEASURES, totals), period=label) for label, totals in periods.items()]
@@ -0,0 +1,115 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import bindparam, func, insert, or_, select, update
+
+from app.extensions import db
+from app.models import Product
+from . import product_search
+
+product_table = Product.__table__
+
+
+def products_by_name(names):
+    '''Load every product referenced by ``names`` with one ``name IN (...)`` query.'''
+    names = set(names)
+    if not names:
+        return {}
+    return {product.name: product for product in Product.query.filter(Product.name.in_(names))}
+
+
+def quantities_by_name(pairs):
+    '''Sum ``(product_name, quantity)`` pairs so duplicate lines count once.'''
+    totals = defaultdict(Decimal)
+    for name, quantity in pairs:
+        totals[name] += quantity
+    return dict(totals)
+
+
+def create_products(rows):
+    '''Insert new products in one batch and return ``{name: product_id}``.'''
+    if not rows:
+        return {}
+    result = db.session.execute(insert(Product).returning(Product.product_id, Product.name), rows)
+    created = {name: product_id for product_id, name in result}
+    for name, product_id in created.items():
+        product_search.queue_name_change(db.session, added=(product_id, name))
+    return created
+
+
+def receive_stock(receipts):
+    '''Add stock from ``{product_id: (quantity, date, storage_id)}``.
+
+    Each product is also moved to the given date and storage.  All products
+    go out as one executemany UPDATE; the increment happens in SQL so
+    concurrent receipts of the same product do not lose updates.
+    '''
+    if not receipts:
+        return
+    statement = (
+        update(product_table)
+        .where(product_table.c.product_id == bindparam('b_product_id'))
+        .values(
+            current_stock=func.coalesce(product_table.c.current_stock, 0) + bindparam('b_quantity'),
+            date=bindparam('b_date'),
+            storage_id=bindparam('b_storage_id'),
+        )
+    )
+    db.session.execute(statement, [
+        {'b_product_id': product_id, 'b_quantity': quantity, 'b_date': date, 'b_storage_id': storage_id}
+        for product_id, (quantity, date, storage_id) in sorted(receipts.items())
+    ])
+
+
+def adjust_stock(deltas):
+    '''Apply signed ``{product_id: delta}`` stock changes in one executemany UPDATE.'''
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    statement = (
+        update(product_table)
+        .where(product_table.c.product_id == bindparam('b_product_id'))
+        .values(current_stock=func.coalesce(product_table.c.current_stock, 0) + bindparam('b_delta'))
+    )
+    db.session.execute(statement, [
+        {'b_product_id': product_id, 'b_delta': delta}
+        for product_id, delta in sorted(deltas.items())
+    ])
+
+
+def take_stock(deltas):
+    '''Apply signed ``{product_id: delta}`` changes without letting stock go negative.
+
+    Each product gets one conditional UPDATE (``... WHERE current_stock +
+    delta >= 0``), so the check and the write are a single atomic step and
+    two concurrent sales cannot both take the last unit.  Products are
+    updated in ``product_id`` order, so concurrent invoices lock their rows
+    in the same order and cannot deadlock.  Returns the ids of the products
+    whose update was refused; the caller is expected to roll back.
+    '''
+    stock_value = func.coalesce(product_table.c.current_stock, 0)
+    statement = (
+        update(product_table)
+        .where(
+            product_table.c.product_id == bindparam('b_product_id'),
+            or_(bindparam('b_delta') >= 0, stock_value + bindparam('b_delta') >= 0),
+        )
+        .values(current_stock=stock_value + bindparam('b_delta'))
+    )
+    refused = []
+    for product_id, delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        result = db.session.execute(statement, {'b_product_id': product_id, 'b_delta': delta})
+        if result.rowcount != 1:
+            refused.append(product_id)
+    return refused
+
+
+def stock_levels(product_ids):
+    '''Read ``current_stock`` of ``product_ids`` from the table, bypassing cached objects.'''
+    rows = db.session.execute(
+        select(product_table.c.product_id, product_table.c.current_stock)
+        .where(product_table.c.product_id.in_(product_ids))
+    )
+    return {product_id: current_stock or 0 for product_id, current_stock in rows}
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from flask import g
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import Contract, Customer, Employee, Operation, Organization, Storage, Supplier, TableVersion
+
+VERSIONED_TABLES = frozenset(model.__tablename__ for model in (
+    Organization, Storage, Employee, Supplier, Customer, Operation, Contract,
+))
+
+version_table = TableVersion.__table__
+# Tables written by the current transaction, for the reference cache.
+PENDING_KEY = 'changed_reference_tables'
+DIALECT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def current(table_name):
+    '''``(version, updated_at)`` of ``table_name``; ``(0, None)`` before its first write.'''
+    row = db.session.execute(
+        select(version_table.c.version, version_table.c.updated_at).where(version_table.c.table_name == table_name)
+    ).first()
+    version, updated_at = tuple(row) if row else (0, None)
+    g.setdefault('table_versions', {})[table_name] = version
+    return version, updated_at
+
+
+def seen(table_name):
+    '''The version of ``table_name`` that :func:`current` last read in this app context, or ``None``.'''
+    return g.get('table_versions', {}).get(table_name)
+
+
+def bump(session, table_names):
+    '''Advance the version of ``table_names`` in the current transaction of ``session``.
+
+    The first write to a table creates its row.  Where the dialect has an
+    upsert, creating and advancing are one statement, so two workers that
+    write a table for the first time at once both succeed.
+    '''
+    table_names = sorted(table_names)
+    if not table_names:
+        return
+    session.info.setdefault(PENDING_KEY, set()).update(table_names)
+    connection = session.connection()
+    c = version_table.c
+    now = datetime.utcnow()
+    dialect_insert = DIALECT_INSERTS.get(connection.dialect.name)
+    if dialect_insert:
+        statement = dialect_insert(version_table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[c.table_name],
+            set_={'version': c.version + 1, 'updated_at': statement.excluded.updated_at},
+        )
+        connection.execute(statement, [{'table_name': name, 'version': 1, 'updated_at': now} for name in table_names])
+        return
+    updated = connection.execute(
+        update(version_table).where(c.table_name.in_(table_names)).values(version=c.version + 1, updated_at=now)
+    ).rowcount
+    if updated < len(table_names):
+        existing = set(connection.execute(select(c.table_name).where(c.table_name.in_(table_names))).scalars())
+        connection.execute(insert(version_table), [
+            {'table_name': name, 'version': 1, 'updated_at': now} for name in table_names if name not in existing
+        ])
+
+
+@event.listens_for(Session, 'after_flush')
+def bump_flushed_tables(session, flush_context):
+    '''Bump every versioned table the flush wrote to, atomically with the write.'''
+    changed = set(session.new) | set(session.deleted)
+    changed |= {obj for obj in session.dirty if session.is_modified(obj, include_collections=False)}
+    tables = {getattr(obj, '__tablename__', None) for obj in changed} & VERSIONED_TABLES
+    if tables:
+        bump(session, tables)
@@ -0,0 +1,71 @@
+"""Compare two benchmark result files and flag regressions.
+
+    python benchmarks/compare.py benchmarks/results/BASE.json benchmarks/results/NEW.json
+
+A scenario regresses when its p50 or p95 latency grows by more than
+``--threshold`` (and by at least ``--min-ms``, so sub-millisecond noise
+does not count) or when it runs more SQL statements per request.  The exit
+status is 1 if any scenario regressed, so the script can gate CI.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def regressions(base, new, threshold, min_ms):
+    '''``(scenario, reasons)`` for each scenario of ``new`` that is worse than in ``base``.'''
+    found = []
+    for name, after in new['results'].items():
+        before = base['results'].get(name)
+        if before is None:
+            continue
+        reasons = []
+        for key in ('p50_ms', 'p95_ms'):
+            if after[key] > before[key] * (1 + threshold) and after[key] - before[key] >= min_ms:
+                reasons.append(f'{key[:3]} {before[key]:.2f} -> {after[key]:.2f} ms')
+        if (after.get('queries') or 0) > (before.get('queries') or 0):
+            reasons.append(f'queries {before.get("queries") or 0:g} -> {after["queries"]:g}')
+        if after['errors'] > before['errors']:
+            reasons.append(f'errors {before["errors"]} -> {after["errors"]}')
+        if reasons:
+            found.append((name, reasons))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('base', help='Result file of the reference commit')
+    parser.add_argument('new', help='Result file to check')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed relative latency growth (0.2 = 20%%)')
+    parser.add_argument('--min-ms', type=float, default=0.5, help='Ignore latency changes smaller than this')
+    args = parser.parse_args()
+
+    base, new = load(args.base), load(args.new)
+    print(f'base {base["meta"]["commit"]} ({base["meta"]["timestamp"]}), '
+          f'new {new["meta"]["commit"]} ({new["meta"]["timestamp"]})')
+    if base['meta'].get('rows') != new['meta'].get('rows'):
+        print('warning: the runs used datasets of different sizes')
+
+    print(f'{"scenario":38} {"p50 base":>9} {"p50 new":>9} {"ratio":>6} {"p95 base":>9} {"p95 new":>9} {"ratio":>6}')
+    for name, after in new['results'].items():
+        before = base['results'].get(name)
+        if before is None:
+            print(f'{name:38} (new scenario)')
+            continue
+        print(f'{name:38} {before["p50_ms"]:9.2f} {after["p50_ms"]:9.2f} '
+              f'{after["p50_ms"] / max(before["p50_ms"], 1e-9):6.2f} '
+              f'{before["p95_ms"]:9.2f} {after["p95_ms"]:9.2f} {after["p95_ms"] / max(before["p95_ms"], 1e-9):6.2f}')
+
+    found = regressions(base, new, args.threshold, args.min_ms)
+    for name, reasons in found:
+        print(f'REGRESSION {name}: {"; ".join(reasons)}')
+    sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
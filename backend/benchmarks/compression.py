@@ -0,0 +1,94 @@
+"""Measure the CPU cost and the bytes saved by compressing real API payloads.
+
+    python benchmarks/seed.py --scale 0.1
+    python benchmarks/compression.py --repeat 20
+
+Fetches invoice lists and exports from the seeded database (uncompressed,
+through the test client) and compresses each body with gzip at several
+levels, and with brotli when it is installed.  For every payload and codec
+it prints the compressed size, the ratio, and the CPU milliseconds per
+response and per MB; ``--output`` also writes them as JSON.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(BENCHMARKS_DIR, 'bench.db'))
+
+from sqlalchemy import func, select  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.compression import brotli  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import IncomingInvoice  # noqa: E402
+
+PAYLOADS = (
+    ('incoming list, 50 with items', '/api/incoming-invoices/?limit=50'),
+    ('incoming list, 1000 with items', '/api/incoming-invoices/?limit=1000'),
+    ('incoming list, 1000 headers', '/api/incoming-invoices/?limit=1000&include='),
+    ('outgoing list, 1000 with items', '/api/outgoing-invoices/?limit=1000'),
+    ('products, 1000', '/api/products/?limit=1000'),
+    ('incoming export, one month (csv)', '/api/incoming-invoices/export?format=csv&{month}'),
+    ('incoming export, one month (ndjson)', '/api/incoming-invoices/export?format=ndjson&{month}'),
+)
+
+
+def codecs():
+    result = [(f'gzip-{level}', lambda data, level=level: gzip.compress(data, compresslevel=level, mtime=0))
+              for level in (1, 6, 9)]
+    if brotli:
+        result += [(f'br-{quality}', lambda data, quality=quality: brotli.compress(data, quality=quality))
+                   for quality in (1, 4, 6, 11)]
+    return result
+
+
+def cpu_ms(function, data, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = function(data)
+    return (time.process_time() - start) * 1000 / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10, help='Compressions per payload and codec')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    app = create_app('production')
+    with app.app_context():
+        latest = db.session.execute(select(func.max(IncomingInvoice.date))).scalar()
+    if latest is None:
+        sys.exit('The database has no invoices; run benchmarks/seed.py first.')
+    month = f'date_from={latest.date().replace(day=1)}&date_to={latest.date()}'
+
+    client = app.test_client()
+    results = []
+    if not brotli:
+        print('brotli is not installed; measuring gzip only')
+    print(f'{"payload":38} {"codec":8} {"bytes":>11} {"compressed":>11} {"ratio":>6} {"ms":>8} {"ms/MB":>7}')
+    for name, path in PAYLOADS:
+        body = client.get(path.format(month=month), headers={'Accept-Encoding': 'identity'}).get_data()
+        for codec, compress in codecs():
+            milliseconds, compressed = cpu_ms(compress, body, args.repeat)
+            result = {
+                'payload': name, 'codec': codec, 'bytes': len(body), 'compressed': len(compressed),
+                'ratio': round(len(body) / max(len(compressed), 1), 2), 'cpu_ms': round(milliseconds, 3),
+                'cpu_ms_per_mb': round(milliseconds / max(len(body), 1) * 1e6, 2),
+            }
+            results.append(result)
+            print(f'{name:38} {codec:8} {result["bytes"]:11} {result["compressed"]:11} {result["ratio"]:6} '
+                  f'{result["cpu_ms"]:8.2f} {result["cpu_ms_per_mb"]:7.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'brotli': bool(brotli), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Time printable invoice rendering, cold and from the document cache.
+
+    python benchmarks/seed.py --scale 0.1
+    python benchmarks/documents.py --invoices 1000 --workers 1 2 4 8
+
+Renders the ``--invoices`` newest outgoing invoices into an empty cache
+directory once per ``--workers`` value (1 renders inline) and reports the
+time per run, then times a second pass that finds every document cached.
+PDF needs WeasyPrint; ``--format html`` measures the template alone.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(BENCHMARKS_DIR, 'bench.db'))
+
+from sqlalchemy import select  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import OutgoingInvoice  # noqa: E402
+from app.services import documents  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=1000, help='Newest invoices rendered per run')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1],
+                        help='Render process counts to compare')
+    parser.add_argument('--format', default='pdf', choices=tuple(documents.FORMATS))
+    args = parser.parse_args()
+    try:
+        documents.check_format(args.format)
+    except documents.DocumentError as e:
+        sys.exit(str(e))
+
+    app = create_app('production')
+    cache_dir = tempfile.mkdtemp(prefix='invoice-documents-')
+    app.config.update(RENDER_CACHE_DIR=cache_dir, RENDER_POOL_MIN=2)
+    try:
+        with app.app_context():
+            invoice_ids = db.session.execute(
+                select(OutgoingInvoice.outgoing_invoice_id)
+                .order_by(OutgoingInvoice.date.desc(), OutgoingInvoice.outgoing_invoice_id.desc())
+                .limit(args.invoices)
+            ).scalars().all()
+            contexts = documents.load(invoice_ids)
+            print(f'{len(contexts)} invoices, {args.format}')
+            for workers in args.workers:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                documents.discard_pool()
+                app.config['RENDER_WORKERS'] = workers
+                if workers > 1:
+                    # Start every pool process outside the timing.
+                    list(documents.pool(workers).map(time.sleep, [0.5] * workers))
+                started = time.perf_counter()
+                documents.documents(contexts, args.format)
+                elapsed = time.perf_counter() - started
+                print(f'{workers} process(es): {elapsed:.2f} s, {len(contexts) / elapsed:.0f} documents/s')
+            started = time.perf_counter()
+            documents.documents(documents.load(invoice_ids), args.format)
+            print(f'cached (load + version check): {time.perf_counter() - started:.2f} s')
+            documents.discard_pool()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
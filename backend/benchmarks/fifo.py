@@ -0,0 +1,80 @@
+"""Check that the incrementally maintained FIFO costs match a full replay, and time the replay.
+
+    python benchmarks/seed.py --scale 0.1
+    python benchmarks/fifo.py --products 50
+
+Reads every lot's ``remaining`` and every outgoing line's ``cogs``, replays
+all products with ``fifo.recost`` and reads them again; the script exits
+with status 1 if anything differs.  It then times ``recost`` of single
+products, the ``--products`` with the most sales, and reports the mean and
+p95 milliseconds.  Nothing is written: every replay is rolled back.
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(BENCHMARKS_DIR, 'bench.db'))
+
+from sqlalchemy import func, select  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import Inventory, OutgoingInvoiceItem, Product  # noqa: E402
+from app.services import fifo  # noqa: E402
+
+
+def state():
+    lots = db.session.execute(select(Inventory.inventory_id, Inventory.remaining).order_by(Inventory.inventory_id))
+    lines = db.session.execute(
+        select(OutgoingInvoiceItem.outgoing_invoice_item_id, OutgoingInvoiceItem.cogs)
+        .order_by(OutgoingInvoiceItem.outgoing_invoice_item_id)
+    )
+    return ([(lot_id, fifo.units(remaining, 3)) for lot_id, remaining in lots],
+            [(item_id, None if cogs is None else fifo.units(cogs, 2)) for item_id, cogs in lines])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=20, help='Busiest products timed one by one')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed replays per product')
+    args = parser.parse_args()
+
+    app = create_app('production')
+    with app.app_context():
+        product_ids = db.session.execute(select(Product.product_id).order_by(Product.product_id)).scalars().all()
+        before = state()
+        print(f'{len(before[0])} lots, {len(before[1])} outgoing lines, {len(product_ids)} products')
+        started = time.perf_counter()
+        fifo.recost(product_ids)
+        print(f'full replay: {time.perf_counter() - started:.2f} s')
+        after = state()
+        db.session.rollback()
+        if before != after:
+            lots = sum(1 for old, new in zip(*(s[0] for s in (before, after))) if old != new)
+            lines = sum(1 for old, new in zip(*(s[1] for s in (before, after))) if old != new)
+            sys.exit(f'The stored costs differ from a full replay: {lots} lot(s), {lines} line(s).')
+        print('Stored costs match a full replay.')
+
+        busiest = db.session.execute(
+            select(Product.product_id, func.count())
+            .join(OutgoingInvoiceItem, OutgoingInvoiceItem.product_name == Product.name)
+            .group_by(Product.product_id).order_by(func.count().desc()).limit(args.products)
+        ).all()
+        timings = []
+        for product_id, _ in busiest:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                fifo.recost([product_id])
+                timings.append((time.perf_counter() - started) * 1000)
+                db.session.rollback()
+        if timings:
+            timings.sort()
+            print(f'single product replay ({busiest[-1][1]}-{busiest[0][1]} sales): '
+                  f'mean {sum(timings) / len(timings):.2f} ms, p95 {timings[int(len(timings) * 0.95)]:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
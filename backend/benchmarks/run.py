@@ -0,0 +1,306 @@
+"""Measure the latency of every API namespace against a seeded database.
+
+    python benchmarks/seed.py --scale 1
+    python benchmarks/run.py --iterations 200
+    python benchmarks/compare.py benchmarks/results/OLD.json benchmarks/results/NEW.json
+
+Requests go through the Flask test client in this process, so there is no
+network between the client and the app and the numbers only move when the
+code or the database does.  Every scenario runs ``--warmup`` unmeasured
+requests and then ``--iterations`` measured ones; parameters are drawn
+from existing rows with a fixed ``--seed``.  The SQL statement count of each
+request is read from its ``Server-Timing`` header.
+
+Results are written as JSON to ``benchmarks/results/<commit>-<time>.json``.
+Write scenarios (create, patch) add a few rows per run; reseed with
+``seed.py --force`` before comparing runs that must match exactly.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from importlib import metadata as packages
+from itertools import count
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(BENCHMARKS_DIR, 'bench.db'))
+# Query counts come from the Server-Timing header.
+os.environ['REQUEST_TIMING'] = '1'
+
+from sqlalchemy import func, inspect, select  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import (  # noqa: E402
+    Contract, Customer, Employee, IncomingInvoice, Operation, Organization, OutgoingInvoice, Product, Storage,
+    Supplier,
+)
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class Fixtures:
+    '''Existing ids and names that scenarios draw their parameters from.'''
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.serial = count()
+        self.organizations = self.ids(Organization.organization_id)
+        self.storages = self.ids(Storage.storage_id)
+        self.employees = self.ids(Employee.employee_id)
+        self.suppliers = self.ids(Supplier.supplier_id)
+        self.customers = self.ids(Customer.customer_id)
+        self.operations = self.ids(Operation.operation_id)
+        self.contracts = self.ids(Contract.contract_id)
+        self.products = self.ids(Product.product_id)
+        self.incoming = self.ids(IncomingInvoice.incoming_invoice_id)
+        self.outgoing = self.ids(OutgoingInvoice.outgoing_invoice_id)
+        self.product_names = self.sampled(select(Product.name))
+        self.stocked = self.sampled(select(Product.name, Product.storage_id).where(Product.current_stock >= 100))
+        first, last = db.session.execute(select(func.min(IncomingInvoice.date), func.max(IncomingInvoice.date))).one()
+        self.first_day = (first or datetime.utcnow()).date()
+        self.days = max(((last or datetime.utcnow()).date() - self.first_day).days, 1)
+
+    def ids(self, column):
+        return [value for value, in db.session.execute(select(column).order_by(column))]
+
+    def sampled(self, statement, size=2000):
+        rows = db.session.execute(statement).all()
+        rows = self.rng.sample(rows, min(size, len(rows)))
+        return [row[0] if len(row) == 1 else tuple(row) for row in rows]
+
+    def pick(self, values):
+        return self.rng.choice(values) if values else 0
+
+    def day(self):
+        return self.first_day + timedelta(days=self.rng.randrange(self.days))
+
+    def unique(self, prefix):
+        return f'{prefix} {os.getpid()}-{time.time_ns()}-{next(self.serial)}'
+
+    def name_fragment(self):
+        name = self.pick(self.product_names) or 'a'
+        return name.split()[0][:4]
+
+    def incoming_payload(self):
+        lines = [{'product_name': name, 'quantity': 5, 'unit_of_measure': 'pc', 'unit_price': 10.0,
+                  'vat_percentage': 20} for name in self.rng.sample(self.product_names, min(5, len(self.product_names)))]
+        return {'date': datetime.utcnow().isoformat(), 'counter_agent_id': self.pick(self.suppliers),
+                'operation_id': self.pick(self.operations), 'contract_id': self.pick(self.contracts),
+                'organization_id': self.pick(self.organizations), 'storage_id': self.pick(self.storages),
+                'responsible_person_id': self.pick(self.employees), 'comment': 'benchmark', 'items': lines}
+
+    def outgoing_payload(self):
+        name, storage_id = self.pick(self.stocked) or ('', 0)
+        return {'date': datetime.utcnow().isoformat(), 'customer_id': self.pick(self.customers),
+                'organization_id': self.pick(self.organizations), 'contract_id': self.pick(self.contracts),
+                'storage_id': storage_id, 'responsible_person_id': self.pick(self.employees),
+                'payment_document': 'benchmark',
+                'items': [{'product_name': name, 'quantity': 1, 'unit_of_measure': 'pc', 'unit_price': 10.0,
+                           'vat_percentage': 20}]}
+
+
+def reference_scenarios(f, namespace, path, ids, payload, put=False):
+    scenarios = [
+        (f'{namespace} list', lambda: ('GET', f'{path}/?limit=50', None)),
+        (f'{namespace} detail', lambda: ('GET', f'{path}/{f.pick(ids)}', None)),
+        (f'{namespace} create', lambda: ('POST', f'{path}/', payload())),
+    ]
+    if put:
+        scenarios.append((f'{namespace} update', lambda: ('PUT', f'{path}/{f.pick(ids)}', payload())))
+    return scenarios
+
+
+def invoice_scenarios(f, namespace, path, ids, party, parties, payload):
+    def date_range():
+        start = f.day()
+        return f'date_from={start}&date_to={start + timedelta(days=30)}'
+
+    def one_day():
+        day = f.day()
+        return f'date_from={day}&date_to={day}'
+
+    return [
+        (f'{namespace} list', lambda: ('GET', f'{path}/?limit=50', None)),
+        (f'{namespace} list headers', lambda: ('GET', f'{path}/?limit=50&include=', None)),
+        (f'{namespace} by {party}', lambda: ('GET', f'{path}/?limit=50&{party}={f.pick(parties)}', None)),
+        (f'{namespace} by date range', lambda: ('GET', f'{path}/?limit=50&{date_range()}', None)),
+        (f'{namespace} detail', lambda: ('GET', f'{path}/{f.pick(ids)}', None)),
+        (f'{namespace} create', lambda: ('POST', f'{path}/', payload())),
+        (f'{namespace} patch header', lambda: ('PATCH', f'{path}/{f.pick(ids)}', {'comment': f.unique('patched')})),
+        (f'{namespace} next number', lambda: ('GET', f'{path}/next-invoice-number'
+                                                      f'?organization_id={f.pick(f.organizations)}&date={f.day()}',
+                                              None)),
+        (f'{namespace} export day', lambda: ('GET', f'{path}/export?format=ndjson&{one_day()}', None)),
+    ]
+
+
+def scenarios(f):
+    '''``(name, request)`` for every benchmarked endpoint; ``request()`` returns ``(method, path, json)``.'''
+    result = []
+    result += reference_scenarios(f, 'organizations', '/api/organizations', f.organizations,
+                                  lambda: {'name': f.unique('Organization')})
+    result += reference_scenarios(f, 'storages', '/api/storages', f.storages,
+                                  lambda: {'name': f.unique('Storage'), 'location': 'bench', 'capacity': 100})
+    result += reference_scenarios(f, 'employees', '/api/employees', f.employees,
+                                  lambda: {'first_name': f.unique('First'), 'last_name': 'Bench', 'position': 'clerk'})
+    result += reference_scenarios(f, 'suppliers', '/api/suppliers', f.suppliers,
+                                  lambda: {'name': f.unique('Supplier'), 'contact_info': 'bench', 'address': 'bench'})
+    result += reference_scenarios(f, 'customers', '/api/customers', f.customers,
+                                  lambda: {'name': f.unique('Customer'), 'contact_info': 'bench', 'address': 'bench'})
+    result += reference_scenarios(f, 'operations', '/api/operations', f.operations,
+                                  lambda: {'operation_type': f.unique('operation')}, put=True)
+    result += reference_scenarios(f, 'contracts', '/api/contracts', f.contracts,
+                                  lambda: {'contract_number': f.unique('C')}, put=True)
+    result += [
+        ('products list', lambda: ('GET', '/api/products/?limit=50', None)),
+        ('products by storage', lambda: ('GET', f'/api/products/?limit=50&storage_id={f.pick(f.storages)}', None)),
+        ('products by date range', lambda: ('GET', f'/api/products/?limit=50&date_from={f.day()}', None)),
+        ('products detail', lambda: ('GET', f'/api/products/{f.pick(f.products)}', None)),
+        ('products by name', lambda: ('GET', f'/api/products/by-name/{f.pick(f.product_names)}', None)),
+        ('products by date', lambda: ('GET', f'/api/products/by-date?date={f.day()}', None)),
+        ('products search', lambda: ('GET', f'/api/products/search?name={f.name_fragment()}', None)),
+        ('products autocomplete', lambda: ('GET', f'/api/products/autocomplete?prefix={f.name_fragment()}', None)),
+        ('products create', lambda: ('POST', '/api/products/', {
+            'name': f.unique('Product'), 'unit_price': 1.5, 'current_stock': 10, 'unit_of_measure': 'pc',
+            'date': datetime.utcnow().isoformat(), 'storage_id': f.pick(f.storages)})),
+    ]
+    result += invoice_scenarios(f, 'incoming-invoices', '/api/incoming-invoices', f.incoming, 'supplier_id',
+                                f.suppliers, f.incoming_payload)
+    result.append(('incoming-invoices stock by date', lambda: (
+        'GET', f'/api/incoming-invoices/by-date-and-storage?date={f.day()}&storage_id={f.pick(f.storages)}', None)))
+    result += invoice_scenarios(f, 'outgoing-invoices', '/api/outgoing-invoices', f.outgoing, 'customer_id',
+                                f.customers, f.outgoing_payload)
+    result += [
+        (f'reports {path}', lambda path=path: ('GET', f'/api/reports/{path}?date_from={f.day()}&limit=50', None))
+        for path in ('sales/by-product', 'sales/by-customer', 'sales/by-storage', 'purchases/by-supplier')
+    ]
+    result += [
+        ('reports sales by month', lambda: ('GET', f'/api/reports/sales/by-period?date_from={f.day()}', None)),
+        ('reports purchases by week', lambda: (
+            'GET', f'/api/reports/purchases/by-period?period=week&date_from={f.day()}', None)),
+    ]
+
+    users = []
+
+    def register():
+        username = f.unique('user').replace(' ', '-')
+        users.append(username)
+        return 'POST', '/api/user/register', {'username': username, 'email': f'{username}@example.com',
+                                               'password': 'benchmark'}
+
+    result += [
+        ('user register', register),
+        ('user login', lambda: ('POST', '/api/user/login', {'username': f.pick(users), 'password': 'benchmark'})),
+    ]
+    return result
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def measure(client, request, iterations, warmup):
+    latencies, queries, errors = [], [], 0
+    for iteration in range(warmup + iterations):
+        method, path, payload = request()
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=payload)
+        # Streamed bodies run their queries after the headers were sent.
+        streamed = 'Content-Length' not in response.headers
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        if iteration < warmup:
+            continue
+        latencies.append(elapsed * 1000)
+        if response.status_code >= 400:
+            errors += 1
+        match = QUERIES.search(response.headers.get('Server-Timing', ''))
+        if match and not streamed:
+            queries.append(int(match.group(1)))
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'rps': round(1000 * len(latencies) / sum(latencies), 1),
+        'queries': round(statistics.fmean(queries), 2) if queries else None,
+    }
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=BENCHMARKS_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run_metadata(args):
+    connection = db.session.connection()
+    return {
+        'commit': git('rev-parse', '--short', 'HEAD') or 'unknown',
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'dialect': connection.dialect.name,
+        'iterations': args.iterations,
+        'warmup': args.warmup,
+        'seed': args.seed,
+        'rows': {name: db.session.execute(select(func.count()).select_from(table)).scalar()
+                 for name, table in db.metadata.tables.items() if inspect(connection).has_table(name)},
+        'python': platform.python_version(),
+        'flask': packages.version('flask'),
+        'sqlalchemy': packages.version('sqlalchemy'),
+        'platform': platform.platform(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200, help='Measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for request parameters')
+    parser.add_argument('--only', help='Only run scenarios whose name matches this regular expression')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/<commit>-<time>.json)')
+    args = parser.parse_args()
+
+    app = create_app('production')
+    with app.app_context():
+        if not db.session.execute(select(func.count()).select_from(Product)).scalar():
+            sys.exit('The database has no products; run benchmarks/seed.py first.')
+        fixtures = Fixtures(random.Random(args.seed))
+        meta = run_metadata(args)
+        db.session.remove()
+
+    client = app.test_client()
+    results = {}
+    for name, request in scenarios(fixtures):
+        if args.only and not re.search(args.only, name):
+            continue
+        results[name] = measure(client, request, args.iterations, args.warmup)
+        result = results[name]
+        queries = '-' if result['queries'] is None else f'{result["queries"]:.1f}'
+        print(f'{name:38} p50 {result["p50_ms"]:8.2f} ms  p95 {result["p95_ms"]:8.2f} ms  '
+              f'{result["rps"]:8.1f} rps  {queries:>5} queries  {result["errors"]} errors')
+
+    output = args.output or os.path.join(
+        BENCHMARKS_DIR, 'results', f'{meta["commit"]}-{datetime.utcnow():%Y%m%dT%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    print(f'wrote {output}')
+
+
+if __name__ == '__main__':
+    main()
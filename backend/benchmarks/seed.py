@@ -0,0 +1,198 @@
+"""Seed a large synthetic dataset for the benchmarks.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/seed.py --scale 1
+
+At ``--scale 1`` this writes 100k products over 50 storages, 5k customers,
+2k suppliers and 100k invoices with 1M invoice lines.  Reference rows and
+products go in with bulk INSERTs; invoices go through the invoice services,
+so stock, the stock ledger and invoice numbers are exactly what the API
+would have produced.  The same ``--seed`` always yields the same dataset.
+Without DATABASE_URL the database is ``benchmarks/bench.db`` (SQLite).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(BENCHMARKS_DIR, 'bench.db'))
+
+from sqlalchemy import func, insert, select, text  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import (  # noqa: E402
+    Contract, Customer, Employee, Operation, Organization, Product, Storage, Supplier,
+)
+from app.services import invoices, ledger  # noqa: E402
+
+START_DATE = datetime(2020, 1, 1)
+DAYS = 5 * 365
+LINES_PER_INVOICE = 10
+UNITS = ('pc', 'kg', 'l', 'box', 'm')
+WORDS = ('steel', 'copper', 'oak', 'pine', 'glass', 'paper', 'cotton', 'nylon', 'brass', 'resin',
+         'bolt', 'screw', 'panel', 'sheet', 'pipe', 'valve', 'cable', 'rope', 'tile', 'brick')
+
+
+def counts(scale):
+    return {
+        'organizations': 10,
+        'storages': 50,
+        'employees': 200,
+        'operations': 5,
+        'contracts': max(10, int(500 * scale)),
+        'customers': max(10, int(5000 * scale)),
+        'suppliers': max(10, int(2000 * scale)),
+        'products': max(100, int(100000 * scale)),
+        'incoming_invoices': max(10, int(50000 * scale)),
+        'outgoing_invoices': max(10, int(50000 * scale)),
+    }
+
+
+def bulk_insert(model, rows, batch=10000):
+    for start in range(0, len(rows), batch):
+        db.session.execute(insert(model), rows[start:start + batch])
+    db.session.commit()
+
+
+def random_date(rng):
+    return START_DATE + timedelta(days=rng.randrange(DAYS), seconds=rng.randrange(86400))
+
+
+def seed_reference_data(rng, n):
+    bulk_insert(Organization, [{'name': f'Organization {i}'} for i in range(n['organizations'])])
+    bulk_insert(Storage, [{'name': f'Storage {i}', 'location': f'Site {i % 7}', 'capacity': 10000}
+                          for i in range(n['storages'])])
+    bulk_insert(Employee, [{'first_name': f'First{i}', 'last_name': f'Last{i}', 'position': 'clerk'}
+                           for i in range(n['employees'])])
+    bulk_insert(Operation, [{'operation_type': f'operation-{i}'} for i in range(n['operations'])])
+    bulk_insert(Contract, [{'contract_number': f'C-{i:06}'} for i in range(n['contracts'])])
+    bulk_insert(Customer, [{'name': f'Customer {i}', 'contact_info': f'customer{i}@example.com',
+                            'address': f'{i} Market street'} for i in range(n['customers'])])
+    bulk_insert(Supplier, [{'name': f'Supplier {i}', 'contact_info': f'supplier{i}@example.com',
+                            'address': f'{i} Harbour road'} for i in range(n['suppliers'])])
+
+
+def seed_products(rng, n):
+    '''Insert the products and return their names grouped by home storage.'''
+    rows = []
+    for i in range(n['products']):
+        rows.append({
+            'name': f'{rng.choice(WORDS)} {rng.choice(WORDS)} {i:06}',
+            'description': 'synthetic benchmark product',
+            'unit_price': round(rng.uniform(1, 500), 2),
+            'current_stock': 0,
+            'unit_of_measure': rng.choice(UNITS),
+            'date': START_DATE,
+            'storage_id': rng.randint(1, n['storages']),
+        })
+    bulk_insert(Product, rows)
+    by_storage = {}
+    for row in rows:
+        by_storage.setdefault(row['storage_id'], []).append(row['name'])
+    return by_storage
+
+
+def ids(model, column):
+    return [value for value, in db.session.execute(select(column).order_by(column))]
+
+
+def seed_invoices(rng, n, names_by_storage, batch_size, progress):
+    '''Create the invoices; each one moves products of a single storage.'''
+    organizations = ids(Organization, Organization.organization_id)
+    storages = sorted(names_by_storage)
+    employees = ids(Employee, Employee.employee_id)
+    operations = ids(Operation, Operation.operation_id)
+    contracts = ids(Contract, Contract.contract_id)
+    customers = ids(Customer, Customer.customer_id)
+    suppliers = ids(Supplier, Supplier.supplier_id)
+    on_hand = {}
+
+    def line(name, quantity):
+        return {'product_name': name, 'quantity': quantity, 'unit_of_measure': 'pc',
+                'unit_price': round(rng.uniform(1, 500), 2), 'vat_percentage': rng.choice((0, 20))}
+
+    def incoming_payload():
+        storage_id = rng.choice(storages)
+        names = names_by_storage[storage_id]
+        lines = []
+        for name in rng.sample(names, min(LINES_PER_INVOICE, len(names))):
+            quantity = rng.randint(10, 100)
+            on_hand[name] = on_hand.get(name, 0) + quantity
+            lines.append(line(name, quantity))
+        return {'date': random_date(rng).isoformat(), 'counter_agent_id': rng.choice(suppliers),
+                'operation_id': rng.choice(operations), 'contract_id': rng.choice(contracts),
+                'organization_id': rng.choice(organizations), 'storage_id': storage_id,
+                'responsible_person_id': rng.choice(employees), 'comment': 'benchmark', 'items': lines}
+
+    stocked = {}
+
+    def outgoing_payload():
+        storage_id = rng.choice(list(stocked))
+        names = stocked[storage_id]
+        lines = []
+        for name in rng.sample(names, min(LINES_PER_INVOICE, len(names))):
+            quantity = min(rng.randint(1, 5), on_hand[name])
+            if quantity:
+                on_hand[name] -= quantity
+                lines.append(line(name, quantity))
+        return {'date': random_date(rng).isoformat(), 'customer_id': rng.choice(customers),
+                'organization_id': rng.choice(organizations), 'contract_id': rng.choice(contracts),
+                'storage_id': storage_id, 'responsible_person_id': rng.choice(employees),
+                'payment_document': 'benchmark', 'items': lines}
+
+    for kind, total, payload, prepare, insert_batch in (
+        ('incoming', n['incoming_invoices'], incoming_payload, invoices.prepare_incoming,
+         invoices.insert_incoming_invoices),
+        ('outgoing', n['outgoing_invoices'], outgoing_payload, invoices.prepare_outgoing,
+         invoices.insert_outgoing_invoices),
+    ):
+        if kind == 'outgoing':
+            for storage_id, names in names_by_storage.items():
+                in_stock = [name for name in names if on_hand.get(name)]
+                if in_stock:
+                    stocked[storage_id] = in_stock
+        started = time.monotonic()
+        for start in range(0, total, batch_size):
+            prepared = [prepare(payload()) for _ in range(min(batch_size, total - start))]
+            insert_batch(prepared)
+            db.session.commit()
+            progress(f'{kind}: {start + len(prepared)}/{total} invoices '
+                     f'({time.monotonic() - started:.0f}s)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help='1.0 = 100k products and 1M invoice lines')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed; the same seed gives the same data')
+    parser.add_argument('--batch-size', type=int, default=500, help='Invoices per transaction')
+    parser.add_argument('--force', action='store_true', help='Drop and recreate all tables first')
+    args = parser.parse_args()
+
+    app = create_app('production')
+    with app.app_context():
+        if args.force:
+            db.drop_all()
+        db.create_all()
+        if db.session.execute(select(func.count()).select_from(Product)).scalar():
+            sys.exit('The database already has products; pass --force to reseed it.')
+
+        rng = random.Random(args.seed)
+        n = counts(args.scale)
+        started = time.monotonic()
+        seed_reference_data(rng, n)
+        names_by_storage = seed_products(rng, n)
+        print(f'reference data and {n["products"]} products ({time.monotonic() - started:.0f}s)')
+        seed_invoices(rng, n, names_by_storage, args.batch_size, print)
+        checkpoints = sum(1 for _ in ledger.write_checkpoints())
+        if db.engine.dialect.name in ('postgresql', 'sqlite'):
+            with db.engine.begin() as connection:
+                connection.execute(text('ANALYZE'))
+        print(f'{checkpoints} stock checkpoints; done in {time.monotonic() - started:.0f}s')
+
+
+if __name__ == '__main__':
+    main()
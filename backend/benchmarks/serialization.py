@@ -0,0 +1,115 @@
+"""Check that the fast list path matches marshal byte for byte, and measure the speedup.
+
+    python benchmarks/seed.py --scale 0.1
+    python benchmarks/serialization.py --pages 5 --repeat 10
+
+Walks the first ``--pages`` pages of the product and invoice lists (with
+and without items, and with filters) twice: once with
+``FAST_LIST_SERIALIZATION`` off, which hydrates ORM objects and runs
+``marshal``, and once with it on, which formats selected column tuples.
+Every response body and paging header must be identical; the script exits
+with status 1 on the first difference.  It then prints the mean CPU
+milliseconds per page of each path and the speedup; ``--output`` also
+writes them as JSON.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(BENCHMARKS_DIR, 'bench.db'))
+
+from sqlalchemy import func, select  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import IncomingInvoice, Storage  # noqa: E402
+
+LISTS = (
+    ('products', '/api/products/?limit={limit}'),
+    ('products, one storage', '/api/products/?limit={limit}&storage_id={storage_id}'),
+    ('incoming invoices', '/api/incoming-invoices/?limit={limit}'),
+    ('incoming headers', '/api/incoming-invoices/?limit={limit}&include='),
+    ('incoming, one month', '/api/incoming-invoices/?limit={limit}&{month}'),
+    ('outgoing invoices', '/api/outgoing-invoices/?limit={limit}'),
+    ('outgoing headers', '/api/outgoing-invoices/?limit={limit}&include='),
+)
+PAGING_HEADERS = ('X-Next-Cursor', 'Link')
+
+
+def walk(client, path, pages):
+    '''``[(path, status, paging headers, body)]`` for the first ``pages`` pages starting at ``path``.'''
+    responses = []
+    while path and len(responses) < pages:
+        response = client.get(path, headers={'Accept-Encoding': 'identity'})
+        responses.append((path, response.status_code,
+                          [response.headers.get(name) for name in PAGING_HEADERS], response.get_data()))
+        link = response.headers.get('Link')
+        path = link[1:link.index('>')].replace('http://localhost', '') if link else None
+    return responses
+
+
+def cpu_ms(client, paths, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        for path in paths:
+            client.get(path, headers={'Accept-Encoding': 'identity'})
+    return (time.process_time() - start) * 1000 / (repeat * len(paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=3, help='Pages walked per list')
+    parser.add_argument('--limit', type=int, default=500, help='Rows per page')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed passes over the pages')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    app = create_app('production')
+    with app.app_context():
+        latest = db.session.execute(select(func.max(IncomingInvoice.date))).scalar()
+        storage_id = db.session.execute(select(func.min(Storage.storage_id))).scalar()
+    if latest is None:
+        sys.exit('The database has no invoices; run benchmarks/seed.py first.')
+    month = f'date_from={latest.date().replace(day=1)}&date_to={latest.date()}'
+    client = app.test_client()
+
+    results = []
+    print(f'{"list":24} {"pages":>5} {"bytes":>10} {"marshal ms":>11} {"fast ms":>9} {"speedup":>8}')
+    for name, path in LISTS:
+        path = path.format(limit=args.limit, storage_id=storage_id, month=month)
+        app.config['FAST_LIST_SERIALIZATION'] = False
+        expected = walk(client, path, args.pages)
+        app.config['FAST_LIST_SERIALIZATION'] = True
+        actual = walk(client, path, args.pages)
+        for (page, *want), (_, *got) in zip(expected, actual):
+            if want != got:
+                sys.exit(f'{name}: the fast path differs from marshal for {page}')
+        if len(expected) != len(actual):
+            sys.exit(f'{name}: the fast path returned {len(actual)} pages instead of {len(expected)}')
+
+        paths = [page for page, *_ in expected]
+        app.config['FAST_LIST_SERIALIZATION'] = False
+        marshal_ms = cpu_ms(client, paths, args.repeat)
+        app.config['FAST_LIST_SERIALIZATION'] = True
+        fast_ms = cpu_ms(client, paths, args.repeat)
+        result = {
+            'list': name, 'pages': len(paths), 'bytes': sum(len(body) for *_, body in expected),
+            'marshal_ms': round(marshal_ms, 3), 'fast_ms': round(fast_ms, 3),
+            'speedup': round(marshal_ms / max(fast_ms, 1e-9), 2),
+        }
+        results.append(result)
+        print(f'{name:24} {result["pages"]:5} {result["bytes"]:10} {result["marshal_ms"]:11.2f} '
+              f'{result["fast_ms"]:9.2f} {result["speedup"]:7.2f}x')
+
+    print('All responses identical.')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'limit': args.limit, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Measure requests per second of a running server.
+
+    python benchmarks/serve_throughput.py http://127.0.0.1:5000/api/products/?limit=50 \
+        --concurrency 16 --duration 20
+
+Opens a new connection per request (gunicorn's sync worker does not keep
+connections alive) from ``--concurrency`` threads and prints throughput,
+latency percentiles and the number of failed requests.
+"""
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def run(url, concurrency, duration):
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    latencies, failures = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        local, failed = [], 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                if response.status != 200:
+                    failed += 1
+                    continue
+            except OSError:
+                failed += 1
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+            failures[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+    print(f'{len(latencies) / elapsed:.1f} req/s  p50 {percentile(0.5):.1f} ms  p99 {percentile(0.99):.1f} ms  '
+          f'ok {len(latencies)}  failed {failures[0]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+    run(args.url, args.concurrency, args.duration)
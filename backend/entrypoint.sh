@@ -26,5 +26,34 @@ flask db migrate -m "Initial migration"
 flask db upgrade
 fi
 
-# Start the Flask application
-flask run --host 0.0.0.0
\ No newline at end of file
+# Run queued background jobs next to the API (see `flask jobs worker`);
+# JOB_WORKERS=0 leaves them to workers on other hosts.
+pids=()
+if [ "${JOB_WORKERS:-2}" != "0" ]; then
+flask jobs worker &
+pids+=($!)
+fi
+
+# Start the application: gunicorn (see gunicorn.conf.py) unless SERVER_MODE=dev
+# asks for the single-process Flask development server.
+if [ "${SERVER_MODE:-gunicorn}" = "dev" ]; then
+flask run --host 0.0.0.0 &
+else
+gunicorn -c gunicorn.conf.py wsgi:app &
+fi
+pids+=($!)
+
+# This shell stays in the foreground, so the container's SIGTERM reaches
+# it: pass it on to the server and the job worker, which finishes its
+# running jobs before it exits. If either process exits on its own, stop
+# the other one as well.
+stop() {
+kill -TERM "${pids[@]}" 2>/dev/null || true
+}
+trap stop TERM INT
+set +e
+wait -n "${pids[@]}"
+status=$?
+stop
+wait "${pids[@]}"
+exit $status
@@ -0,0 +1,82 @@
+"""Gunicorn settings for serving the API in production.
+
+Start with ``gunicorn -c gunicorn.conf.py wsgi:app``.  Every setting can be
+overridden from the environment, so the same image can be tuned per host.
+"""
+import glob
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+# gthread serves ``threads`` requests per worker; with one thread the plain
+# sync worker does the same job with less overhead.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+
+# Import the app once in the master so workers fork with the code already
+# loaded (faster start, shared memory pages).
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then so slow leaks cannot grow without bound; the
+# jitter keeps all workers from restarting at the same moment.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Set GUNICORN_ACCESS_LOG= (empty) to turn the access log off.
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+# Workers share their /metrics state through files in this directory (one
+# per worker, wiped at start); a private temporary directory by default.
+metrics_flush_interval = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+
+def on_starting(server):
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            os.remove(path)
+    else:
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='invoice-metrics-')
+        os.environ['METRICS_DIR_CREATED'] = '1'
+
+
+def on_exit(server):
+    if os.environ.pop('METRICS_DIR_CREATED', None):
+        shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+
+
+def post_fork(server, worker):
+    # With preload_app the master may already hold pooled connections; a
+    # socket shared between processes corrupts both sides, so every worker
+    # starts with an empty pool. close=False leaves the master's sockets alone.
+    from app.extensions import db
+    from app.metrics import registry
+    from wsgi import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+    registry.share(app, os.environ['PROMETHEUS_MULTIPROC_DIR'], metrics_flush_interval)
+
+
+def worker_exit(server, worker):
+    from app.metrics import registry
+
+    registry.flush()
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counters in the totals.
+    from app.metrics import mark_dead
+
+    mark_dead(worker.pid, os.environ['PROMETHEUS_MULTIPROC_DIR'])
@@ -0,0 +1,28 @@
+"""add invoice number series
+
+Revision ID: a3c51f0e7b21
+Revises: 41b4993a8f3d
+Create Date: 2026-10-18 17:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c51f0e7b21'
+down_revision = '41b4993a8f3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('invoicenumberseries',
+    sa.Column('series', sa.String(length=50), nullable=False),
+    sa.Column('next_value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('series')
+    )
+
+
+def downgrade():
+    op.drop_table('invoicenumberseries')
@@ -0,0 +1,52 @@
+"""recompute outgoing invoice discount totals
+
+Revision ID: b2f7c4d19e63
+Revises: a7d3e91b5c20
+Create Date: 2026-10-19 04:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2f7c4d19e63'
+down_revision = 'a7d3e91b5c20'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def upgrade():
+    # The d3a7f5c81e42 backfill rounded the sum of the line discounts; the
+    # app and the daily rollups round each line first.  Recompute the
+    # outgoing invoices with lines the same way, one id range per
+    # transaction.
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        low, high = connection.execute(sa.text(
+            'SELECT MIN(outgoing_invoice_id), MAX(outgoing_invoice_id) FROM outgoinginvoice'
+        )).one()
+        if low is None:
+            return
+        for start in range(low, high + 1, BATCH_SIZE):
+            connection.execute(sa.text("""
+                UPDATE outgoinginvoice SET
+                    discount_total = totals.discount_total
+                FROM (
+                    SELECT it.outgoing_invoice_id AS invoice_id,
+                           SUM(CASE WHEN it.discount > 0
+                               THEN ROUND(ROUND(it.quantity, 3) * ROUND(it.unit_price, 2) - ROUND(it.total_price, 2), 2)
+                               ELSE 0 END) AS discount_total
+                    FROM outgoinginvoiceitem it
+                    WHERE it.outgoing_invoice_id BETWEEN :start AND :end
+                    GROUP BY it.outgoing_invoice_id
+                ) totals
+                WHERE outgoinginvoice.outgoing_invoice_id = totals.invoice_id
+            """), {'start': start, 'end': start + BATCH_SIZE - 1})
+
+
+def downgrade():
+    # The recomputed totals are the correct ones; there is nothing to undo.
+    pass
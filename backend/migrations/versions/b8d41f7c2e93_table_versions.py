@@ -0,0 +1,35 @@
+"""add table versions for conditional GET
+
+Revision ID: b8d41f7c2e93
+Revises: f19c6d2b7a48
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d41f7c2e93'
+down_revision = 'f19c6d2b7a48'
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ('organization', 'storage', 'employee', 'supplier', 'customer', 'operation', 'contract')
+
+
+def upgrade():
+    table = op.create_table('tableversion',
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    now = datetime.utcnow()
+    op.bulk_insert(table, [{'table_name': name, 'version': 1, 'updated_at': now} for name in VERSIONED_TABLES])
+
+
+def downgrade():
+    op.drop_table('tableversion')
@@ -0,0 +1,93 @@
+"""add stock movement ledger and checkpoints
+
+Revision ID: c7d2e9a41f06
+Revises: a3c51f0e7b21
+Create Date: 2026-10-18 19:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e9a41f06'
+down_revision = 'a3c51f0e7b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stockmovement',
+    sa.Column('movement_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('storage_id', sa.Integer(), nullable=True),
+    sa.Column('movement_date', sa.DateTime(), nullable=False),
+    sa.Column('quantity', sa.Numeric(precision=12, scale=3), nullable=False),
+    sa.Column('source_type', sa.String(length=20), nullable=False),
+    sa.Column('source_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['product.product_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['storage_id'], ['storage.storage_id'], ),
+    sa.PrimaryKeyConstraint('movement_id')
+    )
+    with op.batch_alter_table('stockmovement', schema=None) as batch_op:
+        batch_op.create_index('ix_stockmovement_movement_date', ['movement_date'], unique=False)
+        batch_op.create_index('ix_stockmovement_product_storage_date', ['product_id', 'storage_id', 'movement_date'], unique=False)
+        batch_op.create_index('ix_stockmovement_source', ['source_type', 'source_id'], unique=False)
+
+    op.create_table('stockcheckpoint',
+    sa.Column('checkpoint_id', sa.Integer(), nullable=False),
+    sa.Column('as_of', sa.DateTime(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('storage_id', sa.Integer(), nullable=True),
+    sa.Column('balance', sa.Numeric(precision=12, scale=3), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['product.product_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['storage_id'], ['storage.storage_id'], ),
+    sa.PrimaryKeyConstraint('checkpoint_id')
+    )
+    with op.batch_alter_table('stockcheckpoint', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stockcheckpoint_as_of'), ['as_of'], unique=False)
+
+    # Replay the existing invoices into the ledger, one movement per invoice
+    # and product.
+    op.execute("""
+        INSERT INTO stockmovement (product_id, storage_id, movement_date, quantity, source_type, source_id, created_at)
+        SELECT p.product_id, i.storage_id, i.date, SUM(it.quantity), 'incoming', i.incoming_invoice_id, CURRENT_TIMESTAMP
+        FROM incominginvoice i
+        JOIN incominginvoiceitem it ON it.incoming_invoice_id = i.incoming_invoice_id
+        JOIN product p ON p.name = it.product_name
+        GROUP BY p.product_id, i.storage_id, i.date, i.incoming_invoice_id
+    """)
+    op.execute("""
+        INSERT INTO stockmovement (product_id, storage_id, movement_date, quantity, source_type, source_id, created_at)
+        SELECT p.product_id, o.storage_id, o.date, -SUM(it.quantity), 'outgoing', o.outgoing_invoice_id, CURRENT_TIMESTAMP
+        FROM outgoinginvoice o
+        JOIN outgoinginvoiceitem it ON it.outgoing_invoice_id = o.outgoing_invoice_id
+        JOIN product p ON p.name = it.product_name
+        GROUP BY p.product_id, o.storage_id, o.date, o.outgoing_invoice_id
+    """)
+    # Stock that no invoice explains (opening stock, manual edits) becomes an
+    # opening movement, so every product's ledger adds up to current_stock.
+    op.execute("""
+        INSERT INTO stockmovement (product_id, storage_id, movement_date, quantity, source_type, source_id, created_at)
+        SELECT p.product_id, p.storage_id, p.date,
+               COALESCE(p.current_stock, 0) - COALESCE(m.total, 0), 'product', p.product_id, CURRENT_TIMESTAMP
+        FROM product p
+        LEFT JOIN (
+            SELECT product_id, SUM(quantity) AS total FROM stockmovement GROUP BY product_id
+        ) m ON m.product_id = p.product_id
+        WHERE COALESCE(p.current_stock, 0) <> COALESCE(m.total, 0)
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('stockcheckpoint', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stockcheckpoint_as_of'))
+
+    op.drop_table('stockcheckpoint')
+    with op.batch_alter_table('stockmovement', schema=None) as batch_op:
+        batch_op.drop_index('ix_stockmovement_source')
+        batch_op.drop_index('ix_stockmovement_product_storage_date')
+        batch_op.drop_index('ix_stockmovement_movement_date')
+
+    op.drop_table('stockmovement')
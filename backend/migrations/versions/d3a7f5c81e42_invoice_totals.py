@@ -0,0 +1,72 @@
+"""add denormalized totals to invoice headers
+
+Revision ID: d3a7f5c81e42
+Revises: b8d41f7c2e93
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a7f5c81e42'
+down_revision = 'b8d41f7c2e93'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+INVOICES = [
+    ('incominginvoice', 'incoming_invoice_id', 'incominginvoiceitem', '0'),
+    ('outgoinginvoice', 'outgoing_invoice_id', 'outgoinginvoiceitem',
+     'CASE WHEN it.discount > 0 THEN ROUND(it.quantity, 3) * ROUND(it.unit_price, 2) - ROUND(it.total_price, 2) '
+     'ELSE 0 END'),
+]
+
+
+def upgrade():
+    for table, _, _, _ in INVOICES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('total_amount', sa.Numeric(precision=14, scale=2), server_default='0', nullable=False))
+            batch_op.add_column(sa.Column('vat_total', sa.Numeric(precision=14, scale=2), server_default='0', nullable=False))
+            batch_op.add_column(sa.Column('discount_total', sa.Numeric(precision=14, scale=2), server_default='0', nullable=False))
+            batch_op.add_column(sa.Column('line_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill one id range at a time, each range in its own transaction, so
+    # no statement holds locks on the whole table.  Amounts are rounded to
+    # their column scale before summing, as SQLite stores them unrounded.
+    # Invoices without lines keep the zero defaults.
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        for table, id_column, item_table, discount in INVOICES:
+            low, high = connection.execute(sa.text(f'SELECT MIN({id_column}), MAX({id_column}) FROM {table}')).one()
+            if low is None:
+                continue
+            for start in range(low, high + 1, BATCH_SIZE):
+                connection.execute(sa.text(f"""
+                    UPDATE {table} SET
+                        total_amount = totals.total_amount,
+                        vat_total = totals.vat_total,
+                        discount_total = totals.discount_total,
+                        line_count = totals.line_count
+                    FROM (
+                        SELECT it.{id_column} AS invoice_id,
+                               SUM(ROUND(it.total_price, 2)) AS total_amount,
+                               SUM(ROUND(it.vat_amount, 2)) AS vat_total,
+                               ROUND(SUM({discount}), 2) AS discount_total,
+                               COUNT(*) AS line_count
+                        FROM {item_table} it
+                        WHERE it.{id_column} BETWEEN :start AND :end
+                        GROUP BY it.{id_column}
+                    ) totals
+                    WHERE {table}.{id_column} = totals.invoice_id
+                """), {'start': start, 'end': start + BATCH_SIZE - 1})
+
+
+def downgrade():
+    for table, _, _, _ in reversed(INVOICES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('line_count')
+            batch_op.drop_column('discount_total')
+            batch_op.drop_column('vat_total')
+            batch_op.drop_column('total_amount')
@@ -0,0 +1,33 @@
+"""add trigram index for product name search
+
+Revision ID: e4b8a0c93d15
+Revises: c7d2e9a41f06
+Create Date: 2026-10-18 20:10:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b8a0c93d15'
+down_revision = 'c7d2e9a41f06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # CONCURRENTLY cannot run inside the migration transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_product_name_trgm', 'product', ['name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_product_name_trgm', table_name='product', postgresql_concurrently=True)
@@ -0,0 +1,43 @@
+"""add daily sales and purchases rollups
+
+Revision ID: e6c2b9d04a17
+Revises: d3a7f5c81e42
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6c2b9d04a17'
+down_revision = 'd3a7f5c81e42'
+branch_labels = None
+depends_on = None
+
+TABLES = ('dailysales', 'dailypurchases')
+
+
+def upgrade():
+    # The tables start empty; fill them with `flask reports rebuild`, which
+    # recomputes the history in parallel date ranges.
+    for table in TABLES:
+        op.create_table(table,
+        sa.Column('rollup_id', sa.Integer(), nullable=False),
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('dimension_key', sa.String(length=100), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('quantity', sa.Numeric(precision=14, scale=3), nullable=False),
+        sa.Column('amount', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('vat', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('discount', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('line_count', sa.Integer(), nullable=False),
+        sa.Column('invoice_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('rollup_id'),
+        sa.UniqueConstraint('dimension', 'day', 'dimension_key', name=f'uq_{table}_dimension_day_key')
+        )
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_table(table)
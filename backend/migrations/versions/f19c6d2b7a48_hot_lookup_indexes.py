@@ -0,0 +1,45 @@
+"""add indexes for hot lookup columns
+
+Revision ID: f19c6d2b7a48
+Revises: e4b8a0c93d15
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f19c6d2b7a48'
+down_revision = 'e4b8a0c93d15'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_product_storage_id', 'product', ['storage_id', 'product_id']),
+    ('ix_product_date', 'product', ['date', 'product_id']),
+    ('ix_incominginvoice_date', 'incominginvoice', ['date', 'incoming_invoice_id']),
+    ('ix_incominginvoice_counter_agent_date', 'incominginvoice', ['counter_agent_id', 'date', 'incoming_invoice_id']),
+    ('ix_incominginvoice_storage_date', 'incominginvoice', ['storage_id', 'date', 'incoming_invoice_id']),
+    ('ix_incominginvoiceitem_invoice_id', 'incominginvoiceitem', ['incoming_invoice_id']),
+    ('ix_incominginvoiceitem_product_name', 'incominginvoiceitem', ['product_name']),
+    ('ix_outgoinginvoice_date', 'outgoinginvoice', ['date', 'outgoing_invoice_id']),
+    ('ix_outgoinginvoice_customer_date', 'outgoinginvoice', ['customer_id', 'date', 'outgoing_invoice_id']),
+    ('ix_outgoinginvoice_storage_date', 'outgoinginvoice', ['storage_id', 'date', 'outgoing_invoice_id']),
+    ('ix_outgoinginvoiceitem_invoice_id', 'outgoinginvoiceitem', ['outgoing_invoice_id']),
+    ('ix_outgoinginvoiceitem_product_name', 'outgoinginvoiceitem', ['product_name']),
+]
+
+
+def upgrade():
+    # On PostgreSQL the indexes are built CONCURRENTLY so writes to the
+    # tables are not blocked; that cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,71 @@
+"""add FIFO lot columns to inventory and cost of goods sold to outgoing lines
+
+Revision ID: f2a9c4e7b105
+Revises: e6c2b9d04a17
+Create Date: 2026-10-19 01:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a9c4e7b105'
+down_revision = 'e6c2b9d04a17'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def upgrade():
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('remaining', sa.Numeric(precision=10, scale=3), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('source_type', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('source_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_inventory_product_date', ['product_id', 'purchase_date', 'inventory_id'], unique=False)
+        batch_op.create_index('ix_inventory_source', ['source_type', 'source_id'], unique=False)
+
+    with op.batch_alter_table('outgoinginvoiceitem', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cogs', sa.Numeric(precision=12, scale=2), nullable=True))
+
+    # One lot per incoming line and one per product's opening stock, none of
+    # them consumed yet.  Sales are costed afterwards by
+    # ``flask stock recost``, which replays each product in Python.
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        connection.execute(sa.text("""
+            INSERT INTO inventory (product_id, quantity, remaining, purchase_date, purchase_price, source_type, source_id)
+            SELECT m.product_id, m.quantity, m.quantity, m.movement_date, p.unit_price, 'product', m.product_id
+            FROM stockmovement m
+            JOIN product p ON p.product_id = m.product_id
+            WHERE m.source_type = 'product' AND m.quantity > 0
+        """))
+        low, high = connection.execute(
+            sa.text('SELECT MIN(incoming_invoice_id), MAX(incoming_invoice_id) FROM incominginvoice')
+        ).one()
+        if low is None:
+            return
+        for start in range(low, high + 1, BATCH_SIZE):
+            connection.execute(sa.text("""
+                INSERT INTO inventory (product_id, quantity, remaining, purchase_date, purchase_price, source_type, source_id)
+                SELECT p.product_id, it.quantity, it.quantity, i.date, it.unit_price, 'incoming', i.incoming_invoice_id
+                FROM incominginvoiceitem it
+                JOIN incominginvoice i ON i.incoming_invoice_id = it.incoming_invoice_id
+                JOIN product p ON p.name = it.product_name
+                WHERE i.incoming_invoice_id BETWEEN :start AND :end
+                ORDER BY it.incoming_invoice_item_id
+            """), {'start': start, 'end': start + BATCH_SIZE - 1})
+
+
+def downgrade():
+    op.execute("DELETE FROM inventory WHERE source_type IN ('product', 'incoming')")
+    with op.batch_alter_table('outgoinginvoiceitem', schema=None) as batch_op:
+        batch_op.drop_column('cogs')
+
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.drop_index('ix_inventory_source')
+        batch_op.drop_index('ix_inventory_product_date')
+        batch_op.drop_column('source_id')
+        batch_op.drop_column('source_type')
+        batch_op.drop_column('remaining')
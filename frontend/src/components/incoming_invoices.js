@@ -9,17 +9,19 @@ function IncomingInvoices() {
   const [invoices, setInvoices] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const navigate = useNavigate();
 
   useEffect(() => {
     fetchInvoices();
   }, []);
 
-  const fetchInvoices = async () => {
+  const fetchInvoices = async (after) => {
     try {
-      const data = await getIncomingInvoices();
+      const { items, nextCursor: cursor } = await getIncomingInvoices(after);
       const invoicesWithData = await Promise.all(
-        data.map(async (invoice) => {
+        items.map(async (invoice) => {
           const supplier = await getSupplier(invoice.counter_agent_id);
           const contract = await getContract(invoice.contract_id);
           const operation = await getOperation(invoice.operation_id);
@@ -29,8 +31,10 @@ function IncomingInvoices() {
           };
         })
       );
-      setInvoices(invoicesWithData);
+      setInvoices((loaded) => (after ? loaded.concat(invoicesWithData) : invoicesWithData));
+      setNextCursor(cursor);
       setLoading(false);
+      setLoadingMore(false);
     } catch (err) {
       if (err.name === 'ExpiredSignatureError') {
         setError('Your session has expired. Please sign in again.');
@@ -38,15 +42,17 @@ function IncomingInvoices() {
         setError('Failed to fetch invoices');
       }
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
-  const handleInvoiceClick = (id) => {
-    navigate(`/edit-incoming-invoice/${id}`);
+  const handleLoadMore = () => {
+    setLoadingMore(true);
+    fetchInvoices(nextCursor);
   };
 
-  const calculateTotalPrice = (items) => {
-    return items.reduce((total, item) => total + (item.total_price || 0), 0).toFixed(2);
+  const handleInvoiceClick = (id) => {
+    navigate(`/edit-incoming-invoice/${id}`);
   };
 
   if (loading) return <div>Loading...</div>;
@@ -85,11 +91,18 @@ function IncomingInvoices() {
               <td>{invoice.operationType}</td>
               <td>{invoice.supplierName}</td>
               <td>{invoice.contractNumber}</td>
-              <td>{calculateTotalPrice(invoice.items)}</td>
+              <td>{Number(invoice.total_amount).toFixed(2)}</td>
             </tr>
           ))}
         </tbody>
       </table>
+      {nextCursor && (
+        <Box sx={{ mt: 2 }}>
+          <Button variant="outlined" onClick={handleLoadMore} disabled={loadingMore}>
+            {loadingMore ? 'Loading...' : 'Load more'}
+          </Button>
+        </Box>
+      )}
     </div>
   );
 }
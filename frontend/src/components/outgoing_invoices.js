@@ -9,17 +9,19 @@ function OutgoingInvoices() {
   const [invoices, setInvoices] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const navigate = useNavigate();
 
   useEffect(() => {
     fetchInvoices();
   }, []);
 
-  const fetchInvoices = async () => {
+  const fetchInvoices = async (after) => {
     try {
-      const data = await getOutgoingInvoices();
+      const { items, nextCursor: cursor } = await getOutgoingInvoices(after);
       const invoicesWithData = await Promise.all(
-        data.map(async (invoice) => {
+        items.map(async (invoice) => {
           const customer = await getCustomer(invoice.customer_id);
           const contract = await getContract(invoice.contract_id);
           return { ...invoice, customerName: customer.name,
@@ -27,8 +29,10 @@ function OutgoingInvoices() {
           };
         })
       );
-      setInvoices(invoicesWithData);
+      setInvoices((loaded) => (after ? loaded.concat(invoicesWithData) : invoicesWithData));
+      setNextCursor(cursor);
       setLoading(false);
+      setLoadingMore(false);
     } catch (err) {
       if (err.name === 'ExpiredSignatureError') {
         setError('Your session has expired. Please sign in again.');
@@ -36,15 +40,17 @@ function OutgoingInvoices() {
         setError('Failed to fetch invoices');
       }
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
-  const handleInvoiceClick = (id) => {
-    navigate(`/edit-outgoing-invoice/${id}`);
+  const handleLoadMore = () => {
+    setLoadingMore(true);
+    fetchInvoices(nextCursor);
   };
 
-  const calculateTotalPrice = (items) => {
-    return items.reduce((total, item) => total + (item.total_price || 0), 0).toFixed(2);
+  const handleInvoiceClick = (id) => {
+    navigate(`/edit-outgoing-invoice/${id}`);
   };
 
   if (loading) return <div>Loading...</div>;
@@ -83,11 +89,18 @@ function OutgoingInvoices() {
               <td>{invoice.number}</td>
               <td>{invoice.customerName}</td>
               <td>{invoice.contractNumber}</td>
-              <td>{calculateTotalPrice(invoice.items)}</td>
+              <td>{Number(invoice.total_amount).toFixed(2)}</td>
             </tr>
           ))}
         </tbody>
       </table>
+      {nextCursor && (
+        <Box sx={{ mt: 2 }}>
+          <Button variant="outlined" onClick={handleLoadMore} disabled={loadingMore}>
+            {loadingMore ? 'Loading...' : 'Load more'}
+          </Button>
+        </Box>
+      )}
     </div>
   );
 }
@@ -34,6 +34,32 @@ api.interceptors.response.use(
 const getToken = () => localStorage.getItem('token');
 const getRefreshToken = () => localStorage.getItem('refresh_token');
 
+// List endpoints return one page at a time; the cursor of the next page
+// comes back in the X-Next-Cursor header.
+const PAGE_SIZE = 1000;
+
+const getPage = async (url, params = {}) => {
+  const response = await api.get(url, {
+    params,
+    headers: {
+      'Authorization': `Bearer ${getToken()}`
+    }
+  });
+  return { items: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+};
+
+// Follows the cursors to the last page, for dropdowns that need every row.
+const getAllPages = async (url, params = {}) => {
+  let items = [];
+  let after;
+  do {
+    const page = await getPage(url, { ...params, limit: PAGE_SIZE, after });
+    items = items.concat(page.items);
+    after = page.nextCursor;
+  } while (after);
+  return items;
+};
+
 const refreshToken = async () => {
   const response = await axios.post(`${API_URL}/user/refresh`, null, {
     headers: {
@@ -69,22 +95,12 @@ export const registerUser = async (username, email, password) => {
     }
   };
 
-export const getIncomingInvoices = async () => {
-  const response = await api.get('/incoming-invoices/', {
-    headers: {
-      'Authorization': `Bearer ${getToken()}`
-    }
-  });
-  return response.data;
+export const getIncomingInvoices = async (after) => {
+  return getPage('/incoming-invoices/', { include: '', after });
 };
 
-export const getOutgoingInvoices = async () => {
-  const response = await api.get('/outgoing-invoices/', {
-    headers: {
-      'Authorization': `Bearer ${getToken()}`
-    }
-  });
-  return response.data;
+export const getOutgoingInvoices = async (after) => {
+  return getPage('/outgoing-invoices/', { include: '', after });
 };
 
 export const getIncomingInvoiceItems = async (invoiceId) => {
@@ -115,12 +131,7 @@ export const createIncomingInvoiceItem = async (itemData) => {
 };
 
 export const getSuppliers = async () => {
-  const response = await api.get('/suppliers/', {
-    headers: {
-      'Authorization': `Bearer ${getToken()}`
-    }
-  });
-  return response.data;
+  return getAllPages('/suppliers/');
 };
 
 export const getSupplier = async (id) => {
@@ -138,39 +149,19 @@ export const getSupplier = async (id) => {
   };
 
 export const getOrganizations = async () => {
-  const response = await api.get('/organizations/', {
-    headers: {
-      'Authorization': `Bearer ${getToken()}`
-    }
-  });
-  return response.data;
+  return getAllPages('/organizations/');
 };
 
 export const getStorages = async () => {
-  const response = await api.get('/storages/', {
-    headers: {
-      'Authorization': `Bearer ${getToken()}`
-    }
-  });
-  return response.data;
+  return getAllPages('/storages/');
 };
 
 export const getEmployees = async () => {
-  const response = await api.get('/employees/', {
-    headers: {
-      'Authorization': `Bearer ${getToken()}`
-    }
-  });
-  return response.data;
+  return getAllPages('/employees/');
 };
 
 export const getProducts = async () => {
-  const response = await api.get('/products/', {
-    headers: {
-      'Authorization': `Bearer ${getToken()}`
-    }
-  });
-  return response.data;
+  return getAllPages('/products/');
 };
 
 export const updateInvoice = async (id, data) => {
@@ -246,12 +237,7 @@ export const createOutgoingInvoice = async (invoice) => {
 };
 
 export const getCustomers = async () => {
-  const response = await api.get('/customers/', {
-    headers: {
-      'Authorization': `Bearer ${getToken()}`
-    }
-  });
-  return response.data;
+  return getAllPages('/customers/');
 };
 
 export const getCustomer = async (id) => {
@@ -302,21 +288,11 @@ export const getCustomer = async (id) => {
   };
 
   export const getContracts = async () => {
-    const response = await api.get('/contracts/', {
-      headers: {
-        'Authorization': `Bearer ${getToken()}`
-      }
-    });
-    return response.data;
+    return getAllPages('/contracts/');
   };
 
   export const getOperations = async () => {
-    const response = await api.get('/operations/', {
-      headers: {
-        'Authorization': `Bearer ${getToken()}`
-      }
-    });
-    return response.data;
+    return getAllPages('/operations/');
   };
 
   export const getContract = async (id) => {